@@ -1,2 +1,8 @@
-﻿import bciserver
-bciserver.main()
+﻿import multiprocessing
+import bciserver
+
+# Training jobs run in worker processes, which import this module again on
+# Windows. Only the original process may start the server.
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    bciserver.main()
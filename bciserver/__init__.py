@@ -1,4 +1,4 @@
-﻿from engine import main
-import classifiers
-import eegdevices
-import bci_exceptions
+﻿from engine import main
+import classifiers
+import eegdevices
+import bci_exceptions
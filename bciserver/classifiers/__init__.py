@@ -1,8 +1,12 @@
-'''
-Collection of BCI classifiers
-'''
-from ssvep import SSVEP
-from ssvep_single import SSVEPSingle
-from p3002 import P300
-from erp_plotter import ERPPlotter
-available_classifiers = {'ssvep':SSVEP, 'ssvep-single':SSVEPSingle, 'p300':P300, 'erp-plotter':ERPPlotter}
+'''
+Collection of BCI classifiers
+'''
+from ..eegdevices.registry import Registry
+
+# Classifiers are only imported when they are selected
+available_classifiers = Registry(__name__, 'Classifiers')
+available_classifiers.register('ssvep', 'ssvep', 'SSVEP')
+available_classifiers.register('ssvep-single', 'ssvep_single', 'SSVEPSingle')
+available_classifiers.register('p300', 'p3002', 'P300')
+available_classifiers.register('p300-dynamic', 'p300', 'P300')
+available_classifiers.register('erp-plotter', 'erp_plotter', 'ERPPlotter')
@@ -1,215 +1,539 @@
-﻿import threading
-import logging
-import cStringIO
-import base64
-
-class Classifier(threading.Thread):
-    '''
-    Base class for classifiers. A classifier acts as a consumer of the data
-    produced by a Recorder class. It has 4 states:
-
-      'idle': classifier does absolutely nothing. Begin state.
-      'data-collect': classifier is quietly collecting data without acting on
-                      it. This state is used for collecting training data.
-      'training': classifier is performing demanting computations on the
-                  training data collected in the 'data-collect' state.
-      'application': classifier is consuming new data and producing
-                     classifiication results.
-
-    The method change_state() is called whenever a state change is requested.
-    The classifier calls Engine.provide_mode() to inform the engine whenever
-    the classifier changes states. One typical use of these functions is the
-    engine first calling change_state('training'), to which the classifier
-    almost immediately responds with Engine.provide_mode('training') to indicate
-    the classifier has begun the classifier training. When training is complete
-    the classifier will call Engine.provide_mode('idle') to inform the engine
-    it has finished and is now in 'idle' mode. This functionality is provided
-    by this base class.
-
-    When implementing a new classifier subclass, three methods need to be
-    implemented:
-
-      __init__: The class constructor. Make sure to call Classifier.__init__
-                from within this constructor to initialize the base class.
-                Initialize your classifier pipeline here.
-      _train: Called when the classifier switched to 'training' mode. Call
-              the train() method of the classifier pipeline here.
-      _apply: Called when the classifier is in 'application' mode and some new
-              data just arrived ready for classification. Call
-              Engine.provide_classifier_result here to pass classification
-              results to the engine, which in turn shall pass it on to the
-              client.
-      set_parameter: Called whenever the client is setting parameters of the
-                     classifier.
-      get_parameter: Called whenever the client is requesting parameters from
-                     the classifier.
-    '''
-
-    def __init__(self, engine, recorder):
-        threading.Thread.__init__(self)
-
-        # Initialize event to signal the classifier to switch states
-        self.state_event = threading.Event()
-
-        # Initialize log system
-        self.logger = logging.getLogger('Classifier')
-
-        self.recorder = recorder
-        self.engine = engine
-        self.running = False
-
-        self._reset() 
-
-    def _reset(self):
-        """ Reset the classifier. Flushes all collected data."""
-        self.application_data = None
-        self.state = 'idle'
-        self.prev_state = self.state
-        self.state_event.clear()
-        self.training_complete = False
-
-    def change_state(self, new_state):
-        """ Changes the state of the classifier to one of:
-        'idle', 'data-collect', 'training', 'application'
-        """
-
-        assert (new_state == 'idle' or
-                new_state == 'data-collect' or
-                new_state == 'training' or
-                new_state == 'application')
-
-        self.prev_state = self.state
-        self.state = new_state
-        self.state_event.set()
-        self.logger.info('Changing state to %s' % new_state)
-
-    def _train(self):
-        """ Train the classifier on a dataset. """
-        pass
-
-    def _apply(self, d):
-        """ Apply the classifier on a dataset. """
-        pass
-
-    def pause_classifier(self):
-        """ Pause the classifier while in application mode. To unpause, call
-        either data-collect() or apply_classifier()."""
-        self.recorder.stop_capture()
-
-    def run(self):
-        assert self.recorder.running
-
-        self.running = True
-        while(self.running and self.recorder.running):
-
-            if self.state_event.is_set():
-                self.state_event.clear()
-
-            if self.state == 'idle':
-                self.recorder.stop_capture()
-
-                self.engine.provide_mode('idle')
-                self.state_event.wait()
-
-            elif self.state == 'data-collect':
-                if self.prev_state != 'data-collect':
-                    self.recorder.flush()
-
-                self.recorder.calibrated_event.wait()
-
-                # Start capturing training data
-                self.recorder.start_capture()
-
-                self.engine.provide_mode('data-collect')
-                self.state_event.wait()
-
-            elif self.state == 'training':
-                # Stop capturing training data
-                self.recorder.stop_capture()
-
-                self.engine.provide_mode('training')
-
-                # Train on the recorded data
-                try:
-                    d = self.recorder.read(block=False)
-                    self._train(d)
-                except Exception as e:
-                    self.logger.error(e)
-                    self.engine.error(e)
-
-                # Turn back to idle state
-                self.change_state('idle')
-
-            elif self.state == 'application':
-                if not self.training_complete:
-                    self.logger.error('Cannot go into application state without'
-                                      'proper training!')
-                    self.change_state('idle')
-                    continue
-
-                # Flush previously stored application data
-                if self.prev_state != 'application':
-                    self.application_data = None
-                    self.engine.provide_mode('application')
-
-                while not self.state_event.is_set():
-                    # Record data
-                    self.recorder.start_capture()
-                    d = self.recorder.read()
-
-                    # Received data could be None for various reasons, recorder did not record
-                    # anything yet, recorder was killed somewhere, etc.
-                    if d == None:
-                        continue
-
-                    self.logger.info('Received data packet of length %d' % d.ninstances)
-
-                    # Apply classifier to data
-                    self._apply(d)
-            else:
-                self.logger.warning('Classifier in invalid state: %s' % self.state)
-                self.state_event.wait()
-
-    def stop(self):
-        """
-        Make the classifier stop collecting data. Works in training as well as
-        application mode.  This will terminate the thread, which cannot be
-        restarted. If you want to continue collecting data at a later stage,
-        use the pause() function instead.
-        """
-        self.logger.info('Stopping classifier')
-        self.running = False
-        self.change_state('idle')
-
-        # Abort the threads waiting for data
-        self.recorder.data_condition.acquire()
-        self.recorder.data_condition.notifyAll()
-        self.recorder.data_condition.release()
-
-        if self.isAlive():
-            self.join()
-        self.logger.info('Classifier stopped')
-
-    def _generate_debug_image(self, d):
-        """ Override this to make your classifier generate an image that is
-        send to the client after training is complete. """
-        return None
-
-    def _send_debug_image(self, d):
-        """ Send a PNG image describing the training data to client. """
-        fig = self._generate_debug_image(d)
-        if fig is None:
-            return
-
-        # Save a snapshot to disk
-        fig.savefig('classifier_output.png', format='png')
-
-        buf = cStringIO.StringIO()
-        fig.savefig(buf, format='png')
-        self.engine.provide_result( ['training-result', base64.b64encode(buf.getvalue())] )
-
-    def set_parameter(self, name, value):
-        return False
-
-    def get_parameter(self, name):
-        return False
+﻿import threading
+import logging
+import cStringIO
+import base64
+import Queue
+import cPickle
+
+from ..bci_exceptions import ClassifierException
+from ..eegdevices import precision_timer
+
+class DebugImageRenderer(threading.Thread):
+    """
+    Renders the debug images of the classifiers in the background, so a
+    classifier can return to work as soon as training is complete. Matplotlib
+    is not thread safe, so all images are rendered by this single thread.
+    """
+
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.jobs = Queue.Queue()
+        self.logger = logging.getLogger('Classifier')
+
+    def run(self):
+        while True:
+            classifier, d, dpi = self.jobs.get()
+            try:
+                self._render(classifier, d, dpi)
+            except Exception as e:
+                self.logger.error('Could not render debug image: %s' % e)
+
+    def _render(self, classifier, d, dpi):
+        import matplotlib.pyplot as plt
+
+        fig = classifier._generate_debug_image(d)
+        if fig is None:
+            return
+
+        buf = cStringIO.StringIO()
+        fig.savefig(buf, format='png', dpi=dpi)
+        plt.close(fig)
+        png = buf.getvalue()
+
+        # Save a snapshot to disk
+        with open(classifier.output_path('classifier_output.png'), 'wb') as f:
+            f.write(png)
+
+        classifier.engine.provide_debug_image( base64.b64encode(png) )
+
+_renderer = None
+_renderer_lock = threading.Lock()
+
+def _get_renderer():
+    """ Returns the debug image renderer, starting it if necessary. """
+    global _renderer
+    _renderer_lock.acquire()
+    if _renderer == None:
+        _renderer = DebugImageRenderer()
+        _renderer.start()
+    _renderer_lock.release()
+    return _renderer
+
+# Version of the file format written by Classifier.save_model()
+MODEL_VERSION = 2
+
+def read_model(path):
+    """ Read a model written by Classifier.save_model(). Returns a dictionary
+    with the keys 'classifier' (the name the classifier is registered under),
+    'sample_rate' and 'channels' (the device configuration the classifier was
+    trained for) and 'attributes' (the trained classifier itself). """
+    try:
+        with open(path, 'rb') as f:
+            model = cPickle.load(f)
+    except IOError as e:
+        raise ClassifierException('Could not read model: %s' % e.strerror)
+    except Exception:
+        # Unpickling garbage can fail in many ways
+        raise ClassifierException('Could not read model: not a model file.')
+
+    if type(model) != dict or model.get('version') != MODEL_VERSION:
+        raise ClassifierException('Model was saved by an incompatible version.')
+    return model
+
+class Classifier(threading.Thread):
+    '''
+    Base class for classifiers. A classifier acts as a consumer of the data
+    produced by a Recorder class. It has 4 states:
+
+      'idle': classifier does absolutely nothing. Begin state.
+      'data-collect': classifier is quietly collecting data without acting on
+                      it. This state is used for collecting training data.
+      'training': classifier is performing demanting computations on the
+                  training data collected in the 'data-collect' state.
+      'application': classifier is consuming new data and producing
+                     classifiication results.
+
+    The method change_state() is called whenever a state change is requested.
+    The classifier calls Engine.provide_mode() to inform the engine whenever
+    the classifier changes states. One typical use of these functions is the
+    engine first calling change_state('training'), to which the classifier
+    almost immediately responds with Engine.provide_mode('training') to indicate
+    the classifier has begun the classifier training. When training is complete
+    the classifier will call Engine.provide_mode('idle') to inform the engine
+    it has finished and is now in 'idle' mode. This functionality is provided
+    by this base class.
+
+    When implementing a new classifier subclass, three methods need to be
+    implemented:
+
+      __init__: The class constructor. Make sure to call Classifier.__init__
+                from within this constructor to initialize the base class.
+                Initialize your classifier pipeline here.
+      _train: Called when the classifier switched to 'training' mode. Call
+              the train() method of the classifier pipeline here.
+      _apply: Called when the classifier is in 'application' mode and some new
+              data just arrived ready for classification. Call
+              Engine.provide_classifier_result here to pass classification
+              results to the engine, which in turn shall pass it on to the
+              client.
+      set_parameter: Called whenever the client is setting parameters of the
+                     classifier.
+      get_parameter: Called whenever the client is requesting parameters from
+                     the classifier.
+
+    Classifiers with a lengthy training procedure can run it in a worker
+    process by calling _train_in_background() from _train(). The classifier
+    thread is then free to serve the client, which receives PROGRESS messages
+    while the training is running. The client may switch to 'application'
+    mode in the meantime to keep using the previous model. When the training
+    is done, the new model is swapped in between two calls to _apply().
+
+    A trained classifier can be saved to disk and loaded again later, see
+    save_model() and load_model(). Subclasses list the attributes that make
+    up the trained classifier, including the parameters it was trained with,
+    in model_attributes. These must be picklable, so use module level
+    functions and classes (see filters.py) instead of lambdas in the pipeline.
+
+    After training, a classifier can send an image describing the training
+    data to the client by calling _send_debug_image(). The image is rendered
+    in the background by _generate_debug_image(), which must therefore not
+    touch the classifier pipeline. Any computations on the pipeline should be
+    done in _prepare_debug_image(), which runs on the classifier thread.
+    The parameters 'debug_image' (0 to skip the image) and 'debug_image_dpi'
+    (resolution of the image) are handled by this base class, so subclasses
+    should call Classifier.set_parameter and Classifier.get_parameter first.
+    '''
+
+    # Attributes that are saved by save_model(). Classifiers that leave this
+    # empty can not be saved.
+    model_attributes = []
+
+    def __init__(self, engine, recorder):
+        threading.Thread.__init__(self)
+
+        # Initialize event to signal the classifier to switch states
+        self.state_event = threading.Event()
+
+        # Initialize log system
+        self.logger = logging.getLogger('Classifier')
+
+        self.recorder = recorder
+        self.engine = engine
+        self.running = False
+
+        self.debug_image = 1
+        self.debug_image_dpi = 100
+
+        # Statistics, see get_stats()
+        self.packets_applied = 0
+        self.apply_latency = 0.0
+        self.apply_latency_mean = 0.0
+        self.apply_latency_max = 0.0
+        self.training_time = 0.0
+
+        # Training running in a worker process, see _train_in_background()
+        self.training_job = None
+        self.save_thread = None
+        self.model_lock = threading.Lock()
+
+        self._reset() 
+
+    def _reset(self):
+        """ Reset the classifier. Flushes all collected data."""
+        self.application_data = None
+        self.state = 'idle'
+        self.prev_state = self.state
+        self.state_event.clear()
+        self.training_complete = False
+
+    def change_state(self, new_state):
+        """ Changes the state of the classifier to one of:
+        'idle', 'data-collect', 'training', 'application'
+        """
+
+        assert (new_state == 'idle' or
+                new_state == 'data-collect' or
+                new_state == 'training' or
+                new_state == 'application')
+
+        self.prev_state = self.state
+        self.state = new_state
+        self.state_event.set()
+        self.logger.info('Changing state to %s' % new_state)
+
+    def _train(self):
+        """ Train the classifier on a dataset. """
+        pass
+
+    def _apply(self, d):
+        """ Apply the classifier on a dataset. """
+        pass
+
+    def pause_classifier(self):
+        """ Pause the classifier while in application mode. To unpause, call
+        either data-collect() or apply_classifier()."""
+        self.recorder.stop_capture()
+
+    def run(self):
+        assert self.recorder.running
+
+        self.running = True
+        while(self.running and self.recorder.running):
+
+            if self.state_event.is_set():
+                self.state_event.clear()
+
+            if self.state == 'idle':
+                self.recorder.stop_capture()
+
+                self.engine.provide_mode('idle')
+                self.state_event.wait()
+
+            elif self.state == 'data-collect':
+                if self.prev_state != 'data-collect':
+                    self.recorder.flush()
+
+                self.recorder.calibrated_event.wait()
+
+                # Start capturing training data
+                self.recorder.start_capture()
+
+                self.engine.provide_mode('data-collect')
+                self.state_event.wait()
+
+            elif self.state == 'training':
+                # Stop capturing training data
+                self.recorder.stop_capture()
+
+                self.engine.provide_mode('training')
+
+                # Train on the recorded data. Only a limited number of
+                # classifiers may train at the same time, across all sessions.
+                self._cancel_training()
+                if not self._acquire_training_slot():
+                    continue
+                job = self.training_job
+                try:
+                    d = self.recorder.read(block=False)
+                    t = precision_timer()
+                    self._train(d)
+                    self.training_time = precision_timer() - t
+                except Exception as e:
+                    self.logger.error(e)
+                    self.engine.error(e)
+                finally:
+                    # A job running in the background holds on to the slot
+                    # until it is done
+                    if self.training_job is job:
+                        self.engine.training_slots.release()
+
+                if self.training_job is job:
+                    # Turn back to idle state
+                    self.change_state('idle')
+                else:
+                    # Training continues in the background and turns back to
+                    # idle state when done, unless the client switched to
+                    # another mode in the meantime.
+                    self.state_event.wait()
+
+            elif self.state == 'application':
+                if not self.training_complete:
+                    self.logger.error('Cannot go into application state without'
+                                      'proper training!')
+                    self.change_state('idle')
+                    continue
+
+                # Flush previously stored application data
+                if self.prev_state != 'application':
+                    self.application_data = None
+                    self.engine.provide_mode('application')
+
+                while not self.state_event.is_set():
+                    # Record data
+                    self.recorder.start_capture()
+                    d = self.recorder.read()
+
+                    # Received data could be None for various reasons, recorder did not record
+                    # anything yet, recorder was killed somewhere, etc.
+                    if d == None:
+                        continue
+
+                    self.logger.info('Received data packet of length %d' % d.ninstances)
+
+                    # Apply classifier to data
+                    t = precision_timer()
+                    self.model_lock.acquire()
+                    try:
+                        self._apply(d)
+                    finally:
+                        self.model_lock.release()
+                    self._update_latency(precision_timer() - t)
+            else:
+                self.logger.warning('Classifier in invalid state: %s' % self.state)
+                self.state_event.wait()
+
+    def stop(self):
+        """
+        Make the classifier stop collecting data. Works in training as well as
+        application mode.  This will terminate the thread, which cannot be
+        restarted. If you want to continue collecting data at a later stage,
+        use the pause() function instead.
+        """
+        self.logger.info('Stopping classifier')
+        self.running = False
+        self._cancel_training()
+        self.change_state('idle')
+
+        # Abort the threads waiting for data
+        self.recorder.data_condition.acquire()
+        self.recorder.data_condition.notifyAll()
+        self.recorder.data_condition.release()
+
+        if self.isAlive():
+            self.join()
+        self.logger.info('Classifier stopped')
+
+    def _acquire_training_slot(self):
+        """ Wait until this classifier may start training. Returns False,
+        without a slot, if the client switched to another mode or the
+        classifier was stopped in the meantime. """
+        slots = self.engine.training_slots
+        while True:
+            if slots.acquire(False):
+                if self.running and not self.state_event.is_set():
+                    return True
+                slots.release()
+                return False
+
+            if not self.running or self.state_event.is_set():
+                return False
+            self.state_event.wait(0.1)
+
+    def _train_in_background(self, function, args, install):
+        """ Run function(*args) in a worker process, see TrainingJob. When it
+        is done, install(result) is called to put the new model in place. It
+        is never called while _apply() is running. """
+        # Imported here, so classifiers that train in the foreground don't
+        # pull in sklearn
+        from training import TrainingJob
+
+        self.training_job = TrainingJob(function, args,
+                                        self.engine.training_slots,
+                                        self._training_progress,
+                                        lambda job, result: self._training_done(job, install, result),
+                                        self._training_failed)
+        self.training_job.start()
+
+    def _cancel_training(self):
+        """ Abort the training running in the background, if any. """
+        job = self.training_job
+        if job and not job.finished.is_set():
+            self.logger.info('Cancelling training')
+            job.cancel()
+
+    def _training_progress(self, fraction, elapsed, remaining):
+        self.engine.provide_progress(fraction, elapsed, remaining)
+
+    def _training_done(self, job, install, result):
+        try:
+            self.model_lock.acquire()
+            try:
+                install(result)
+            finally:
+                self.model_lock.release()
+            self.training_time = job.elapsed
+        except Exception as e:
+            self.logger.error(e)
+            self.engine.error(e)
+        self._training_finished(job)
+
+    def _training_failed(self, job, message):
+        self.logger.error('Training failed: %s' % message)
+        self.engine.error(ClassifierException('Training failed: %s' % message))
+        self._training_finished(job)
+
+    def _training_finished(self, job):
+        if self.state == 'training' and self.training_job is job:
+            # Turn back to idle state
+            self.change_state('idle')
+
+    def _save_training_data(self, d):
+        """ Save a snapshot of the training data to disk. Saving happens in
+        the background, so training doesn't have to wait for the disk. """
+        if self.save_thread:
+            self.save_thread.join()
+
+        self.save_thread = threading.Thread(target=self._save_dataset,
+                                            args=(d, self.output_path('test_data.dat')))
+        self.save_thread.start()
+
+    def _save_dataset(self, d, path):
+        try:
+            d.save(path)
+        except Exception as e:
+            self.logger.error('Could not save training data: %s' % e)
+
+    def save_model(self, path, name):
+        """ Save the trained classifier, together with the configuration of
+        the recording device it was trained for. name is the name the
+        classifier is registered under. """
+        if not self.model_attributes:
+            raise ClassifierException('This classifier can not be saved.')
+        if not self.training_complete:
+            raise ClassifierException('Please train the classifier before saving it.')
+
+        self.model_lock.acquire()
+        try:
+            model = {
+                'version': MODEL_VERSION,
+                'classifier': name,
+                'sample_rate': self.recorder.sample_rate,
+                'channels': list(self.recorder.feat_lab),
+                'attributes': dict([(attr, getattr(self, attr))
+                                    for attr in self.model_attributes]),
+            }
+            data = cPickle.dumps(model, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            self.model_lock.release()
+
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.logger.info('Saved model to %s' % path)
+
+    def load_model(self, model):
+        """ Replace the classifier with a model returned by read_model(). The
+        model must have been trained for the same sample rate and channels as
+        the current recording device. Afterwards, the classifier is ready for
+        application. """
+        if not self.model_attributes:
+            raise ClassifierException('This classifier can not be loaded.')
+        if self.state != 'idle':
+            raise ClassifierException('Can only load a model in idle mode.')
+        if model['sample_rate'] != self.recorder.sample_rate:
+            raise ClassifierException('Model was trained at %s Hz, but the device records at %s Hz.' %
+                                      (model['sample_rate'], self.recorder.sample_rate))
+        if model['channels'] != list(self.recorder.feat_lab):
+            raise ClassifierException('Model was trained on channels %s, but the device records %s.' %
+                                      (', '.join(model['channels']), ', '.join(self.recorder.feat_lab)))
+
+        self._cancel_training()
+        self.model_lock.acquire()
+        try:
+            # Attributes added to the classifier after the model was saved
+            # keep their current value
+            for attr in self.model_attributes:
+                if attr in model['attributes']:
+                    setattr(self, attr, model['attributes'][attr])
+            self._reset()
+            self.training_complete = True
+        finally:
+            self.model_lock.release()
+        self.logger.info('Loaded model')
+
+    def output_path(self, filename):
+        """ Returns the path of an output file in the output directory of the
+        session. """
+        return self.recorder.output_path(filename)
+
+    def _update_latency(self, latency):
+        self.packets_applied += 1
+        self.apply_latency = latency
+        self.apply_latency_max = max(self.apply_latency_max, latency)
+        if self.packets_applied == 1:
+            self.apply_latency_mean = latency
+        else:
+            # Exponential moving average over roughly the last 20 packets
+            self.apply_latency_mean += 0.05 * (latency - self.apply_latency_mean)
+
+    def get_stats(self):
+        """ Returns a list of (name, value) pairs describing the state of the
+        classifier. Latencies are in seconds. """
+        return [('packets_applied', self.packets_applied),
+                ('apply_latency', self.apply_latency),
+                ('apply_latency_mean', self.apply_latency_mean),
+                ('apply_latency_max', self.apply_latency_max),
+                ('training_time', self.training_time)]
+
+    def _prepare_debug_image(self, d):
+        """ Override this to perform any computations needed for the debug
+        image that can't be done in the background. Runs on the classifier
+        thread, the return value is passed to _generate_debug_image(). """
+        return d
+
+    def _generate_debug_image(self, d):
+        """ Override this to make your classifier generate an image that is
+        send to the client after training is complete. Runs in the background.
+        """
+        return None
+
+    def _send_debug_image(self, d):
+        """ Send a PNG image describing the training data to client. The image
+        is rendered and send in the background. """
+        if not self.debug_image:
+            return
+
+        d = self._prepare_debug_image(d)
+        _get_renderer().jobs.put( (self, d, self.debug_image_dpi) )
+
+    def set_parameter(self, name, value):
+        if name == 'debug_image':
+            if len(value) < 1 or type(value[0]) != int:
+                raise ClassifierException('Value for debug_image must be 0 or 1.')
+            self.debug_image = value[0]
+            return True
+
+        elif name == 'debug_image_dpi':
+            if len(value) < 1 or (type(value[0]) != int and type(value[0]) != float) or value[0] <= 0:
+                raise ClassifierException('Value for debug_image_dpi must be a positive number.')
+            self.debug_image_dpi = value[0]
+            return True
+
+        return False
+
+    def get_parameter(self, name):
+        if name == 'debug_image':
+            return self.debug_image
+        elif name == 'debug_image_dpi':
+            return self.debug_image_dpi
+        return False
@@ -0,0 +1,118 @@
+import numpy
+import psychic
+
+class FilterBankCCA(psychic.nodes.BaseNode):
+    """
+    Scores windows of data for SSVEP responses with filter bank canonical
+    correlation analysis:
+
+    Chen, X., Wang, Y., Gao, S., Jung, T.-P., Gao, X. (2015). Filter bank
+    canonical correlation analysis for implementing a high-speed SSVEP-based
+    brain-computer interface. Journal of Neural Engineering, 12(4).
+
+    The input are windows of data that have been split into sub-bands by an
+    OnlineFilterBank followed by an OnlineSlidingWindow. For each window, the
+    canonical correlation between each sub-band and the references of each
+    frequency is computed, all in one go. The score of a frequency is the
+    weighted sum of the squared correlations, with weights that favour the
+    lower sub-bands. The output has a feature for each frequency.
+    """
+
+    def __init__(self, templates, nbands, a=1.25, b=0.25):
+        """
+        templates - ReferenceTemplates for the windows, see templates.py
+        nbands    - number of sub-bands in the data
+        a, b      - the weight of sub-band n (counting from 1) is n^-a + b
+        """
+        psychic.nodes.BaseNode.__init__(self)
+        self.templates = templates
+        self.nbands = nbands
+        self.weights = numpy.arange(1, nbands + 1) ** -float(a) + b
+
+    def train_(self, d):
+        pass
+
+    def correlations(self, X):
+        """ The largest canonical correlations of windows of data, given as
+        an array of (windows x bands x channels x samples), with the
+        references of each frequency. Returns an array of (windows x bands x
+        frequencies). """
+        X = X - numpy.mean(X, axis=3)[...,numpy.newaxis]
+        nchannels = X.shape[2]
+
+        # Whiten the data of each band in each window. The bases of the
+        # references are orthonormal already.
+        Cxx = numpy.einsum('wbcs,wbds->wbcd', X, X)
+        ridge = 1e-10 * numpy.trace(Cxx, axis1=2, axis2=3) / nchannels + 1e-300
+        Cxx += ridge[...,numpy.newaxis,numpy.newaxis] * numpy.eye(nchannels)
+        L = numpy.linalg.cholesky(Cxx)
+
+        # (windows x bands x frequencies x channels x references)
+        P = numpy.einsum('wbcs,fsr->wbfcr', X, self.templates.Q)
+        K = numpy.linalg.solve(L[:,:,numpy.newaxis], P)
+        rho = numpy.linalg.svd(K, compute_uv=False)[...,0]
+        return numpy.clip(rho, 0, 1)
+
+    def apply_(self, d):
+        nsamples = d.data.shape[1]
+        X = d.data.reshape(self.nbands, -1, nsamples, d.ninstances)
+        X = X.transpose(3, 0, 1, 2)
+
+        rho = self.correlations(X)
+        scores = numpy.einsum('b,wbf->fw', self.weights, rho ** 2)
+        return psychic.DataSet(data=scores, labels=d.labels, ids=d.ids)
+
+if __name__ == '__main__':
+    # Time the filter bank and the scoring on 8 channels at 200 Hz with 4
+    # stimulus frequencies and 5 sub-bands, with the default SSVEP windows of
+    # 2 seconds every 0.5 seconds and data arriving in blocks of 1/20 second.
+    # Run as: python -m bciserver.classifiers.fbcca
+    import time
+    from filters import OnlineFilterBank
+    from templates import reference_templates
+
+    sample_rate = 200
+    freqs = [60/4., 60/5., 60/6., 60/7.]
+    nharmonics = 3
+    nchannels = 8
+    bands = [(8 * n - 2, 90) for n in range(1, 6)]
+    window_size = 2 * sample_rate
+    window_step = sample_rate // 2
+    nsamples = 5 * 60 * sample_rate
+    chunk = sample_rate // 20
+
+    rng = numpy.random.RandomState(0)
+    t = numpy.arange(nsamples) / float(sample_rate)
+    data = rng.randn(nchannels, nsamples) + 0.3 * numpy.sin(2 * numpy.pi * freqs[2] * t)
+
+    filterbank = OnlineFilterBank(4, bands)
+    filterbank.design(sample_rate)
+    start = time.time()
+    filtered = []
+    for i in range(0, nsamples, chunk):
+        d = psychic.DataSet(data=data[:,i:i+chunk], labels=numpy.zeros((1, chunk)),
+                            ids=numpy.atleast_2d(t[i:i+chunk]))
+        filtered.append(filterbank.apply_(d).data)
+    filtered = numpy.hstack(filtered)
+    t_filter = (time.time() - start) / (nsamples // chunk)
+
+    templates = reference_templates(sample_rate, freqs, nharmonics, window_size)
+    node = FilterBankCCA(templates, len(bands))
+    ends = range(window_size, nsamples + 1, window_step)
+    windows = numpy.array([filtered[:,end - window_size:end] for end in ends])
+    windows = windows.reshape(len(ends), len(bands), nchannels, window_size)
+
+    start = time.time()
+    for window in windows:
+        node.correlations(window[numpy.newaxis])
+    t_window = (time.time() - start) / len(windows)
+
+    rho = node.correlations(windows)
+    scores = numpy.einsum('b,wbf->wf', node.weights, rho ** 2)
+    difference = numpy.max(numpy.abs(rho[0,:,:] -
+                                     [templates.canoncorr(band) for band in windows[0]]))
+
+    print 'Filter bank: %.3f ms per block of %d samples' % (1000 * t_filter, chunk)
+    print 'Scoring: %.3f ms per window (budget %d ms)' % (1000 * t_window, 1000 * window_step / sample_rate)
+    print 'Detected frequency: %s' % numpy.bincount(numpy.argmax(scores, axis=1), minlength=len(freqs))
+    print 'Difference with CCA of a single band: %g' % difference
@@ -0,0 +1,145 @@
+import threading
+
+import numpy
+import scipy.signal
+import psychic
+
+# Filter designs, shared by all classifiers and sessions. Designs are
+# immutable, so they can be handed out without copying.
+_designs = {}
+_designs_lock = threading.Lock()
+
+# The filters the classifiers use with their default parameters, as
+# (order, bandpass) pairs, and the sample rates of the supported devices
+COMMON_FILTERS = [(3, (0.5, 15)), (4, (2, 45)), (2, (8, 15))]
+COMMON_SAMPLE_RATES = [128, 256, 512, 1024, 2048]
+
+def design_filter(order, band, sample_rate, btype='bandpass', ftype='butter'):
+    """
+    Design an IIR filter as second-order sections, which are numerically
+    robust for narrow bands and high sample rates where the transfer function
+    representation breaks down. Designs are cached, so designing the same
+    filter again is cheap.
+
+    order       - order of the filter
+    band        - cutoff frequency in Hz, or [lo, hi] cutoff frequencies
+    sample_rate - sample rate of the data in Hz
+    btype       - type of filter: 'bandpass', 'lowpass', 'highpass' or
+                  'bandstop'
+    ftype       - type of IIR filter, see scipy.signal.iirfilter
+
+    Returns the sections as a read-only array, see scipy.signal.sosfilt.
+    """
+    if numpy.isscalar(band):
+        band = (float(band),)
+    else:
+        band = tuple([float(f) for f in band])
+    key = (ftype, btype, int(order), band, float(sample_rate))
+
+    _designs_lock.acquire()
+    try:
+        sos = _designs.get(key)
+        if sos is None:
+            nyquist = sample_rate / 2.0
+            sos = scipy.signal.iirfilter(order, [f / nyquist for f in band],
+                                         btype=btype, ftype=ftype, output='sos')
+            sos.flags.writeable = False
+            _designs[key] = sos
+    finally:
+        _designs_lock.release()
+
+    return sos
+
+def prewarm(filters=COMMON_FILTERS, sample_rates=COMMON_SAMPLE_RATES):
+    """ Design the given (order, bandpass) filters for the given sample rates
+    ahead of time, so training doesn't have to. """
+    for order, band in filters:
+        for sample_rate in sample_rates:
+            design_filter(order, band, sample_rate)
+
+class OnlineSOSFilter(psychic.nodes.BaseNode):
+    """
+    Applies an IIR bandpass filter to the data as it comes in, keeping the
+    state of the filter between calls, like psychic.nodes.OnlineFilter.
+    The filter is designed for the sample rate of the training data, using
+    design_filter(). Unlike OnlineFilter with a lambda, it can be pickled
+    along with the rest of the pipeline.
+    """
+
+    def __init__(self, order, bandpass):
+        """
+        order    - order of the filter
+        bandpass - [lo, hi] cutoff frequencies in Hz
+        """
+        psychic.nodes.BaseNode.__init__(self)
+        self.order = order
+        self.bandpass = (bandpass[0], bandpass[1])
+        self.sos = None
+        self.zi = None
+
+    def design(self, sample_rate):
+        """ Design the filter for the given sample rate, without training. """
+        # sosfilt() refuses read-only arrays, so take a copy of the design
+        self.sos = numpy.array(design_filter(self.order, self.bandpass, sample_rate))
+        self.zi = None
+
+    def reset(self):
+        """ Forget the state of the filter. """
+        self.zi = None
+
+    def train_(self, d):
+        self.design(psychic.get_samplerate(d))
+
+    def apply_(self, d):
+        if self.zi is None:
+            self.zi = numpy.zeros((self.sos.shape[0], d.nfeatures, 2))
+
+        X, self.zi = scipy.signal.sosfilt(self.sos, d.data, axis=1, zi=self.zi)
+        return psychic.DataSet(data=X, default=d)
+
+class OnlineFilterBank(psychic.nodes.BaseNode):
+    """
+    Splits the data into several frequency bands as it comes in, keeping the
+    state of the filters between calls. The output has the channels of the
+    first band, followed by the channels of the second band, and so on.
+
+    The bands are filtered one after the other, with a call to
+    scipy.signal.sosfilt for each band. sosfilt applies a single cascade of
+    sections to all channels, so the bands, which each have their own
+    cascade, can't share a call.
+    """
+
+    def __init__(self, order, bands):
+        """
+        order - order of the filters
+        bands - list of [lo, hi] cutoff frequencies in Hz, one for each band
+        """
+        psychic.nodes.BaseNode.__init__(self)
+        self.order = order
+        self.bands = [(band[0], band[1]) for band in bands]
+        self.sos = None
+        self.zi = None
+
+    def design(self, sample_rate):
+        """ Design the filters for the given sample rate, without training. """
+        self.sos = [numpy.array(design_filter(self.order, band, sample_rate))
+                    for band in self.bands]
+        self.zi = None
+
+    def reset(self):
+        """ Forget the state of the filters. """
+        self.zi = None
+
+    def train_(self, d):
+        self.design(psychic.get_samplerate(d))
+
+    def apply_(self, d):
+        if self.zi is None:
+            self.zi = [numpy.zeros((sos.shape[0], d.nfeatures, 2)) for sos in self.sos]
+
+        # One sosfilt call per band, see the class docstring
+        X = numpy.empty((len(self.bands) * d.nfeatures, d.ninstances))
+        for i, sos in enumerate(self.sos):
+            rows = slice(i * d.nfeatures, (i + 1) * d.nfeatures)
+            X[rows], self.zi[i] = scipy.signal.sosfilt(sos, d.data, axis=1, zi=self.zi[i])
+        return psychic.DataSet(data=X, labels=d.labels, ids=d.ids)
@@ -0,0 +1,150 @@
+import cPickle
+
+import numpy
+import psychic
+
+def _symmetric_decorrelation(W):
+    """ Make the rows of W orthonormal: W <- (W W^T)^-1/2 W """
+    s, u = numpy.linalg.eigh(numpy.dot(W, W.T))
+    return numpy.dot(numpy.dot(u / numpy.sqrt(s), u.T), W)
+
+def _fastica(Z, W, max_iter, tol):
+    """ Symmetric FastICA with the logcosh contrast on whitened data Z
+    (components x samples), starting from W. Returns the unmixing matrix of
+    the whitened data and whether it converged. """
+    W = _symmetric_decorrelation(W)
+    nsamples = float(Z.shape[1])
+    for i in range(max_iter):
+        G = numpy.tanh(numpy.dot(W, Z))
+        W_new = (numpy.dot(G, Z.T) / nsamples -
+                 numpy.mean(1 - G ** 2, axis=1)[:,numpy.newaxis] * W)
+        W_new = _symmetric_decorrelation(W_new)
+        change = numpy.max(numpy.abs(numpy.abs(numpy.sum(W_new * W, axis=1)) - 1))
+        W = W_new
+        if change < tol:
+            return W, True
+    return W, False
+
+class WarmICA(psychic.nodes.BaseNode):
+    """
+    Unmixes the channels into independent components with FastICA, like
+    psychic.nodes.ICA, but cheaper to train:
+
+     - Training uses at most max_samples samples, taken at regular intervals
+       from the data.
+     - Training starts from the unmixing matrix found before for the same
+       montage, if any, see save() and load(). When the participant is the
+       same, only a few iterations are needed.
+     - update() refines the unmixing matrix with new data, without going
+       over the data used before.
+
+    The mean and covariance of all data this node was trained and updated on
+    are kept, so the whitening improves with every update. They are not
+    saved: an unmixing matrix loaded from a file is only used as the
+    starting point of the next training.
+    """
+
+    def __init__(self, max_samples=10000, max_iter=200, tol=1e-4, seed=0):
+        """
+        max_samples - maximum number of samples to train on
+        max_iter    - maximum number of FastICA iterations
+        tol         - FastICA stops when the unmixing matrix changes less
+        seed        - seed for the initial unmixing matrix, when there is no
+                      previous one
+        """
+        psychic.nodes.BaseNode.__init__(self)
+        self.max_samples = max_samples
+        self.max_iter = max_iter
+        self.tol = tol
+        self.seed = seed
+
+        self.montage = None
+        self.unmixing = None
+        self.mean = None
+        self.forget_statistics()
+
+    def forget_statistics(self):
+        """ Forget the mean and covariance of the data seen so far, so the
+        next update() fails and the node has to be trained again. The unmixing
+        matrix is kept as a starting point. """
+        self.nsamples = 0
+        self.sum = None
+        self.sum_of_products = None
+
+    def _montage(self, d):
+        return (d.nfeatures, repr(d.feat_lab), float(psychic.get_samplerate(d)))
+
+    def _decimate(self, X):
+        step = int(numpy.ceil(X.shape[1] / float(self.max_samples)))
+        return X[:,::max(step, 1)]
+
+    def _add_statistics(self, X):
+        if self.sum is None:
+            self.sum = numpy.zeros(X.shape[0])
+            self.sum_of_products = numpy.zeros((X.shape[0], X.shape[0]))
+        self.nsamples += X.shape[1]
+        self.sum += numpy.sum(X, axis=1)
+        self.sum_of_products += numpy.dot(X, X.T)
+
+    def _fit(self, X, max_iter):
+        """ Update the whitening with the statistics and run FastICA on X,
+        starting from the current unmixing matrix. """
+        self.mean = self.sum / self.nsamples
+        cov = self.sum_of_products / self.nsamples - numpy.outer(self.mean, self.mean)
+        D, E = numpy.linalg.eigh(cov)
+        D = numpy.maximum(D, 1e-12 * numpy.max(D))
+        whitening = (E / numpy.sqrt(D)).T
+        dewhitening = E * numpy.sqrt(D)
+
+        if self.unmixing is None:
+            W = numpy.random.RandomState(self.seed).randn(len(D), len(D))
+        else:
+            W = numpy.dot(self.unmixing, dewhitening)
+
+        Z = numpy.dot(whitening, X - self.mean[:,numpy.newaxis])
+        W, converged = _fastica(Z, W, max_iter, self.tol)
+        if not converged:
+            raise ValueError('ICA did not converge')
+        self.unmixing = numpy.dot(W, whitening)
+
+    def train_(self, d):
+        montage = self._montage(d)
+        if montage != self.montage:
+            # The previous unmixing matrix is of no use
+            self.unmixing = None
+            self.montage = montage
+
+        self.forget_statistics()
+        X = self._decimate(d.data)
+        self._add_statistics(X)
+        self._fit(X, self.max_iter)
+
+    def update(self, d, max_iter=20):
+        """ Refine the unmixing matrix with new data. The node must have been
+        trained before, on data of this montage. """
+        if self.sum is None or self._montage(d) != self.montage:
+            raise ValueError('ICA must be trained on this montage before it can be updated')
+
+        X = self._decimate(d.data)
+        self._add_statistics(X)
+        self._fit(X, max_iter)
+
+    def apply_(self, d):
+        X = numpy.dot(self.unmixing, d.data - self.mean[:,numpy.newaxis])
+        return psychic.DataSet(data=X, default=d)
+
+    def save(self, path):
+        """ Store the unmixing matrix, to start from it in a later session. """
+        with open(path, 'wb') as f:
+            cPickle.dump({'montage': self.montage, 'unmixing': self.unmixing},
+                         f, cPickle.HIGHEST_PROTOCOL)
+
+    def load(self, path):
+        """ Start the next training from an unmixing matrix stored with
+        save(). Training ignores it when the montage turns out to be
+        different. The statistics of this node are forgotten. """
+        with open(path, 'rb') as f:
+            state = cPickle.load(f)
+        self.montage = state['montage']
+        self.unmixing = state['unmixing']
+        self.forget_statistics()
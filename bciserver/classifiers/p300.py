@@ -1,287 +1,471 @@
-import psychic
-import numpy
-import scipy
-
-import sklearn.svm
-import sklearn.grid_search
-
-from ..classifier import Classifier
-from ..bci_exceptions import ClassifierException
-
-class P300(Classifier):
-    """ Implements an online P300 classifier. """
-    def __init__(self, engine, recorder, classifications_needed=0, num_repetitions=10, num_options=7, window=(0.0, 1.0), bandpass=[0.5, 15]):
-        """ Constructor.
-
-        Required parameters:
-        recorder: The Recorder object to read data from
-
-        Keyword parameters (configures the classifier): 
-        classifications_needed: Number of consistent classifications needed to make a desicion
-        window: A pair (from, to) in samples of the window to extract around the stimulation onset
-        bandpass: [lo, hi] cutoff frequencies for the bandpass filter to use on the data
-        """
-
-        assert len(window) == 2
-
-        self.num_repetitions = num_repetitions
-        self.num_options = num_options
-        self.target_sample_rate = 128
-        self.window = window
-        self.window_samples = (int(recorder.sample_rate*window[0]), int(recorder.sample_rate*window[1]))
-        self.target_window = (int(self.target_sample_rate*window[0]), int(self.target_sample_rate*window[1]))
-        self.classifications_needed = classifications_needed
-
-        self.mdict = {}
-        for i in range(1,self.num_options+1):
-            self.mdict[i] = 'target %02d' % i
-
-
-        # Create pipeline
-        self.bp_node = psychic.nodes.OnlineFilter( lambda s : scipy.signal.iirfilter(3, [bandpass[0]/(s/2.0), bandpass[1]/(s/2.0)]) )
-        self.resample_node = psychic.nodes.Resample(self.target_sample_rate, max_marker_delay=1)
-        self.svm_node = sklearn.grid_search.GridSearchCV(
-            sklearn.svm.LinearSVC(),
-            {'C': numpy.logspace(-3, 5, 10)},
-            cv=5,
-        )
-        self.slice_node = psychic.nodes.OnlineSlice(self.mdict, window)
-        self.preprocessing = psychic.nodes.Chain([self.bp_node, self.resample_node])
-        self.classification = psychic.nodes.Chain([self.svm_node])
-
-        Classifier.__init__(self, engine, recorder)
-
-        self.logger.info('sample_rate: %d Hz' % recorder.sample_rate)
-        self.logger.info('bandpass: %s' % bandpass)
-        self.logger.info('window: %s' % str(window))
-        self.logger.info('num_repetitions: %d' % num_repetitions)
-
-    def _reset(self):
-        """ Resets the classifier. Flushes all collected data."""
-        super(P300, self)._reset()
-
-        self.application_data_valid = True
-        self.processed_data = None
-        self.num_coherent_classifications = 0
-        self.last_winner = -1
-        self.last_repetitions_recorded = 0
-
-    def _train(self, d):
-        """ Trains on the data collected thus far. """
-
-        if not d:
-            raise ClassifierException('First collect some data before training.')
-
-        # Save a snapshot of the training data to disk
-        d.save('test_data.dat')
-
-        # Do preprocessing
-        self.preprocessing.train(d)
-        d = self.preprocessing.apply(d)
-        self.feat_lab = d.feat_lab
-
-        self.slice_node.train(d)
-
-        # Extract trials
-        d = self._extract_training_trials(d)
-        d2 = psychic.nodes.Blowup(100).apply(d)
-        d2 = psychic.nodes.Mean(axis=2).apply(d2)
-
-        # Train classifier
-        self.classification.train(d2)
-        #if (numpy.any( numpy.isfinite(self.lda_node.means) ) or
-        #    numpy.any( numpy.isfinite(self.lda_node.const) ) or
-        #    numpy.any( numpy.isfinite(self.lda_node.S_is)  )):
-        #    self.logger.error('Training FAILED')
-        #    raise ClassifierException('Training failed')
-
-        self.logger.info('Training complete')
-
-        # Send a debug plot to client
-        self._send_debug_image( psychic.nodes.Mean(axis=2).apply(d) )
-
-        self.training_complete = True
-        self.slice_node.reset()
-
-    def _extract_training_trials(self, d):
-        block_onsets = numpy.flatnonzero(d.Y > 100)
-        num_blocks = len(block_onsets)
-        if not num_blocks:
-            raise ClassifierException('No blocks found in recording. Make sure the data is properly labeled.')
-
-        block_lengths = numpy.hstack( (numpy.diff(block_onsets), d.ninstances-block_onsets[-1]) )
-        targets = d.Y[0,block_onsets] - 100
-        options = numpy.unique(targets)
-        num_options = len(options)
-        num_instances = num_blocks * num_options
-        num_channels = d.nfeatures
-
-        mdict = {}
-        for target in sorted(numpy.unique(targets)):
-            mdict[target] = 'target %02d' % target
-
-        # Allocate memory for the blocks
-        feat_dim_lab = ['channels', 'samples', 'repetitions']
-        feat_shape = (num_channels, self.target_window[1]-self.target_window[0], self.num_repetitions)
-        X = numpy.zeros(feat_shape + (num_instances,))
-        Y = numpy.zeros((2,num_instances))
-        I = numpy.arange(num_instances)
-
-        # Extract each block
-        for block_num,block_onset,block_length,target in zip(range(num_blocks), block_onsets, block_lengths, targets):
-            block = d[block_onset : block_onset+block_length+self.target_sample_rate]
-            block = psychic.slice(block, mdict, self.target_window)
-            #block = psychic.baseline(block, (0, 10))
-
-            # Extract each option within a block
-            for option_num in range(block.nclasses):
-                if block.get_class(option_num).ndX.shape[2] < self.num_repetitions:
-                    self.logger.warning('could not extract all repetitions of option %d in block %d' % (option_num+1, block_num))
-                    continue
-                instance = block_num*num_options+option_num
-                X[:,:,:,instance] = block.get_class(option_num).ndX[:,:,:self.num_repetitions]
-                Y[0,instance] = (option_num == (target-1)) # target trial
-                Y[1,instance] = (option_num != (target-1)) # nontarget trial
-
-        # Build new dataset containing the trials
-        return psychic.DataSet(data=X, labels=Y, ids=I,
-                               feat_dim_lab=feat_dim_lab,
-                               l_lab=['target', 'nontarget'])
-
-    def _apply(self, d):
-        """ Applies classifier to a dataset. """
-
-        # Perform preprocessing
-        d = self.preprocessing.apply(d)
-        slices = self.slice_node.apply(d)
-        if slices == None:
-            return
-
-        if self.application_data == None or not self.application_data_valid:
-            self.application_data = slices
-            self.application_data_valid = True
-        else:
-            self.application_data += slices
-
-        repetitions_recorded = numpy.min(self.application_data.ninstances_per_class)
-        if repetitions_recorded == self.last_repetitions_recorded:
-            return
-
-        self.logger.debug('Repetitions recorded: %d' % repetitions_recorded)
-        self.last_repetitions_recorded = repetitions_recorded
-        if repetitions_recorded < self.num_repetitions:
-            return
-
-        d = psychic.erp(self.application_data)
-
-        # Perform actual classification
-        try:
-            result = self.classification.apply(d).data
-
-            candidates = numpy.flatnonzero( numpy.argmax(result, axis=0) == 0 )
-            if len(candidates) > 0:
-                winner = candidates[ numpy.argmax( result[0, candidates] ) ]
-            else:
-                winner = numpy.argmax(result[0,:])
-
-            if winner == self.last_winner:
-                self.num_coherent_classifications += 1
-            else:
-                self.num_coherent_classifications = 0
-                self.last_winner = winner
-
-            self.logger.debug('Coherent classifications: %d' % self.num_coherent_classifications)
-            if self.num_coherent_classifications < self.classifications_needed:
-                self.engine.provide_result([list(result[0,:]), 0])
-                return
-
-            self.logger.info('classification result: %d' % winner)
-            self.engine.provide_result([list(result[0,:]), winner+1])
-            self.application_data_valid = False
-            self.num_coherent_classifications = 0
-            self.last_winner = -1
-            self.last_repetitions_recorded = 0
-
-        except ValueError as e:
-            self.logger.error('Classification failed: %s' % e)
-    
-    def _generate_debug_image(self, d):
-        """ Generate image describing the training data. """
-        d = psychic.DataSet(cl_lab=self.cl_lab, default=d)
-        fig = psychic.plot_erp(d, enforce_equal_n=False)
-        fig.set_size_inches(7, 11)
-        return fig
-
-    def set_parameter(self, name, value):
-        if name == 'num_repetitions':
-            if type(value[0]) != int:
-                raise ClassifierException('Value for num_repetitions must be of type int.')
-
-            self.num_repetitions = value[0]
-            return True
-
-        elif name == 'classifications_needed':
-            if type(value[0]) != int:
-                raise ClassifierException('Value for classifications_needed must be of type int.')
-
-            self.classifications_needed = value[0]
-            return True
-
-        elif name == 'num_options':
-            if type(value[0]) != int:
-                raise ClassifierException('Value for num_options must be of type int.')
-
-            self.num_options = value[0]
-
-            # Rebuild marker dictionary
-            self.mdict.clear()
-            for i in range(1,self.num_options+1):
-                self.mdict[i] = 'target %02d' % i
-            self.slice_node.reset()
-            self.application_data_valid = False
-            return True
-
-        if self.state != 'idle' or self.training_complete:
-            raise ClassifierException('Can only change this parameter in idle mode, before training.')
-
-        if name == 'bandpass':
-            if len(value) < 2 or (type(value[0]) != float and type(value[1]) != int) or (type(value[1]) != float and type(value[1]) != int):
-                raise ClassifierException('This parameter needs two numeric value.')
-
-            self.bandpass = (value[0], value[1])
-            return True
-
-        elif name == 'window':
-            if len(value) < 2 or (type(value[0]) != float and type(value[1]) != int) or (type(value[1]) != float and type(value[1]) != int):
-                raise ClassifierException('This parameter needs two numeric value.')
-
-            self.window = (value[0], value[1])
-            self.window_samples = (int(self.recorder.sample_rate*value[0]), int(self.recorder.sample_rate*value[1]))
-            self.target_window = (int(self.target_sample_rate*value[0]), int(self.target_sample_rate*value[1]))
-            return True
-
-        elif name == 'target_sample_rate':
-            if type(value[0]) != int and type(value[0]) != float:
-                raise ClassifierException('Value for target_sample_rate must be numeric.')
-
-            self.target_sample_rate = value[0]
-            self.target_window = (int(self.target_sample_rate*self.window[0]), int(self.target_sample_rate*self.window[1]))
-            return True
-
-        return False
-
-    def get_parameter(self, name):
-        if name == 'num_options':
-            return self.num_options
-        elif name == 'num_repetitions':
-            return self.num_repetitions
-        elif name == 'window':
-            return self.window
-        elif name == 'target_sample_rate':
-            return self.target_sample_rate
-        elif name == 'bandpass':
-            return self.bandpass
-        elif name == 'classifications_needed':
-            return self.classifications_needed
-        else:
-            return False
+import psychic
+import numpy
+import scipy
+
+from classifier import Classifier
+from filters import OnlineSOSFilter
+from ..bci_exceptions import ClassifierException
+
+class ERPAccumulator:
+    """
+    Keeps running sums of the trials of each option as they come in, so the
+    ERPs are available at any time without averaging all trials again.
+    Resetting is cheap: the sums are overwritten by the next update.
+    """
+
+    def __init__(self, track_variance=False):
+        """
+        track_variance - also keep the sums of squares, see variances()
+        """
+        self.track_variance = track_variance
+        self.reset()
+
+    def reset(self):
+        """ Forget all trials. """
+        self.empty = True
+        self.template = None
+        self.sums = None
+        self.sums_of_squares = None
+        self.counts = None
+
+    def update(self, slices):
+        """ Add the trials in a dataset produced by psychic.nodes.OnlineSlice.
+        """
+        X = slices.data.reshape(-1, slices.ninstances)
+        Y = slices.Y.astype(float)
+
+        sums = numpy.dot(Y, X.T)
+        counts = Y.sum(axis=1)
+        if self.empty:
+            self.template = slices
+            self.sums = sums
+            self.counts = counts
+            if self.track_variance:
+                self.sums_of_squares = numpy.dot(Y, (X ** 2).T)
+            self.empty = False
+        else:
+            self.sums += sums
+            self.counts += counts
+            if self.track_variance:
+                self.sums_of_squares += numpy.dot(Y, (X ** 2).T)
+
+    def min_count(self):
+        """ Returns the number of trials of the option with the least
+        trials. """
+        if self.empty:
+            return 0
+        return int(numpy.min(self.counts))
+
+    def means(self):
+        """ Returns the ERPs as a dataset with an instance for each option,
+        like psychic.erp. """
+        means = self.sums / numpy.maximum(self.counts, 1)[:,numpy.newaxis]
+        feat_shape = self.template.data.shape[:-1]
+        nclasses = len(self.counts)
+        return psychic.DataSet(data=means.T.reshape(feat_shape + (nclasses,)),
+                               labels=numpy.eye(nclasses),
+                               ids=numpy.arange(nclasses),
+                               default=self.template)
+
+    def variances(self):
+        """ Returns the variance of the trials of each option, as an array of
+        (options x features). Requires track_variance. """
+        counts = numpy.maximum(self.counts, 1)[:,numpy.newaxis]
+        means = self.sums / counts
+        return self.sums_of_squares / counts - means ** 2
+
+def posterior_margin(scores, temperature=1.0):
+    """ Turns the target scores of the options into a posterior probability
+    for each option being the target, using a softmax on the scores divided
+    by the temperature of the classifier, see LinearClassifier. Returns the
+    option with the highest probability and the difference between its
+    probability and that of the runner-up. """
+    scores = numpy.asarray(scores) / temperature
+    p = numpy.exp(scores - numpy.max(scores))
+    p /= numpy.sum(p)
+    order = numpy.argsort(p)[::-1]
+    if len(p) < 2:
+        return order[0], p[order[0]]
+    return order[0], p[order[0]] - p[order[1]]
+
+class P300(Classifier):
+    """ Implements an online P300 classifier. """
+
+    model_attributes = ['num_repetitions', 'num_options', 'classifications_needed',
+                        'stopping_confidence', 'min_repetitions',
+                        'window', 'window_samples', 'target_window',
+                        'target_sample_rate', 'bandpass', 'C_values', 'mdict',
+                        'bp_node', 'resample_node', 'preprocessing', 'slice_node',
+                        'feat_lab', 'classification']
+
+    def __init__(self, engine, recorder, classifications_needed=0, num_repetitions=10, num_options=7, window=(0.0, 1.0), bandpass=[0.5, 15]):
+        """ Constructor.
+
+        Required parameters:
+        recorder: The Recorder object to read data from
+
+        Keyword parameters (configures the classifier): 
+        classifications_needed: Number of consistent classifications needed to make a desicion
+        window: A pair (from, to) in samples of the window to extract around the stimulation onset
+        bandpass: [lo, hi] cutoff frequencies for the bandpass filter to use on the data
+        """
+
+        assert len(window) == 2
+
+        self.num_repetitions = num_repetitions
+        self.num_options = num_options
+        self.target_sample_rate = 128
+        self.window = window
+        self.window_samples = (int(recorder.sample_rate*window[0]), int(recorder.sample_rate*window[1]))
+        self.target_window = (int(self.target_sample_rate*window[0]), int(self.target_sample_rate*window[1]))
+        self.classifications_needed = classifications_needed
+        self.stopping_confidence = 0
+        self.min_repetitions = 2
+        self.bandpass = bandpass
+        self.C_values = numpy.logspace(-3, 5, 10)
+        self.cv_folds = 5
+        self.blowup = 100
+        self.search_patience = None
+        self.search_jobs = -1
+
+        self.mdict = {}
+        for i in range(1,self.num_options+1):
+            self.mdict[i] = 'target %02d' % i
+
+        # Running ERPs of the data collected in application mode
+        self.erps = ERPAccumulator()
+
+
+        # Create pipeline
+        self.bp_node = OnlineSOSFilter(3, bandpass)
+        self.resample_node = psychic.nodes.Resample(self.target_sample_rate, max_marker_delay=1)
+        self.slice_node = psychic.nodes.OnlineSlice(self.mdict, window)
+        self.preprocessing = psychic.nodes.Chain([self.bp_node, self.resample_node])
+
+        # Trained in a worker process, see _train()
+        self.classification = None
+
+        Classifier.__init__(self, engine, recorder)
+
+        self.logger.info('sample_rate: %d Hz' % recorder.sample_rate)
+        self.logger.info('bandpass: %s' % bandpass)
+        self.logger.info('window: %s' % str(window))
+        self.logger.info('num_repetitions: %d' % num_repetitions)
+
+    def _reset(self):
+        """ Resets the classifier. Flushes all collected data."""
+        super(P300, self)._reset()
+
+        self.application_data_valid = True
+        self.processed_data = None
+        self.num_coherent_classifications = 0
+        self.last_winner = -1
+        self.last_repetitions_recorded = 0
+
+    def _train(self, d):
+        """ Trains on the data collected thus far. """
+
+        if not d:
+            raise ClassifierException('First collect some data before training.')
+
+        # Save a snapshot of the training data to disk
+        self._save_training_data(d)
+
+        # Do preprocessing
+        self.preprocessing.train(d)
+        d = self.preprocessing.apply(d)
+        self.feat_lab = d.feat_lab
+
+        self.slice_node.train(d)
+
+        # Extract trials
+        d = self._extract_training_trials(d)
+        valid = numpy.sum(d.Y, axis=0) > 0
+        X = d.data.reshape(-1, self.num_repetitions, d.ninstances)[:,:,valid]
+        y = d.y[valid]
+
+        # Train classifier in a worker process, on random averages of the
+        # repetitions. The SVM is swapped in by _install_classification()
+        # when training is done.
+        from training import train_averaged_svm
+        self._train_in_background(train_averaged_svm,
+                                  (X, y, self.blowup, self.C_values, self.cv_folds,
+                                   self.search_jobs, self.search_patience),
+                                  self._install_classification)
+        #if (numpy.any( numpy.isfinite(self.lda_node.means) ) or
+        #    numpy.any( numpy.isfinite(self.lda_node.const) ) or
+        #    numpy.any( numpy.isfinite(self.lda_node.S_is)  )):
+        #    self.logger.error('Training FAILED')
+        #    raise ClassifierException('Training failed')
+
+        # Send a debug plot to client
+        self._send_debug_image( psychic.nodes.Mean(axis=2).apply(d) )
+
+        self.slice_node.reset()
+
+    def _install_classification(self, result):
+        """ Swap in the classifier trained in the worker process. """
+        self.classification, C, search_time = result
+        self.logger.info('Training complete (C=%g, search took %.1f s)' % (C, search_time))
+        self.training_complete = True
+
+    def _extract_training_trials(self, d):
+        """ Cut the recording into trials. Returns a dataset with an instance
+        for each option in each block, containing the first num_repetitions
+        trials of the option in the block. The instances are labeled as
+        target or nontarget. """
+        labels = d.Y[0,:].astype(int)
+        block_onsets = numpy.flatnonzero(labels > 100)
+        num_blocks = len(block_onsets)
+        if not num_blocks:
+            raise ClassifierException('No blocks found in recording. Make sure the data is properly labeled.')
+
+        targets = labels[block_onsets] - 100
+        options = numpy.unique(targets)
+        num_options = len(options)
+        num_instances = num_blocks * num_options
+        num_channels = d.nfeatures
+        start, end = self.target_window
+
+        # Each block extends to the next block plus one second. A trial
+        # belongs to a block when its window lies entirely within the block.
+        block_ends = numpy.hstack( (block_onsets[1:], d.ninstances) ) + self.target_sample_rate
+        block_ends = numpy.minimum(block_ends, d.ninstances)
+        first_onset = block_onsets - start
+        last_onset = block_ends - end
+
+        # Like psychic.slice, a trial starts at the first sample of a run of
+        # samples with the same marker code
+        run_starts = numpy.hstack( ([True], labels[1:] != labels[:-1]) )
+
+        # Find the onsets of the first repetitions of each option in each block
+        onsets = numpy.zeros((num_blocks, num_options, self.num_repetitions), dtype=int)
+        valid = numpy.zeros((num_blocks, num_options), dtype=bool)
+        for option_num, option in enumerate(options):
+            option_onsets = numpy.flatnonzero((labels == option) & run_starts)
+            first = numpy.searchsorted(option_onsets, first_onset, 'left')
+            last = numpy.searchsorted(option_onsets, last_onset, 'right')
+            valid[:,option_num] = (last - first) >= self.num_repetitions
+
+            index = first[:,numpy.newaxis] + numpy.arange(self.num_repetitions)
+            index = numpy.minimum(index, len(option_onsets) - 1)
+            if len(option_onsets) > 0:
+                onsets[:,option_num,:] = option_onsets[index]
+
+        for block_num, option_num in zip(*numpy.nonzero(~valid)):
+            self.logger.warning('could not extract all repetitions of option %d in block %d' % (option_num+1, block_num))
+
+        # Gather all trials at once: the index has the shape
+        # (samples, repetitions, instances)
+        onsets = onsets.reshape(num_instances, self.num_repetitions)
+        onsets[~valid.ravel()] = -start
+        index = numpy.arange(start, end)[:,numpy.newaxis,numpy.newaxis] + onsets.T[numpy.newaxis,:,:]
+        X = d.data[:,index]
+        X[:,:,:,~valid.ravel()] = 0
+
+        is_target = (options[numpy.newaxis,:] == targets[:,numpy.newaxis]).ravel()
+        Y = numpy.zeros((2,num_instances))
+        Y[0,:] = is_target & valid.ravel() # target trial
+        Y[1,:] = ~is_target & valid.ravel() # nontarget trial
+        I = numpy.arange(num_instances)
+
+        # Build new dataset containing the trials
+        feat_dim_lab = ['channels', 'samples', 'repetitions']
+        return psychic.DataSet(data=X, labels=Y, ids=I,
+                               feat_dim_lab=feat_dim_lab,
+                               l_lab=['target', 'nontarget'])
+
+    def _apply(self, d):
+        """ Applies classifier to a dataset. """
+
+        # Perform preprocessing
+        d = self.preprocessing.apply(d)
+        slices = self.slice_node.apply(d)
+        if slices == None:
+            return
+
+        if self.application_data == None or not self.application_data_valid:
+            # Start collecting from scratch
+            self.erps.reset()
+            self.application_data = self.erps
+            self.application_data_valid = True
+        self.erps.update(slices)
+
+        repetitions_recorded = self.erps.min_count()
+        if repetitions_recorded == self.last_repetitions_recorded:
+            return
+
+        self.logger.debug('Repetitions recorded: %d' % repetitions_recorded)
+        self.last_repetitions_recorded = repetitions_recorded
+
+        # With dynamic stopping, classify after every repetition and decide
+        # as soon as the classifier is confident enough
+        early = repetitions_recorded < self.num_repetitions
+        if early and (not self.stopping_confidence or
+                      repetitions_recorded < self.min_repetitions):
+            return
+
+        d = self.erps.means()
+
+        # Perform actual classification
+        try:
+            result = self.classification.apply(d)
+
+            if early:
+                winner, margin = posterior_margin(result[0,:], self.classification.temperature)
+                self.logger.debug('Posterior margin after %d repetitions: %.3f' %
+                                  (repetitions_recorded, margin))
+                if margin < self.stopping_confidence:
+                    self.engine.provide_result([list(result[0,:]), 0])
+                    return
+                self._decide(result, winner)
+                return
+
+            candidates = numpy.flatnonzero( numpy.argmax(result, axis=0) == 0 )
+            if len(candidates) > 0:
+                winner = candidates[ numpy.argmax( result[0, candidates] ) ]
+            else:
+                winner = numpy.argmax(result[0,:])
+
+            if winner == self.last_winner:
+                self.num_coherent_classifications += 1
+            else:
+                self.num_coherent_classifications = 0
+                self.last_winner = winner
+
+            self.logger.debug('Coherent classifications: %d' % self.num_coherent_classifications)
+            if self.num_coherent_classifications < self.classifications_needed:
+                self.engine.provide_result([list(result[0,:]), 0])
+                return
+
+            self._decide(result, winner)
+
+        except ValueError as e:
+            self.logger.error('Classification failed: %s' % e)
+
+    def _decide(self, result, winner):
+        """ Report the selected option and start collecting trials for the
+        next selection. """
+        self.logger.info('classification result: %d (%d repetitions)' %
+                         (winner, self.last_repetitions_recorded))
+        self.engine.provide_result([list(result[0,:]), winner+1])
+        self.erps.reset()
+        self.num_coherent_classifications = 0
+        self.last_winner = -1
+        self.last_repetitions_recorded = 0
+    
+    def _generate_debug_image(self, d):
+        """ Generate image describing the training data. """
+        d = psychic.DataSet(cl_lab=['target', 'nontarget'], default=d)
+        fig = psychic.plot_erp(d, enforce_equal_n=False)
+        fig.set_size_inches(7, 11)
+        return fig
+
+    def set_parameter(self, name, value):
+        if super(P300, self).set_parameter(name, value):
+            return True
+
+        if name == 'num_repetitions':
+            if type(value[0]) != int:
+                raise ClassifierException('Value for num_repetitions must be of type int.')
+
+            self.num_repetitions = value[0]
+            return True
+
+        elif name == 'classifications_needed':
+            if type(value[0]) != int:
+                raise ClassifierException('Value for classifications_needed must be of type int.')
+
+            self.classifications_needed = value[0]
+            return True
+
+        elif name == 'stopping_confidence':
+            if (type(value[0]) != float and type(value[0]) != int) or not 0 <= value[0] < 1:
+                raise ClassifierException('Value for stopping_confidence must be a number between 0 and 1.')
+
+            self.stopping_confidence = value[0]
+            return True
+
+        elif name == 'min_repetitions':
+            if type(value[0]) != int or value[0] < 1:
+                raise ClassifierException('Value for min_repetitions must be a positive int.')
+
+            self.min_repetitions = value[0]
+            return True
+
+        elif name == 'search_patience':
+            if type(value[0]) != int:
+                raise ClassifierException('Value for search_patience must be of type int.')
+
+            # Zero disables early stopping
+            self.search_patience = value[0] if value[0] > 0 else None
+            return True
+
+        elif name == 'num_options':
+            if type(value[0]) != int:
+                raise ClassifierException('Value for num_options must be of type int.')
+
+            self.num_options = value[0]
+
+            # Rebuild marker dictionary
+            self.mdict.clear()
+            for i in range(1,self.num_options+1):
+                self.mdict[i] = 'target %02d' % i
+            self.slice_node.reset()
+            self.application_data_valid = False
+            return True
+
+        if self.state != 'idle' or self.training_complete:
+            raise ClassifierException('Can only change this parameter in idle mode, before training.')
+
+        if name == 'bandpass':
+            if len(value) < 2 or (type(value[0]) != float and type(value[1]) != int) or (type(value[1]) != float and type(value[1]) != int):
+                raise ClassifierException('This parameter needs two numeric value.')
+
+            self.bandpass = (value[0], value[1])
+            return True
+
+        elif name == 'window':
+            if len(value) < 2 or (type(value[0]) != float and type(value[1]) != int) or (type(value[1]) != float and type(value[1]) != int):
+                raise ClassifierException('This parameter needs two numeric value.')
+
+            self.window = (value[0], value[1])
+            self.window_samples = (int(self.recorder.sample_rate*value[0]), int(self.recorder.sample_rate*value[1]))
+            self.target_window = (int(self.target_sample_rate*value[0]), int(self.target_sample_rate*value[1]))
+            return True
+
+        elif name == 'target_sample_rate':
+            if type(value[0]) != int and type(value[0]) != float:
+                raise ClassifierException('Value for target_sample_rate must be numeric.')
+
+            self.target_sample_rate = value[0]
+            self.target_window = (int(self.target_sample_rate*self.window[0]), int(self.target_sample_rate*self.window[1]))
+            return True
+
+        return False
+
+    def get_parameter(self, name):
+        value = super(P300, self).get_parameter(name)
+        if value is not False:
+            return value
+
+        if name == 'num_options':
+            return self.num_options
+        elif name == 'num_repetitions':
+            return self.num_repetitions
+        elif name == 'window':
+            return self.window
+        elif name == 'target_sample_rate':
+            return self.target_sample_rate
+        elif name == 'bandpass':
+            return self.bandpass
+        elif name == 'classifications_needed':
+            return self.classifications_needed
+        elif name == 'stopping_confidence':
+            return self.stopping_confidence
+        elif name == 'min_repetitions':
+            return self.min_repetitions
+        elif name == 'search_patience':
+            return self.search_patience or 0
+        else:
+            return False
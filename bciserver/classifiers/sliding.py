@@ -0,0 +1,252 @@
+import collections
+import fractions
+
+import numpy
+import psychic
+
+from templates import reference_templates
+
+class SlidingSSVEPScorer(psychic.nodes.BaseNode):
+    """
+    Scores sliding windows of the data for SSVEP responses, taking the place
+    of psychic.nodes.OnlineSlidingWindow followed by psychic.nodes.MNEC or
+    psychic.nodes.CanonCorr.
+
+    Both methods only need the cross-products of the data and the sine/cosine
+    references over the window. Windows overlap, so instead of computing the
+    cross-products from scratch for every window, the data is cut into blocks
+    that fit both the window size and the window step. The cross-products of
+    each block are computed once, added to running totals when the block
+    comes in and subtracted again when it leaves the window. The cost per
+    window therefore depends on the window step, not on the window size.
+
+    The references are generated in absolute time. Shifting a window only
+    rotates the sine and cosine of each harmonic into each other, which
+    doesn't change the scores.
+
+    The output has an instance for each window, identified by its last
+    sample like OnlineSlidingWindow with ref_point=1.0, and a feature for each
+    frequency:
+      'canoncorr' - the largest canonical correlation between the channels and
+                    the references of the frequency
+      'mnec'      - the signal to noise ratio of the frequency after combining
+                    the channels as in the Minimum Energy Combination method
+                    (Friman et al., 2007). The noise is estimated from the
+                    energy of the channels after removing the references,
+                    which can be done with the running totals, instead of
+                    with an AR model.
+    """
+
+    # Fraction of the noise energy kept by the spatial filters of MNEC
+    NOISE_ENERGY = 0.1
+
+    # Number of windows after which the running totals are summed again from
+    # the blocks, to keep rounding errors from accumulating
+    RESUM_INTERVAL = 100
+
+    def __init__(self, method, sample_rate, freqs, nharmonics, window_size, window_step):
+        """
+        method      - 'mnec' or 'canoncorr'
+        sample_rate - sample rate of the data in Hz
+        freqs       - frequencies of the stimuli in Hz
+        nharmonics  - number of harmonics of each frequency to use
+        window_size - length of a window in samples
+        window_step - number of samples between the starts of two windows
+        """
+        psychic.nodes.BaseNode.__init__(self)
+        if method not in ['mnec', 'canoncorr']:
+            raise ValueError('unknown method: %s' % method)
+        if window_size < 1 or window_step < 1:
+            raise ValueError('window size and step must be at least one sample')
+
+        self.method = method
+        self.sample_rate = float(sample_rate)
+        self.freqs = list(freqs)
+        self.nharmonics = nharmonics
+        self.window_size = window_size
+        self.window_step = window_step
+
+        self.block_size = fractions.gcd(window_size, window_step)
+        self.blocks_per_window = window_size // self.block_size
+        self.blocks_per_step = window_step // self.block_size
+
+        # Angular frequency of each reference: a sine and a cosine for each
+        # harmonic of each frequency
+        harmonics = numpy.arange(1, nharmonics + 1)
+        self.omega = numpy.repeat((2 * numpy.pi / self.sample_rate) *
+                                  numpy.outer(self.freqs, harmonics).ravel(), 2)
+        self.phase = numpy.tile([0, numpy.pi / 2], len(self.freqs) * nharmonics)
+
+        # The references of a block are those of the first block, rotated
+        templates = reference_templates(self.sample_rate, self.freqs, nharmonics, self.block_size)
+        self.block_references = templates.references.reshape(-1, self.block_size)
+        self.block_references_products = numpy.dot(self.block_references, self.block_references.T)
+        self.block_references_sum = numpy.sum(self.block_references, axis=1)
+
+        self.reset()
+
+    def reset(self):
+        """ Forget all data. """
+        self.nsamples = 0
+        self.buffer = None
+        self.buffered = 0
+        self.blocks = collections.deque()
+        self.totals = None
+        self.nblocks = 0
+        self.windows_since_resum = 0
+
+    def train_(self, d):
+        pass
+
+    def score(self, Cxx, Cxy, Cyy):
+        """ Score a window, given the covariances of the data and the
+        references over it. Returns a score for each frequency. """
+        if self.method == 'mnec':
+            return self._score_mnec(Cxx, Cxy, Cyy)
+        else:
+            return self._score_canoncorr(Cxx, Cxy, Cyy)
+
+    def _references(self, start, n):
+        """ The references for n samples, starting at the given absolute
+        sample number. """
+        t = numpy.arange(start, start + n, dtype=float)
+        return numpy.sin(self.omega[:,numpy.newaxis] * t + self.phase[:,numpy.newaxis])
+
+    def _rotation(self, start):
+        """ The matrix that turns the references of the first block into the
+        references of the block starting at the given sample number. """
+        angle = self.omega[::2] * start
+        cos = numpy.cos(angle)
+        sin = numpy.sin(angle)
+        i = numpy.arange(0, len(self.omega), 2)
+        R = numpy.zeros((len(self.omega), len(self.omega)))
+        R[i,i] = cos
+        R[i,i+1] = sin
+        R[i+1,i] = -sin
+        R[i+1,i+1] = cos
+        return R
+
+    def _block_products(self, X):
+        """ Returns the cross-products of a block of data with itself and
+        with the references, and the sums of both. """
+        R = self._rotation(self.nsamples)
+        self.nsamples += X.shape[1]
+        return [numpy.dot(X, X.T),
+                numpy.dot(numpy.dot(X, self.block_references.T), R.T),
+                numpy.dot(numpy.dot(R, self.block_references_products), R.T),
+                numpy.sum(X, axis=1),
+                numpy.dot(R, self.block_references_sum)]
+
+    def _add_block(self, X):
+        """ Adds a block to the window. Returns whether a window is
+        complete. """
+        products = self._block_products(X)
+        self.blocks.append(products)
+        self.nblocks += 1
+        if self.totals is None:
+            self.totals = [p.copy() for p in products]
+        else:
+            for total, p in zip(self.totals, products):
+                total += p
+
+        if len(self.blocks) > self.blocks_per_window:
+            for total, p in zip(self.totals, self.blocks.popleft()):
+                total -= p
+
+        if len(self.blocks) < self.blocks_per_window:
+            return False
+        return (self.nblocks - self.blocks_per_window) % self.blocks_per_step == 0
+
+    def _covariances(self):
+        """ Covariances of the data and references over the current
+        window. """
+        self.windows_since_resum += 1
+        if self.windows_since_resum >= self.RESUM_INTERVAL:
+            self.totals = [numpy.sum(p, axis=0) for p in zip(*self.blocks)]
+            self.windows_since_resum = 0
+
+        Sxx, Sxy, Syy, sx, sy = self.totals
+        n = float(self.window_size)
+        Cxx = Sxx - numpy.outer(sx, sx) / n
+        Cxy = Sxy - numpy.outer(sx, sy) / n
+        Cyy = Syy - numpy.outer(sy, sy) / n
+        return Cxx, Cxy, Cyy
+
+    def _score_canoncorr(self, Cxx, Cxy, Cyy):
+        """ The canonical correlations of all frequencies at once: the
+        singular values of the cross-covariance after whitening both the data
+        and the references of each frequency. """
+        nfreqs = len(self.freqs)
+        nrefs = 2 * self.nharmonics
+        ridge = 1e-10 * numpy.trace(Cxx) / len(Cxx) + 1e-300
+        Lx = numpy.linalg.cholesky(Cxx + ridge * numpy.eye(len(Cxx)))
+        Ly = numpy.linalg.cholesky(self._diagonal_blocks(Cyy))
+
+        # (freqs x refs x channels)
+        K = numpy.linalg.solve(Lx, Cxy).T.reshape(nfreqs, nrefs, -1)
+        K = numpy.linalg.solve(Ly, K)
+        rho = numpy.linalg.svd(K, compute_uv=False)
+        return numpy.clip(rho[:,0], 0, 1)
+
+    def _score_mnec(self, Cxx, Cxy, Cyy):
+        """ The MNEC scores of all frequencies at once. """
+        nfreqs = len(self.freqs)
+        nrefs = 2 * self.nharmonics
+
+        # Energy of the channels after removing the references of each
+        # frequency, (freqs x channels x channels)
+        Cyx = Cxy.T.reshape(nfreqs, nrefs, -1)
+        noise = Cxx - numpy.einsum('frc,frd->fcd', Cyx,
+                                   numpy.linalg.solve(self._diagonal_blocks(Cyy), Cyx))
+        energy, V = numpy.linalg.eigh(noise)
+        energy = numpy.maximum(energy, 1e-12 * numpy.max(energy) + 1e-300)
+
+        # Keep the combinations of channels with the least noise
+        fraction = numpy.cumsum(energy, axis=1) / numpy.sum(energy, axis=1)[:,numpy.newaxis]
+        keep = numpy.hstack( (numpy.ones((nfreqs, 1), dtype=bool),
+                              fraction[:,:-1] < self.NOISE_ENERGY) )
+        nkeep = numpy.sum(keep, axis=1)
+
+        # Power of each reference in the combined channels, relative to the
+        # noise in them
+        power = numpy.einsum('fcw,frc->fwr', V, Cyx) ** 2
+        power /= energy[:,:,numpy.newaxis]
+        power /= numpy.diagonal(self._diagonal_blocks(Cyy), axis1=1, axis2=2)[:,numpy.newaxis,:]
+        power = numpy.sum(numpy.sum(power, axis=2) * keep, axis=1)
+        return power / (nkeep * self.nharmonics)
+
+    def _diagonal_blocks(self, Cyy):
+        """ The covariances of the references of each frequency, as an array
+        of (freqs x refs x refs). """
+        nrefs = 2 * self.nharmonics
+        return numpy.array([Cyy[i:i + nrefs, i:i + nrefs]
+                            for i in range(0, len(Cyy), nrefs)])
+
+    def apply_(self, d):
+        if self.buffer is None:
+            self.buffer = numpy.zeros((d.nfeatures, self.block_size))
+
+        # Collect the data in blocks
+        results = []
+        window_ids = []
+        position = 0
+        while position < d.ninstances:
+            n = min(self.block_size - self.buffered, d.ninstances - position)
+            self.buffer[:,self.buffered:self.buffered + n] = d.data[:,position:position + n]
+            self.buffered += n
+            position += n
+            if self.buffered < self.block_size:
+                break
+
+            self.buffered = 0
+            if self._add_block(self.buffer):
+                results.append(self.score(*self._covariances()))
+                window_ids.append(d.ids[0,position - 1])
+
+        if len(results) == 0:
+            data = numpy.zeros((len(self.freqs), 0))
+        else:
+            data = numpy.array(results).T
+        return psychic.DataSet(data=data,
+                               labels=numpy.zeros((1, len(window_ids))),
+                               ids=numpy.atleast_2d(window_ids))
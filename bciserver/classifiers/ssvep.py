@@ -1,192 +1,349 @@
-import matplotlib.pyplot as plt
-
-import psychic
-import scipy
-import scipy.signal
-import traceback
-import numpy as np
-
-from classifier import Classifier
-from ..bci_exceptions import ClassifierException
-
-class SSVEP(Classifier):
-    """
-    Implements an online SSVEP classifier that can desinguish between flickering
-    stimuli. Based on the Minimum Energy Combination method.
-
-    Chumerin, N., Manyakov, N. V, Combaz, A., Robben, A., van Vliet, M., Van
-    Hulle, M. M., Manyakov, N., et al. (2011). Steady state visual evoked
-    potential based computer gaming - The Maze. The 4th International ICST
-    Conference on Intelligent Technologies for Interactive Entertainment
-    (INTETAIN). Genoa, Italy, May 25-27, in press.
-    """
-    def __init__(self, engine, recorder, window_size=2.0, window_step=0.5, freqs=[60/4., 60/5., 60/6., 60/7.], bandpass=[2, 45], cl_type='MNEC', nharmonics=3):
-        """ Constructor.
-
-        Required parameters:
-        recorder: The Recorder object to read data from
-
-        Keyword parameters (configures the classifier): 
-        window_size: The window size in seconds to use on the data
-        window_step: The window step in seconds to use on the data
-        freqs: The frequencies in Hertz of the SSVEP stimuli to look for.
-        bandpass: [lo, hi] cutoff frequencies for the bandpass filter to use on the data
-        """
-        self.window_size = window_size
-        self.window_step = window_step
-        self.freqs = freqs
-        self.bandpass = bandpass
-        self.nharmonics = nharmonics
-        self.pipeline = None
-        self.cl_type = cl_type
-
-        # Figure out a sane target sample rate, using only a decimation factor
-        self.target_sample_rate = np.floor(recorder.sample_rate / np.max([1, np.floor(recorder.sample_rate / 200)]))
-    
-        Classifier.__init__(self, engine, recorder)
-
-    def _construct_pipeline(self):
-        self.logger.info('Creating pipeline')
-        self.logger.info("cl_type: %s" % self.cl_type)
-        self.logger.info("freqs: %s" % self.freqs)
-        self.logger.info("device sample_rate: %f" % self.recorder.sample_rate)
-        self.logger.info("target sample_rate: %f" % self.target_sample_rate)
-        self.logger.info("window_size: %f" % self.window_size)
-        self.logger.info("window_step: %f" % self.window_step)
-        self.logger.info("bandpass: %s" % str(self.bandpass))
-        self.logger.info("nharmonics: %s" % self.nharmonics)
-
-        self.bp_node = psychic.nodes.OnlineFilter(None)
-        self.resample_node = psychic.nodes.Resample(self.target_sample_rate, max_marker_delay=1)
-        self.window_node = psychic.nodes.OnlineSlidingWindow(int(self.window_size*self.target_sample_rate), int(self.window_step*self.target_sample_rate), ref_point=1.0)
-
-        if self.cl_type.lower() == 'mnec':
-            self.classifier_node = psychic.nodes.MNEC(self.target_sample_rate, self.freqs, self.nharmonics, nsamples=int(self.window_size*self.target_sample_rate, ))
-        elif self.cl_type.lower() == 'canoncorr':
-            self.classifier_node = psychic.nodes.CanonCorr(self.target_sample_rate, self.freqs, self.nharmonics, nsamples=int(self.window_size*self.target_sample_rate))
-        else:
-            raise ClassifierException(0, "Classifier type must be one of: ['MNEC', 'canoncorr'], not %s" % self.cl_type)
-
-        # Go over the nodes and initialize them (to avoid having to train later)
-        self.bp_node.filter = scipy.signal.iirfilter(4, [self.bandpass[0]/(self.target_sample_rate/2.0), self.bandpass[1]/(self.target_sample_rate/2.0)])
-        self.resample_node.old_samplerate = self.recorder.sample_rate
-        self.classifier_node.train_(None)
-        
-        self.pipeline = psychic.nodes.Chain([self.bp_node,
-                                             self.resample_node,
-                                             self.window_node,
-                                             self.classifier_node])
-
-    def _reset(self):
-        """ Reset the classifier. Flushes all collected data."""
-        super(SSVEP, self)._reset()
-
-        if self.pipeline:
-            self.window_node.reset()
-
-    def _train(self, d):
-        """ Construct and initialize pipeline, which can take some time. """
-        self._construct_pipeline()
-
-        if d:
-            d.save('test_data.dat')
-
-        self.logger.info('Training complete')
-        self.training_complete = True
-
-    def _apply(self, d):
-        """ Apply the classifier on a dataset. """
-        if d.ninstances == 0:
-            return
-
-        try:
-            result = self.pipeline.apply(d)
-            self.logger.debug('Result was: %s at %s' % (result.data.ravel(), result.ids))
-            # send result to client
-            if self.engine != None:
-                for i in range(0, result.ninstances):
-                    self.engine.provide_result(result.data[:,i].ravel().tolist())
-        except Exception as e:
-            self.logger.warning('%s' % e.message)
-            traceback.print_exc()
-
-    def set_parameter(self, name, value):
-        if self.state != 'idle' or self.training_complete:
-            raise ClassifierException('Can only change this parameter in idle mode, before training.')
-
-        parameter_set = False
-
-        if name == 'cl_type':
-            if value[0].lower() != 'mnec' and value[0].lower() != 'canoncorr':
-                raise ClassifierException(0, "cl_type must be one of: ['MNEC', 'canoncorr'].");
-
-            self.cl_type = value[0]
-            parameter_set = True
-
-        elif name == 'window_size':
-            if len(value) < 1 or (type(value[0]) != float and type(value[0]) != int):
-                raise ClassifierException('Invalid value for window size.')
-            self.window_size = float(value[0])
-            parameter_set = True
-
-        elif name == 'window_step':
-            if len(value) < 1 or (type(value[0]) != float and type(value[0]) != int):
-                raise ClassifierException('Invalid value for window step.')
-            self.window_step = float(value[0])
-            parameter_set = True
-
-        elif name == 'bandpass':
-            if len(value) < 2 or (type(value[0]) != float and type(value[1]) != int) or (type(value[1]) != float and type(value[1]) != int):
-                raise ClassifierException('Bandpass parameter needs two numeric values.')
-
-            self.bandpass = (value[0], value[1])
-            parameter_set = True
-
-        elif name == 'freqs':
-            if len(value) < 1:
-                raise ClassifierException('No value given for stimulus frequencies.')
-
-            self.freqs = []
-            for freq in value:
-                if type(freq) != float and type(freq) != int:
-                    raise ClassifierException('Invalid value for stimulus frequency: %s' % freq)
-                self.freqs.append(float(freq))
-
-            parameter_set = True
-
-        elif name == 'nharmonics':
-            if len(value) < 1:
-                raise ClassifierException('No value given for nharmonics.')
-
-            if type(value[0]) != int:
-                raise ClassifierException('Number of harmonics should be an int value.')
-
-            self.nharmonics = value[0]
-            parameter_set = True
-
-        elif name == 'target_sample_rate':
-            if type(value[0]) != int and type(value[0]) != float:
-                raise ClassifierException('Value for target_sample_rate must be numeric.')
-
-            self.target_sample_rate = value[0]
-            parameter_set = True
-
-        return parameter_set
-
-    def get_parameter(self, name):
-        if name == 'cl_type':
-            return self.cl_type
-        elif name == 'window_step':
-            return self.window_step
-        elif name == 'window_size':
-            return self.window_size
-        elif name == 'target_sample_rate':
-            return self.target_sample_rate
-        elif name == 'bandpass':
-            return self.bandpass
-        elif name == 'freqs':
-            return self.freqs
-        elif name == 'nharmonics':
-            return self.nharmonics
-        else:
-            return False
+import matplotlib.pyplot as plt
+
+import psychic
+import scipy
+import scipy.signal
+import traceback
+import threading
+import numpy as np
+
+from classifier import Classifier
+from filters import OnlineSOSFilter, OnlineFilterBank
+from sliding import SlidingSSVEPScorer
+from fbcca import FilterBankCCA
+from templates import reference_templates, trained_references
+from ..bci_exceptions import ClassifierException
+
+# The types of classifier that can be used, in lower case
+CL_TYPES = ['mnec', 'canoncorr', 'fbcca']
+
+class SSVEP(Classifier):
+    """
+    Implements an online SSVEP classifier that can desinguish between flickering
+    stimuli. Based on the Minimum Energy Combination method, or on (filter
+    bank) canonical correlation analysis.
+
+    Chumerin, N., Manyakov, N. V, Combaz, A., Robben, A., van Vliet, M., Van
+    Hulle, M. M., Manyakov, N., et al. (2011). Steady state visual evoked
+    potential based computer gaming - The Maze. The 4th International ICST
+    Conference on Intelligent Technologies for Interactive Entertainment
+    (INTETAIN). Genoa, Italy, May 25-27, in press.
+    """
+
+    model_attributes = ['cl_type', 'window_size', 'window_step', 'freqs',
+                        'bandpass', 'nharmonics', 'target_sample_rate',
+                        'incremental', 'nbands',
+                        'bp_node', 'resample_node', 'filterbank_node',
+                        'window_node', 'classifier_node', 'pipeline']
+
+    def __init__(self, engine, recorder, window_size=2.0, window_step=0.5, freqs=[60/4., 60/5., 60/6., 60/7.], bandpass=[2, 45], cl_type='MNEC', nharmonics=3, incremental=False, nbands=5):
+        """ Constructor.
+
+        Required parameters:
+        recorder: The Recorder object to read data from
+
+        Keyword parameters (configures the classifier): 
+        window_size: The window size in seconds to use on the data
+        window_step: The window step in seconds to use on the data
+        freqs: The frequencies in Hertz of the SSVEP stimuli to look for.
+        bandpass: [lo, hi] cutoff frequencies for the bandpass filter to use on the data
+        incremental: Score the windows with a SlidingSSVEPScorer, which reuses
+                     the overlap between windows, instead of with psychic.
+                     With cl_type 'canoncorr' the scores are the same. With
+                     'MNEC' they are not: the scorer estimates the noise from
+                     the energy of the channels after removing the
+                     references, psychic from an AR model. Only pays off
+                     when windows are long compared to the window step, see
+                     benchmarks/ssvep_sliding.py.
+        nbands: The number of sub-bands to use with cl_type 'FBCCA'
+        """
+        self.window_size = window_size
+        self.window_step = window_step
+        self.freqs = freqs
+        self.bandpass = bandpass
+        self.nharmonics = nharmonics
+        self.pipeline = None
+        self.filterbank_node = None
+        self.cl_type = cl_type
+        self.incremental = incremental
+        self.nbands = nbands
+
+        # Figure out a sane target sample rate, using only a decimation factor
+        self.target_sample_rate = np.floor(recorder.sample_rate / np.max([1, np.floor(recorder.sample_rate / 200)]))
+    
+        Classifier.__init__(self, engine, recorder)
+
+        # The pipeline needs no data, so it is constructed in the background
+        # right away and whenever a parameter changes. Each construction gets
+        # a generation number, only the latest one is installed.
+        self.pipeline_generation = 0
+        self.pipeline_installed = None
+        self.pipeline_builder = None
+        self._build_pipeline()
+
+    def _build_pipeline(self):
+        """ Construct the pipeline in the background with the current
+        parameters. """
+        self.pipeline_generation += 1
+        self.pipeline_builder = threading.Thread(target=self._pipeline_builder,
+                                                 args=(self.pipeline_generation,))
+        self.pipeline_builder.daemon = True
+        self.pipeline_builder.start()
+
+    def _pipeline_builder(self, generation):
+        try:
+            nodes = self._construct_pipeline()
+        except Exception as e:
+            # _train() tries again and reports the error
+            self.logger.warning('Could not create pipeline: %s' % e)
+            return
+        self._install_pipeline(nodes, generation)
+
+    def _install_pipeline(self, nodes, generation):
+        self.model_lock.acquire()
+        try:
+            if generation == self.pipeline_generation:
+                (self.bp_node, self.resample_node, self.filterbank_node,
+                 self.window_node, self.classifier_node, self.pipeline) = nodes
+                self.pipeline_installed = generation
+        finally:
+            self.model_lock.release()
+
+    def _construct_pipeline(self):
+        """ Create and initialize the nodes of the pipeline, which can take
+        some time. Returns the nodes and the pipeline, without installing
+        them. """
+        self.logger.info('Creating pipeline')
+        self.logger.info("cl_type: %s" % self.cl_type)
+        self.logger.info("freqs: %s" % self.freqs)
+        self.logger.info("device sample_rate: %f" % self.recorder.sample_rate)
+        self.logger.info("target sample_rate: %f" % self.target_sample_rate)
+        self.logger.info("window_size: %f" % self.window_size)
+        self.logger.info("window_step: %f" % self.window_step)
+        self.logger.info("bandpass: %s" % str(self.bandpass))
+        self.logger.info("nharmonics: %s" % self.nharmonics)
+        self.logger.info("incremental: %s" % self.incremental)
+        self.logger.info("nbands: %s" % self.nbands)
+
+        bp_node = OnlineSOSFilter(4, self.bandpass)
+        resample_node = psychic.nodes.Resample(self.target_sample_rate, max_marker_delay=1)
+        window_size = int(self.window_size*self.target_sample_rate)
+        window_step = int(self.window_step*self.target_sample_rate)
+
+        cl_type = self.cl_type.lower()
+        if cl_type not in CL_TYPES:
+            raise ClassifierException("Classifier type must be one of: ['MNEC', 'canoncorr', 'FBCCA'], not %s" % self.cl_type)
+
+        filterbank_node = None
+        if cl_type == 'fbcca':
+            # Split the data into sub-bands after resampling
+            filterbank_node = OnlineFilterBank(4, self._subbands())
+            filterbank_node.design(self.target_sample_rate)
+            window_node = psychic.nodes.OnlineSlidingWindow(window_size, window_step, ref_point=1.0)
+            templates = reference_templates(self.target_sample_rate, self.freqs, self.nharmonics, window_size)
+            classifier_node = FilterBankCCA(templates, len(filterbank_node.bands))
+        elif self.incremental:
+            # The scorer does the windowing itself
+            window_node = SlidingSSVEPScorer(cl_type, self.target_sample_rate, self.freqs, self.nharmonics, window_size, window_step)
+            classifier_node = window_node
+        else:
+            # Each classifier gets its own node, psychic nodes are not meant
+            # to be used by several threads at once. Instead of training it,
+            # it gets the shared references.
+            window_node = psychic.nodes.OnlineSlidingWindow(window_size, window_step, ref_point=1.0)
+            if cl_type == 'mnec':
+                node_class = psychic.nodes.MNEC
+            else:
+                node_class = psychic.nodes.CanonCorr
+            classifier_node = node_class(self.target_sample_rate, self.freqs, self.nharmonics, nsamples=window_size)
+            classifier_node.__dict__.update(trained_references(node_class, self.target_sample_rate, self.freqs, self.nharmonics, window_size))
+
+        # Go over the nodes and initialize them (to avoid having to train later)
+        bp_node.design(self.target_sample_rate)
+        resample_node.old_samplerate = self.recorder.sample_rate
+
+        if filterbank_node:
+            pipeline = psychic.nodes.Chain([bp_node,
+                                            resample_node,
+                                            filterbank_node,
+                                            window_node,
+                                            classifier_node])
+        elif self.incremental:
+            pipeline = psychic.nodes.Chain([bp_node, resample_node, classifier_node])
+        else:
+            pipeline = psychic.nodes.Chain([bp_node,
+                                            resample_node,
+                                            window_node,
+                                            classifier_node])
+        return bp_node, resample_node, filterbank_node, window_node, classifier_node, pipeline
+
+    def _subbands(self):
+        """ The sub-bands for FBCCA. Sub-band n starts just below the n-th
+        harmonic of the lowest stimulus frequency and all sub-bands extend to
+        the upper edge of the bandpass. """
+        lowest = min(self.freqs)
+        hi = self.bandpass[1]
+        bands = []
+        for n in range(1, self.nbands + 1):
+            lo = max(n * lowest - 2, self.bandpass[0])
+            if lo >= hi - 2:
+                break
+            bands.append( (lo, hi) )
+        return bands
+
+    def _reset(self):
+        """ Reset the classifier. Flushes all collected data."""
+        super(SSVEP, self)._reset()
+
+        if self.pipeline:
+            self.window_node.reset()
+
+    def _train(self, d):
+        """ The pipeline is constructed in the background, so training only
+        waits for it to be ready. """
+        self.pipeline_builder.join()
+        if self.pipeline_installed != self.pipeline_generation:
+            # Constructing the pipeline in the background failed
+            self._install_pipeline(self._construct_pipeline(), self.pipeline_generation)
+        self.bp_node.reset()
+        if self.filterbank_node:
+            self.filterbank_node.reset()
+        self.window_node.reset()
+
+        if d:
+            self._save_training_data(d)
+
+        self.logger.info('Training complete')
+        self.training_complete = True
+
+    def load_model(self, model):
+        # Don't let a pipeline that is still under construction replace the
+        # loaded one
+        self.pipeline_generation += 1
+        super(SSVEP, self).load_model(model)
+        self.pipeline_installed = self.pipeline_generation
+
+    def _apply(self, d):
+        """ Apply the classifier on a dataset. """
+        if d.ninstances == 0:
+            return
+
+        try:
+            result = self.pipeline.apply(d)
+            self.logger.debug('Result was: %s at %s' % (result.data.ravel(), result.ids))
+            # send result to client
+            if self.engine != None:
+                results = [result.data[:,i].ravel().tolist() for i in range(result.ninstances)]
+                timestamps = (result.ids[0,:] + self.recorder.T0).tolist()
+                self.engine.provide_results(results, timestamps, coalesce=True)
+        except Exception as e:
+            self.logger.warning('%s' % e.message)
+            traceback.print_exc()
+
+    def set_parameter(self, name, value):
+        if super(SSVEP, self).set_parameter(name, value):
+            return True
+
+        if self.state != 'idle' or self.training_complete:
+            raise ClassifierException('Can only change this parameter in idle mode, before training.')
+
+        parameter_set = False
+
+        if name == 'cl_type':
+            if value[0].lower() not in CL_TYPES:
+                raise ClassifierException("cl_type must be one of: ['MNEC', 'canoncorr', 'FBCCA'].")
+
+            self.cl_type = value[0]
+            parameter_set = True
+
+        elif name == 'window_size':
+            if len(value) < 1 or (type(value[0]) != float and type(value[0]) != int):
+                raise ClassifierException('Invalid value for window size.')
+            self.window_size = float(value[0])
+            parameter_set = True
+
+        elif name == 'window_step':
+            if len(value) < 1 or (type(value[0]) != float and type(value[0]) != int):
+                raise ClassifierException('Invalid value for window step.')
+            self.window_step = float(value[0])
+            parameter_set = True
+
+        elif name == 'bandpass':
+            if len(value) < 2 or (type(value[0]) != float and type(value[1]) != int) or (type(value[1]) != float and type(value[1]) != int):
+                raise ClassifierException('Bandpass parameter needs two numeric values.')
+
+            self.bandpass = (value[0], value[1])
+            parameter_set = True
+
+        elif name == 'freqs':
+            if len(value) < 1:
+                raise ClassifierException('No value given for stimulus frequencies.')
+
+            self.freqs = []
+            for freq in value:
+                if type(freq) != float and type(freq) != int:
+                    raise ClassifierException('Invalid value for stimulus frequency: %s' % freq)
+                self.freqs.append(float(freq))
+
+            parameter_set = True
+
+        elif name == 'nharmonics':
+            if len(value) < 1:
+                raise ClassifierException('No value given for nharmonics.')
+
+            if type(value[0]) != int:
+                raise ClassifierException('Number of harmonics should be an int value.')
+
+            self.nharmonics = value[0]
+            parameter_set = True
+
+        elif name == 'target_sample_rate':
+            if type(value[0]) != int and type(value[0]) != float:
+                raise ClassifierException('Value for target_sample_rate must be numeric.')
+
+            self.target_sample_rate = value[0]
+            parameter_set = True
+
+        elif name == 'nbands':
+            if type(value[0]) != int or value[0] < 1:
+                raise ClassifierException('Number of sub-bands should be a positive int value.')
+
+            self.nbands = value[0]
+            parameter_set = True
+
+        elif name == 'incremental':
+            if type(value[0]) != int:
+                raise ClassifierException('Value for incremental must be 0 or 1.')
+
+            self.incremental = bool(value[0])
+            parameter_set = True
+
+        if parameter_set:
+            self._build_pipeline()
+        return parameter_set
+
+    def get_parameter(self, name):
+        value = super(SSVEP, self).get_parameter(name)
+        if value is not False:
+            return value
+
+        if name == 'cl_type':
+            return self.cl_type
+        elif name == 'window_step':
+            return self.window_step
+        elif name == 'window_size':
+            return self.window_size
+        elif name == 'target_sample_rate':
+            return self.target_sample_rate
+        elif name == 'bandpass':
+            return self.bandpass
+        elif name == 'freqs':
+            return self.freqs
+        elif name == 'nharmonics':
+            return self.nharmonics
+        elif name == 'incremental':
+            return int(self.incremental)
+        elif name == 'nbands':
+            return self.nbands
+        else:
+            return False
@@ -0,0 +1,146 @@
+import threading
+
+import numpy
+
+# Reference templates, shared by all classifiers and sessions. Templates are
+# immutable, so they can be handed out without copying.
+_templates = {}
+_templates_lock = threading.Lock()
+
+# The references psychic's MNEC and CanonCorr nodes compute when they are
+# trained, see trained_references()
+_trained = {}
+_trained_lock = threading.Lock()
+
+class ReferenceTemplates:
+    """
+    The sine/cosine references of a set of SSVEP stimulus frequencies, for
+    windows of a fixed length, and the decompositions used to correlate data
+    with them. Stored as read-only arrays. The references are kept in double
+    precision, as SlidingSSVEPScorer builds running totals from them. The
+    orthonormal bases are float32 to keep them compact. Use
+    reference_templates() to obtain them.
+    """
+
+    def __init__(self, sample_rate, freqs, nharmonics, nsamples):
+        """
+        sample_rate - sample rate of the data in Hz
+        freqs       - frequencies of the stimuli in Hz
+        nharmonics  - number of harmonics of each frequency
+        nsamples    - length of a window in samples
+        """
+        self.sample_rate = sample_rate
+        self.freqs = freqs
+        self.nharmonics = nharmonics
+        self.nsamples = nsamples
+
+        # A sine and a cosine for each harmonic of each frequency:
+        # (freqs x references x samples)
+        t = numpy.arange(nsamples) / float(sample_rate)
+        harmonics = numpy.arange(1, nharmonics + 1)
+        omega = 2 * numpy.pi * numpy.outer(freqs, harmonics)
+        angle = omega[:,:,numpy.newaxis] * t
+        references = numpy.empty((len(freqs), nharmonics, 2, nsamples))
+        references[:,:,0,:] = numpy.sin(angle)
+        references[:,:,1,:] = numpy.cos(angle)
+        references = references.reshape(len(freqs), 2 * nharmonics, nsamples)
+
+        # Orthonormal basis of the centered references of each frequency:
+        # (freqs x samples x references)
+        centered = references - numpy.mean(references, axis=2)[:,:,numpy.newaxis]
+        Q = numpy.array([numpy.linalg.qr(Y.T)[0] for Y in centered])
+
+        self.references = self._freeze(references, numpy.float64)
+        self.Q = self._freeze(Q, numpy.float32)
+
+    def _freeze(self, a, dtype):
+        a = a.astype(dtype)
+        a.flags.writeable = False
+        return a
+
+    def canoncorr(self, X):
+        """ The largest canonical correlation between the channels of a
+        window of data (channels x samples) and the references of each
+        frequency. """
+        X = X - numpy.mean(X, axis=1)[:,numpy.newaxis]
+        Qx = numpy.linalg.qr(X.T)[0]
+        M = numpy.dot(self.Q.transpose(0, 2, 1).reshape(-1, self.nsamples), Qx)
+        M = M.reshape(len(self.freqs), 2 * self.nharmonics, -1)
+        rho = numpy.array([numpy.linalg.svd(m, compute_uv=False)[0] for m in M])
+        return numpy.clip(rho, 0, 1)
+
+def reference_templates(sample_rate, freqs, nharmonics, nsamples):
+    """
+    Returns the ReferenceTemplates for the given sample rate, stimulus
+    frequencies, number of harmonics and window length. They are created once
+    and then shared, so switching between configurations is cheap.
+    """
+    key = (float(sample_rate), tuple([float(f) for f in freqs]),
+           int(nharmonics), int(nsamples))
+
+    _templates_lock.acquire()
+    try:
+        templates = _templates.get(key)
+        if templates is None:
+            templates = ReferenceTemplates(*key)
+            _templates[key] = templates
+    finally:
+        _templates_lock.release()
+
+    return templates
+
+def trained_references(node_class, sample_rate, freqs, nharmonics, nsamples):
+    """
+    Returns the attributes a psychic.nodes.MNEC or psychic.nodes.CanonCorr
+    node fills in when it is trained, as a dictionary of read-only arrays:
+    the sine/cosine references of the stimulus frequencies. Assign them to a
+    new node instead of training it. psychic nodes can't be shared between
+    classifiers, as they are not meant to be used by several threads at
+    once, but their references can.
+
+    The names and layout of these attributes are internal to psychic, so a
+    node is trained once for each configuration to obtain them. Arrays that
+    hold the references of reference_templates() are replaced by views of
+    those, so all classifiers use the same copy.
+    """
+    key = (node_class, float(sample_rate), tuple([float(f) for f in freqs]),
+           int(nharmonics), int(nsamples))
+
+    _trained_lock.acquire()
+    try:
+        attributes = _trained.get(key)
+        if attributes is None:
+            node = node_class(sample_rate, freqs, nharmonics, nsamples=nsamples)
+            untrained = dict(vars(node))
+            node.train_(None)
+
+            references = reference_templates(sample_rate, freqs, nharmonics, nsamples).references
+            attributes = {}
+            for name, value in vars(node).items():
+                if name not in untrained or value is not untrained[name]:
+                    attributes[name] = _share(value, references)
+            _trained[key] = attributes
+    finally:
+        _trained_lock.release()
+
+    return attributes
+
+def _share(value, references):
+    """ Returns value with its arrays made read-only. An array that holds
+    the references (freqs x references x samples), reshaped or as the
+    transpose of their rows, is replaced by a view of them. """
+    if isinstance(value, list):
+        if len(value) == len(references):
+            return [_share(v, r) for v, r in zip(value, references)]
+        return [_share(v, references) for v in value]
+    if not isinstance(value, numpy.ndarray):
+        return value
+
+    if value.size == references.size and value.dtype == references.dtype:
+        rows = references.reshape(-1, references.shape[-1])
+        for candidate in [references.reshape(value.shape), rows.T]:
+            if candidate.shape == value.shape and numpy.allclose(candidate, value):
+                return candidate
+
+    value.flags.writeable = False
+    return value
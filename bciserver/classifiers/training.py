@@ -0,0 +1,411 @@
+import logging
+import threading
+import multiprocessing
+import Queue
+
+import numpy
+import sklearn.linear_model
+import sklearn.cross_validation
+from sklearn.externals import joblib
+
+from ..eegdevices import precision_timer
+
+def _worker(function, args, queue):
+    """ Entry point of the worker process. """
+    def progress(fraction):
+        queue.put( ('progress', fraction) )
+
+    try:
+        queue.put( ('done', function(*args, progress=progress)) )
+    except Exception as e:
+        queue.put( ('error', '%s' % e) )
+
+class TrainingJob(threading.Thread):
+    """
+    Runs a training function in a worker process, so the heavy computations
+    don't hold the GIL of the server. The function is called as
+    function(*args, progress=callback) and must be defined at module level, as
+    both the function and its arguments are pickled and send to the worker.
+    It can report its progress by calling the callback with the fraction of
+    the work done. Its return value is send back to the server.
+
+    This thread waits for the worker and calls:
+      on_progress(fraction, elapsed, remaining) - whenever progress is
+                                                  reported, times in seconds
+      on_complete(job, result)                  - when the function returned
+      on_error(job, message)                    - when the function failed
+    on_complete() or on_error() is called exactly once, unless the job is
+    cancelled. The semaphore given as slot, if any, is released when the job
+    is done, cancelled or not.
+    """
+
+    def __init__(self, function, args, slot, on_progress, on_complete, on_error):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.logger = logging.getLogger('Training')
+
+        self.on_progress = on_progress
+        self.on_complete = on_complete
+        self.on_error = on_error
+        self.slot = slot
+
+        self.queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=_worker,
+                                               args=(function, args, self.queue))
+        self.process.daemon = True
+
+        self.cancelled = False
+        self.finished = threading.Event()
+        self.start_time = None
+        self.elapsed = 0.0
+
+    def start(self):
+        self.start_time = precision_timer()
+        self.process.start()
+        threading.Thread.start(self)
+
+    def cancel(self):
+        """ Abort the training. None of the callbacks is called afterwards. """
+        self.cancelled = True
+        if self.process.is_alive():
+            self.process.terminate()
+        self.finished.wait()
+
+    def run(self):
+        try:
+            self._wait_for_worker()
+        finally:
+            self.elapsed = precision_timer() - self.start_time
+            if self.slot:
+                self.slot.release()
+            self.finished.set()
+
+    def _wait_for_worker(self):
+        while not self.cancelled:
+            try:
+                kind, value = self.queue.get(timeout=0.5)
+            except Queue.Empty:
+                if not self.process.is_alive() and self.queue.empty():
+                    if not self.cancelled:
+                        self.on_error(self, 'Training process exited unexpectedly')
+                    return
+                continue
+
+            elapsed = precision_timer() - self.start_time
+            if kind == 'progress':
+                if value > 0:
+                    remaining = elapsed * (1 - value) / value
+                else:
+                    remaining = 0.0
+                self.on_progress(value, elapsed, remaining)
+                continue
+
+            self.process.join()
+            self.elapsed = elapsed
+            if self.cancelled:
+                return
+            elif kind == 'done':
+                self.on_complete(self, value)
+            else:
+                self.on_error(self, value)
+            return
+
+class LinearClassifier:
+    """
+    A trained linear classifier for two classes. Keeps only the weights, so
+    it pickles small and doesn't depend on sklearn when applied. The scaling
+    of the features the classifier was trained with is folded into the
+    weights.
+    """
+
+    def __init__(self, coef, intercept, temperature=1.0):
+        """
+        coef        - weight of each feature
+        intercept   - the bias
+        temperature - scale of the scores, see posterior_margin() in p300.py.
+                      Dividing the scores by it gives the log-odds of the
+                      second class.
+        """
+        self.coef = numpy.asarray(coef, dtype=float)
+        self.intercept = float(intercept)
+        self.temperature = float(temperature)
+
+    def apply(self, d):
+        """ Returns the scores for the instances of the given dataset, as an
+        array of shape (2, instances): the first row holds the score of the
+        first class, the second row that of the second class. """
+        scores = numpy.dot(self.coef, d.X) + self.intercept
+        return numpy.vstack( (-scores, scores) )
+
+def standardization(X):
+    """
+    Returns the mean and standard deviation of each feature of the averages
+    generated by repetition_averages(), as a (mean, scale) tuple. They are
+    computed in closed form: an average of n repetitions drawn with
+    replacement varies around the mean of its instance with the variance of
+    the repetitions divided by n.
+
+    X - trials, array of shape (features, repetitions, instances)
+    """
+    nrepetitions = X.shape[1]
+    instance_means = numpy.mean(X, axis=1)
+    mean = numpy.mean(instance_means, axis=1)
+    variance = (numpy.var(instance_means, axis=1) +
+                numpy.mean(numpy.var(X, axis=1), axis=1) / nrepetitions)
+    scale = numpy.sqrt(variance)
+    scale[scale == 0] = 1
+    return mean, scale
+
+def repetition_averages(X, y, blowup, batch_size, rng):
+    """
+    Generates averages of randomly drawn repetitions, in batches. For each
+    instance, blowup averages are made of as many repetitions as the instance
+    has, drawn with replacement. Only one batch exists in memory at any time,
+    so memory use does not depend on the blowup factor.
+
+    X          - trials, array of shape (features, repetitions, instances)
+    y          - class of each instance
+    blowup     - number of averages to make of each instance
+    batch_size - number of averages in a batch (approximately)
+    rng        - numpy.random.RandomState to draw the repetitions with
+
+    Yields (averages, classes) tuples, with averages of shape
+    (averages, features), in random order.
+    """
+    nfeatures, nrepetitions, ninstances = X.shape
+    instances_per_batch = max(1, batch_size // blowup)
+    order = rng.permutation(ninstances)
+    p = numpy.ones(nrepetitions) / nrepetitions
+
+    for start in range(0, ninstances, instances_per_batch):
+        instances = order[start:start + instances_per_batch]
+
+        # Instead of gathering the drawn repetitions, count how often each
+        # repetition is drawn and take weighted sums.
+        weights = rng.multinomial(nrepetitions, p, size=(len(instances), blowup))
+        weights = weights / float(nrepetitions)
+
+        # numpy.dot releases the GIL, so searches running in threads (see
+        # train_averaged_svm) can generate their averages in parallel
+        averages = numpy.empty((len(instances), blowup, nfeatures))
+        for i, instance in enumerate(instances):
+            averages[i] = numpy.dot(weights[i], X[:,:,instance].T)
+        averages = averages.reshape(-1, nfeatures)
+        classes = numpy.repeat(y[instances], blowup)
+
+        shuffle = rng.permutation(len(classes))
+        yield averages[shuffle], classes[shuffle]
+
+def _fit_hinge(X, y, C, scaling, blowup, epochs, batch_size, rng, progress, svm=None):
+    """ Train a linear SVM with averaged stochastic gradient descent on the
+    standardized averages generated by repetition_averages(), calling
+    progress() after each epoch. When an SVM is given, training continues
+    from its weights. """
+    # The regularization of SGDClassifier is scaled differently than the C of
+    # an SVM.
+    alpha = 1.0 / (C * X.shape[2] * blowup)
+    if svm is None:
+        # The steps of SGD grow with C, which makes the weights jump around
+        # for large C. Averaging the weights over the steps smooths this out.
+        # The first epoch is left out of the average, as the weights are
+        # still far off then.
+        svm = sklearn.linear_model.SGDClassifier(loss='hinge', alpha=alpha,
+                                                 average=X.shape[2] * blowup,
+                                                 random_state=rng)
+    else:
+        svm.set_params(alpha=alpha)
+
+    mean, scale = scaling
+    classes = numpy.unique(y)
+    for epoch in range(epochs):
+        for averages, labels in repetition_averages(X, y, blowup, batch_size, rng):
+            averages -= mean
+            averages /= scale
+            svm.partial_fit(averages, labels, classes=classes)
+        progress(1)
+    return svm
+
+def _fit_path(X, y, C_values, scaling, blowup, epochs, warm_epochs, batch_size,
+              rng, progress, score=None, patience=None):
+    """ Train an SVM for each C value, in increasing order. Each SVM starts
+    from the weights of the previous one, so it needs fewer epochs. Each SVM
+    is scored with score(svm), if given. With patience, training stops when
+    the score didn't improve for that many C values in a row. Returns the
+    last SVM and the scores, None for the C values that were pruned. """
+    scores = []
+    svm = None
+    best = -numpy.inf
+    misses = 0
+    for C in C_values:
+        n = epochs if svm is None else warm_epochs
+        if patience is not None and misses >= patience:
+            scores.append(None)
+            progress(n)
+            continue
+
+        svm = _fit_hinge(X, y, C, scaling, blowup, n, batch_size, rng, progress, svm)
+        if score is None:
+            continue
+
+        scores.append(score(svm))
+        if scores[-1] > best:
+            best = scores[-1]
+            misses = 0
+        else:
+            misses += 1
+
+    return svm, scores
+
+def _search_fold(X, y, means, train, test, C_values, blowup, epochs,
+                 warm_epochs, batch_size, seed, patience, progress):
+    """ Score the C values on one cross-validation fold, see _fit_path().
+    Returns the scores, None for the C values that were pruned, and the
+    decision values of the test instances for each C value that was scored.
+    """
+    X = X[:,:,train]
+    mean, scale = scaling = standardization(X)
+    test_means = (means[test] - mean) / scale
+    decisions = []
+
+    def score(svm):
+        decisions.append(svm.decision_function(test_means))
+        return svm.score(test_means, y[test])
+
+    scores = _fit_path(X, y[train], C_values, scaling, blowup, epochs, warm_epochs,
+                       batch_size, numpy.random.RandomState(seed), progress,
+                       score, patience)[1]
+    return scores, decisions
+
+def fit_temperature(scores, y):
+    """
+    Fits P(y = 1) = 1 / (1 + exp(-(a * score + b))) to the decision values
+    of a classifier with Platt's method: logistic regression on the scores,
+    with targets smoothed by the number of instances of each class, so the
+    fit stays finite when the scores separate the classes. Returns the
+    temperature 1 / a, or infinity when the scores don't predict the class.
+
+    scores - decision values, positive for class 1
+    y      - class of each instance, 0 or 1
+    """
+    scores = numpy.asarray(scores, dtype=float)
+    positive = numpy.asarray(y) == 1
+    npositive = numpy.sum(positive)
+    nnegative = len(positive) - npositive
+    t = numpy.where(positive, (npositive + 1.0) / (npositive + 2.0), 1.0 / (nnegative + 2.0))
+
+    def loss(a, b):
+        z = a * scores + b
+        return numpy.sum(t * numpy.logaddexp(0, -z) + (1 - t) * numpy.logaddexp(0, z))
+
+    # Newton's method with backtracking
+    a, b = 0.0, numpy.log((npositive + 1.0) / (nnegative + 1.0))
+    current = loss(a, b)
+    for iteration in range(100):
+        p = 1 / (1 + numpy.exp(-(a * scores + b)))
+        w = numpy.maximum(p * (1 - p), 1e-12)
+        gradient = numpy.array([numpy.dot(p - t, scores), numpy.sum(p - t)])
+        hessian = numpy.array([[numpy.dot(w, scores ** 2) + 1e-12, numpy.dot(w, scores)],
+                               [numpy.dot(w, scores), numpy.sum(w) + 1e-12]])
+        step = numpy.linalg.solve(hessian, gradient)
+
+        size = 1.0
+        while size > 1e-10:
+            new = loss(a - size * step[0], b - size * step[1])
+            if new < current:
+                break
+            size /= 2
+        else:
+            break
+
+        a, b = a - size * step[0], b - size * step[1]
+        if current - new < 1e-10 * max(1.0, abs(current)):
+            break
+        current = new
+
+    return 1.0 / a if a > 0 else numpy.inf
+
+def train_averaged_svm(X, y, blowup, C_values, folds=5, n_jobs=-1,
+                       patience=None, epochs=5, warm_epochs=2, batch_size=1000,
+                       seed=0, progress=None):
+    """
+    Trains a linear SVM on averages of randomly drawn repetitions of the
+    trials, see repetition_averages(). The averages are generated as they are
+    needed and fed to the SVM in batches, so the augmented dataset never
+    exists in memory. The features are standardized, see standardization().
+    Meant to run in a worker process, see TrainingJob.
+
+    The C parameter is selected through stratified cross-validation over the
+    instances, scoring each fold on the plain average of all repetitions of
+    its instances. Within a fold, the SVM for each C value is warm-started
+    from the SVM for the previous, smaller, C value, so the C values of a
+    fold are trained one after the other. The folds are searched in parallel
+    threads. With early stopping, a fold stops searching when the score
+    didn't improve for a number of C values in a row. Only C values scored on
+    all folds are considered. The final SVM is trained on all instances along
+    the same path of C values, so it is trained the same way as the SVMs it
+    was selected by.
+
+    The temperature of the classifier is fitted to the decision values of
+    the selected C value on the cross-validation folds, see fit_temperature().
+
+    X           - trials, array of shape (features, repetitions, instances)
+    y           - class of each instance, 0 or 1
+    blowup      - number of averages to make of each instance
+    C_values    - the values of C to choose from
+    folds       - number of cross-validation folds
+    n_jobs      - number of folds to search at the same time, -1 to use all
+                  cores
+    patience    - number of C values without improvement after which a fold
+                  stops searching, None to search all C values
+    epochs      - number of passes over the averages
+    warm_epochs - number of passes over the averages when warm-starting
+    batch_size  - number of averages to feed to the SVM at once
+    seed        - seed for drawing the repetitions
+
+    Returns a LinearClassifier, the C value that was selected and the time
+    the search took in seconds.
+    """
+    C_values = numpy.sort(C_values)
+    means = numpy.mean(X, axis=1).T
+    path_epochs = epochs + (len(C_values) - 1) * warm_epochs
+    nepochs = (folds + 1) * path_epochs
+    done = [0]
+    lock = threading.Lock()
+
+    def epochs_done(n):
+        with lock:
+            done[0] += n
+            if progress:
+                progress(done[0] / float(nepochs))
+
+    start_time = precision_timer()
+    cv = list(sklearn.cross_validation.StratifiedKFold(y, folds))
+    fold_results = joblib.Parallel(n_jobs=n_jobs, backend='threading')(
+        joblib.delayed(_search_fold)(X, y, means, train, test, C_values, blowup,
+                                     epochs, warm_epochs, batch_size, seed + fold,
+                                     patience, epochs_done)
+        for fold, (train, test) in enumerate(cv))
+    search_time = precision_timer() - start_time
+
+    scores = []
+    for i in range(len(C_values)):
+        fold_score = [s[i] for s, d in fold_results]
+        if None in fold_score:
+            scores.append(-numpy.inf)
+        else:
+            scores.append(numpy.mean(fold_score))
+
+    best = int(numpy.argmax(scores))
+    decisions = numpy.hstack([d[best] for s, d in fold_results])
+    tested = numpy.hstack([y[test] for train, test in cv])
+    temperature = fit_temperature(decisions, tested)
+
+    mean, scale = scaling = standardization(X)
+    svm = _fit_path(X, y, C_values[:best + 1], scaling, blowup, epochs, warm_epochs,
+                    batch_size, numpy.random.RandomState(seed), epochs_done)[0]
+    epochs_done((len(C_values) - 1 - best) * warm_epochs)
+
+    # Fold the standardization into the weights
+    coef = svm.coef_[0] / scale
+    intercept = svm.intercept_[0] - numpy.dot(coef, mean)
+    return LinearClassifier(coef, intercept, temperature), C_values[best], search_time
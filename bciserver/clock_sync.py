@@ -0,0 +1,148 @@
+import threading
+from collections import deque
+
+from eegdevices import precision_timer
+
+class ClockSync:
+    """
+    Estimates the relation between the clock of the client and the clock of
+    the server (precision_timer), so timestamps supplied by the client can be
+    mapped onto the server clock.
+
+    The estimate is obtained NTP-style from a series of ping/pong exchanges.
+    The server sends a ping stamped with its own clock (t1), the client
+    stamps the moment it receives the ping (t2) and the moment it sends its
+    reply (t3) with its own clock, and the server stamps the moment the reply
+    arrives (t4). For each exchange this gives an estimate of the offset
+    between the clocks and the round trip delay:
+
+        offset = ((t2 - t1) + (t3 - t4)) / 2
+        delay  = (t4 - t1) - (t3 - t2)
+
+    The error of each offset estimate is bounded by half the round trip delay.
+    A weighted linear fit through the offsets, favouring the exchanges with
+    the shortest delays, yields both the offset and the drift of the client
+    clock:
+
+        client_time = server_time + offset + drift * (server_time - reference)
+
+    As long as no exchanges have been performed, client timestamps are assumed
+    to be on the server clock already.
+    """
+
+    def __init__(self, max_samples=64, min_drift_span=10.0):
+        """
+        max_samples    - maximum number of exchanges to base the estimate on,
+                         older exchanges are discarded.
+        min_drift_span - minimum time span (in seconds) the exchanges must
+                         cover before the drift is estimated.
+        """
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=max_samples)
+        self.min_drift_span = min_drift_span
+        self.outstanding = {}
+        self.next_seq = 0
+        self._reset_estimate()
+
+    def _reset_estimate(self):
+        self.offset = 0.0
+        self.drift = 0.0
+        self.reference = 0.0
+        self.uncertainty = None
+
+    def reset(self):
+        """ Forget all exchanges and the current estimate. """
+        self.lock.acquire()
+        self.samples.clear()
+        self.outstanding.clear()
+        self._reset_estimate()
+        self.lock.release()
+
+    def ping(self):
+        """ Start a new exchange. Returns a (sequence number, server time)
+        pair to send to the client. """
+        self.lock.acquire()
+        seq = self.next_seq
+        self.next_seq += 1
+        t1 = precision_timer()
+        self.outstanding[seq] = t1
+
+        # Forget about pings the client never answered
+        if len(self.outstanding) > self.samples.maxlen:
+            del self.outstanding[min(self.outstanding)]
+        self.lock.release()
+
+        return seq, t1
+
+    def pong(self, seq, t2, t3=None):
+        """ Complete an exchange.
+
+        seq - sequence number of the ping
+        t2  - client time at which the ping was received
+        t3  - client time at which the reply was send. Defaults to t2.
+
+        Returns the round trip delay of the exchange, or None if the sequence
+        number is unknown.
+        """
+        t4 = precision_timer()
+        if t3 == None:
+            t3 = t2
+
+        self.lock.acquire()
+        try:
+            t1 = self.outstanding.pop(seq, None)
+            if t1 == None:
+                return None
+
+            offset = ((t2 - t1) + (t3 - t4)) / 2.0
+            delay = max((t4 - t1) - (t3 - t2), 1e-6)
+            self.samples.append( ((t1 + t4) / 2.0, offset, delay) )
+            self._update_estimate()
+            return delay
+        finally:
+            self.lock.release()
+
+    def _update_estimate(self):
+        # Only use the exchanges with the shortest round trip delays, the
+        # others most likely suffered from queueing somewhere along the way.
+        delays = sorted([s[2] for s in self.samples])
+        max_delay = delays[(len(delays) - 1) // 2]
+        samples = [s for s in self.samples if s[2] <= max_delay]
+
+        weights = [1.0 / (s[2] ** 2) for s in samples]
+        total = sum(weights)
+        t_mean = sum([w * s[0] for w, s in zip(weights, samples)]) / total
+        o_mean = sum([w * s[1] for w, s in zip(weights, samples)]) / total
+
+        span = samples[-1][0] - samples[0][0]
+        drift = 0.0
+        if span >= self.min_drift_span:
+            var = sum([w * (s[0] - t_mean) ** 2 for w, s in zip(weights, samples)])
+            if var > 0:
+                cov = sum([w * (s[0] - t_mean) * (s[1] - o_mean)
+                           for w, s in zip(weights, samples)])
+                drift = cov / var
+
+        residual = sum([w * (s[1] - o_mean - drift * (s[0] - t_mean)) ** 2
+                        for w, s in zip(weights, samples)]) / total
+
+        self.reference = t_mean
+        self.offset = o_mean
+        self.drift = drift
+        self.uncertainty = delays[0] / 2.0 + residual ** 0.5
+
+    def to_server_time(self, client_time):
+        """ Map a timestamp from the client clock onto the server clock. """
+        self.lock.acquire()
+        server_time = (self.reference +
+                       (client_time - self.reference - self.offset) / (1.0 + self.drift))
+        self.lock.release()
+        return server_time
+
+    def get_estimate(self):
+        """ Returns (offset, drift, uncertainty, number of exchanges). The
+        uncertainty is None as long as no exchanges have been performed. """
+        self.lock.acquire()
+        estimate = (self.offset, self.drift, self.uncertainty, len(self.samples))
+        self.lock.release()
+        return estimate
@@ -0,0 +1,85 @@
+import logging
+import importlib
+import threading
+
+class Registry:
+    """
+    Maps names to classes living in the modules of a package. A module is
+    only imported when its class is needed for the first time, so drivers and
+    classifiers with heavy or missing dependencies (USB libraries, DLLs,
+    sklearn) don't slow down the start of the server. Whether a module can be
+    imported is remembered, together with the error if it can't.
+
+    Supports the 'in' operator and [] to obtain a class, like a dictionary.
+    """
+
+    def __init__(self, package, logger_name):
+        """
+        package     - full name of the package containing the modules
+        logger_name - name of the logger to report import errors to
+        """
+        self.package = package
+        self.logger = logging.getLogger(logger_name)
+        self.lock = threading.Lock()
+
+        self.entry_points = {}
+        self.classes = {}
+        self.errors = {}
+
+    def register(self, name, module, class_name):
+        """ Register the class with the given name in the given module of the
+        package under a name. The module is not imported yet. """
+        self.entry_points[name] = (module, class_name)
+
+    def keys(self):
+        """ Returns all registered names, whether their module can be
+        imported or not. """
+        return self.entry_points.keys()
+
+    def __contains__(self, name):
+        return name in self.entry_points
+
+    def __getitem__(self, name):
+        return self.load(name)
+
+    def load(self, name):
+        """ Returns the class registered under the given name, importing its
+        module if needed. Raises KeyError for unknown names and the error
+        that occurred while importing the module if it couldn't be imported.
+        """
+        module, class_name = self.entry_points[name]
+
+        self.lock.acquire()
+        try:
+            if name in self.classes:
+                return self.classes[name]
+            if name in self.errors:
+                raise self.errors[name]
+
+            try:
+                cls = getattr(importlib.import_module('%s.%s' % (self.package, module)),
+                              class_name)
+            except Exception as e:
+                # Drivers can fail with other errors than ImportError, for
+                # example when a DLL can't be loaded
+                self.errors[name] = e
+                self.logger.debug('%s unavailable: %s' % (name, e))
+                raise
+
+            self.classes[name] = cls
+            return cls
+        finally:
+            self.lock.release()
+
+    def available(self):
+        """ Returns the names of the classes that can be loaded. All modules
+        are imported the first time to find out, after that the outcome is
+        cached. """
+        names = []
+        for name in sorted(self.entry_points):
+            try:
+                self.load(name)
+                names.append(name)
+            except Exception:
+                pass
+        return names
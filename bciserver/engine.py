@@ -1,238 +1,311 @@
-import matplotlib
-matplotlib.use('Agg')
-
-import classifiers
-import eegdevices
-
-from network import ClientHandler
-
-import logging
-import socket
-import argparse
-
-from bci_exceptions import *
-
-class Engine:
-    def __init__(self, port):
-        self.classifier = None
-        self.recorder = None
-        self.logger = logging.getLogger('ENGINE')
-        self.ch = None
-        self.port = port
-        self.running = False
-
-    def run(self):
-        # Wait for incoming TCP/IP connections
-        self.running = True
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            self.server_socket.bind( ('', self.port) )
-
-            self.logger.info('Awaiting network connection on port %d' % self.port)
-            self.server_socket.settimeout(1)
-            self.server_socket.listen(1)
-
-            self.connected = False
-            while self.running:
-                try:
-                    (client_socket, address) = self.server_socket.accept()
-                    self.ch = ClientHandler(client_socket, self)
-                    self.connected = True
-
-                    self.ch.run()
-                    self.connected = False
-
-                    if self.classifier:
-                        self.classifier.stop()
-                        self.classifier = None
-                    if self.recorder:
-                        self.recorder.stop()
-                        self.recorder = None
-
-                except socket.timeout:
-                    pass
-                except KeyboardInterrupt:
-                    break
-
-        except Exception as e:
-            self.logger.error('%s' % e)
-            self.stop()
-            raise
-
-        self.stop()
-
-    def stop(self):
-        if self.classifier:
-            self.classifier.stop()
-        if self.recorder:
-            self.recorder.stop()
-        if self.server_socket:
-            self.server_socket.close()
-        self.running = False
-        print 'Stopped.'
-
-    def provide_devices(self):
-        return eegdevices.available_devices.keys()
-
-    def set_device(self, name):
-        if not name in eegdevices.available_devices:
-            raise EngineException(101, 'Recording device not available')
-
-        try:
-            if self.recorder:
-                self.logger.info('Switching device.')
-                self.recorder.stop()
-            self.recorder = eegdevices.available_devices[name]()
-            self.logger.info('Selected device: %s.' % name)
-        except IOError as e:
-            raise EngineException(202, e.strerror)
-
-    def open_device(self):
-        if not self.recorder:
-            raise EngineException(102, 'Please specify a recording device first')
-        self.logger.info('Opening device.')
-
-        if not self.recorder.running:
-            self.recorder.start()
-        else:
-            print 'Device already opened'
-
-        if self.classifier and not self.classifier.running:
-            self.classifier.start()
-
-    def provide_classifiers(self):
-        return classifiers.available_classifiers.keys()
-
-    def set_classifier(self, name):
-        if not self.recorder:
-            raise EngineException(201, 'Please specify a recording device first')
-        if not name in classifiers.available_classifiers:
-            raise EngineException(202, 'Classifier not available')
-
-        if self.classifier:
-            self.logger.info('Switching classifier.')
-            self.classifier.stop()
-
-        self.logger.info('Loading classifier: ' + name)
-        self.classifier = classifiers.available_classifiers[name](self, self.recorder)
-
-        if self.recorder.running:
-            self.classifier.start()
-
-    def set_device_parameter(self, name, values):
-        if not self.recorder:
-            raise EngineException(301, 'Please specify a recording device first')
-
-        if not self.recorder.set_parameter(name, values):
-            raise EngineException(303, 'Unknown device parameter')
-
-    def get_device_parameter(self, name):
-        if not self.recorder:
-            raise EngineException(301, 'Please specify a recording device first')
-
-        value = self.recorder.get_parameter(name)
-        if not value:
-            raise EngineException(303, 'Unknown device parameter')
-        return value
-
-    def set_classifier_parameter(self, name, values):
-        if not self.classifier:
-            raise EngineException(302, 'Please specify a classifier first')
-
-        if not self.classifier.set_parameter(name, values):
-            raise EngineException(304, 'Unknown classifier parameter')
-
-    def get_classifier_parameter(self, name):
-        if not self.classifier:
-            raise EngineException(302, 'Please specify a classifier first')
-
-        value = self.classifier.get_parameter(name)
-        if not value:
-            raise EngineException(304, 'Unknown classifier parameter')
-        return value
-
-    def set_mode(self, mode):
-        if mode != 'idle' and mode != 'data-collect' and mode != 'training' and mode != 'application':
-            raise EngineException(401, 'Invalid mode requested')
-        if not self.classifier:
-            raise EngineException(402, 'Please specify a classifier first')
-
-        self.classifier.change_state(mode)
-
-    def get_mode(self):
-        if not self.classifier:
-            raise EngineException(402, 'Please specify a classifier first')
-        return self.classifier.state
-
-    def provide_mode(self, mode):
-        if self.ch:
-            self.ch.provide_mode(mode)
-
-    def set_marker(self, code, type, timestamp):
-        if not self.recorder:
-            raise EngineException(301, 'Please specify a recording device first')
-
-        self.recorder.set_marker(code, type, timestamp)
-
-    def provide_result(self, result, timestamp=None):
-        if self.ch:
-            self.ch.provide_result(result, timestamp)
-
-    def error(self, e):
-        if self.ch:
-            self.ch.error(e)
-
-def main():
-    class VAction(argparse.Action):
-        def __call__(self, parser, args, values, option_string=None):
-            if values==None:
-                values='1'
-            try:
-                values=int(values)
-            except ValueError:
-                values=values.count('v')+1
-            setattr(args, self.dest, values)
-
-    print '''
-K.U.Leuven BCI server -- Marijn van Vliet <marijn.vanvliet@med.kuleuven.be>
-Copyright computational neuroscience group, K.U.Leuven (2013)
-'''
-    parser = argparse.ArgumentParser(description='BCI EEG data recorder and classifier')
-    parser.add_argument('-p', '--network-port', metavar='N', type=int, default=9000, help='Set the port number on which the recorder will listen to incoming connections from Unity. [9000]')
-    parser.add_argument('-l', '--log', metavar='File', help='Specify a file to write any log messages to.')
-    parser.add_argument('-v', nargs='?', action=VAction, dest='verbose', help='Be more verbose. Repeat this argument to be even more verbose.')
-    args = parser.parse_args()
-
-    # Setup logging
-    if args.log:
-        ch = logging.FileHandler(args.log)
-    else:
-        ch = logging.StreamHandler()
-
-    if args.verbose == None:
-        ch.setLevel(logging.WARNING)
-    elif args.verbose == 1:
-        ch.setLevel(logging.INFO)
-    else:
-        ch.setLevel(logging.DEBUG)
-
-    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    ch.setFormatter(formatter)
-    logger = logging.getLogger()
-
-    if args.verbose == None:
-        logger.setLevel(logging.WARNING)
-    elif args.verbose == 1:
-        logger.setLevel(logging.INFO)
-    else:
-        logger.setLevel(logging.DEBUG)
-
-    logger.addHandler(ch)
-
-    # Check if all devices loaded properly
-    for module, error in eegdevices.device_errors.items():
-        logging.getLogger('EEG-Devices').debug('Device %s unavailable: %s' % (module, error.message))
-
-    # Start engine
-    e = Engine( int(args.network_port) )
-    e.run()
+# Debug images are rendered without a display. This only selects the
+# backend, pyplot is imported by psychic and the classifiers.
+import matplotlib
+matplotlib.use('Agg')
+
+from network import ClientHandler
+from session import Session, stop_concurrently
+from udp_markers import MarkerListener
+
+import os
+import re
+import logging
+import socket
+import select
+import errno
+import threading
+import argparse
+
+from bci_exceptions import *
+
+def _wakeup_pair():
+    """ Returns a pair of connected sockets, used to wake up select(). Pipes
+    can't be used with select() on Windows, so a loopback TCP connection is
+    used instead. """
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind( ('127.0.0.1', 0) )
+    listener.listen(1)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sender.connect(listener.getsockname())
+    receiver, address = listener.accept()
+    listener.close()
+
+    sender.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sender.setblocking(False)
+    receiver.setblocking(False)
+    return receiver, sender
+
+# Clients are attached to this session when they connect
+DEFAULT_SESSION = 'default'
+
+# Session names are used as directory names
+valid_session_name = re.compile(r'^[A-Za-z0-9_\-]+$').match
+
+class Engine:
+    """
+    Accepts client connections and manages the sessions they are attached to.
+    """
+
+    def __init__(self, port, udp_port=None, session_dir='sessions', max_training_jobs=1,
+                 model_dir='models'):
+        self.logger = logging.getLogger('ENGINE')
+        self.port = port
+        self.udp_port = udp_port
+        self.session_dir = session_dir
+        self.model_dir = model_dir
+        self.marker_listener = None
+        self.server_socket = None
+        self.wakeup_sender = None
+        self.running = False
+
+        self.sessions = {}
+        self.clients = []
+
+        # Threads stopping the sessions that lost their last client
+        self.stopping = []
+
+        # Limits the number of classifiers training at the same time, so heavy
+        # training jobs don't starve the sessions that are running
+        self.training_slots = threading.Semaphore(max_training_jobs)
+
+    def run(self):
+        # Wait for incoming TCP/IP connections. A single thread waits for
+        # connections, data from the clients and wake-up calls at the same
+        # time, so everything is handled as soon as it happens.
+        self.running = True
+        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.wakeup_receiver, self.wakeup_sender = _wakeup_pair()
+        try:
+            if os.name == 'nt':
+                # On Windows, SO_REUSEADDR would let us bind to a port another
+                # server is still using. Make sure no one else can bind to it.
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_EXCLUSIVEADDRUSE, 1)
+            else:
+                # Allow restarting the server while old connections linger
+                self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server_socket.bind( ('', self.port) )
+
+            self.logger.info('Awaiting network connections on port %d' % self.port)
+            self.server_socket.listen(5)
+
+            # Optionally receive markers over UDP as well
+            if self.udp_port != None:
+                self.marker_listener = MarkerListener(self, self.udp_port)
+                self.marker_listener.start()
+
+            # Design the common filters in the background, so the first
+            # training doesn't have to
+            prewarm = threading.Thread(target=self._prewarm_filters)
+            prewarm.daemon = True
+            prewarm.start()
+
+            while self.running:
+                rlist = [self.wakeup_receiver, self.server_socket]
+                rlist += [ch.socket for ch in self.clients]
+
+                try:
+                    readable = select.select(rlist, [], [])[0]
+                except select.error as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+                except KeyboardInterrupt:
+                    break
+
+                if self.wakeup_receiver in readable:
+                    self.wakeup_receiver.recv(4096)
+
+                if self.server_socket in readable:
+                    self._accept()
+
+                for ch in list(self.clients):
+                    if ch.socket in readable:
+                        if not ch.handle_read():
+                            self._disconnect(ch)
+                    elif not ch.running:
+                        self._disconnect(ch)
+
+        except Exception as e:
+            self.logger.error('%s' % e)
+            self._shutdown()
+            raise
+
+        self._shutdown()
+
+    def _accept(self):
+        (client_socket, address) = self.server_socket.accept()
+
+        # Don't let Nagle's algorithm hold back our messages
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        ch = ClientHandler(client_socket, self)
+        self.clients.append(ch)
+        ch.start()
+        self.attach(ch, DEFAULT_SESSION)
+
+    def _disconnect(self, ch):
+        self.clients.remove(ch)
+        self.detach(ch)
+        ch.close()
+
+    def _shutdown(self):
+        for ch in self.clients:
+            ch.session = None
+            ch.close()
+        self.clients = []
+
+        stop_concurrently(self.sessions.values() + [self.marker_listener])
+        self.sessions = {}
+        self.marker_listener = None
+
+        for thread in self.stopping:
+            thread.join()
+        self.stopping = []
+
+        if self.server_socket:
+            self.server_socket.close()
+        self.wakeup_receiver.close()
+        self.wakeup_sender.close()
+        self.wakeup_sender = None
+        self.running = False
+        print 'Stopped.'
+
+    def _prewarm_filters(self):
+        try:
+            from classifiers import filters
+            filters.prewarm()
+        except Exception as e:
+            self.logger.warning('Could not design filters: %s' % e)
+
+    def wakeup(self):
+        """ Interrupt the main loop, so it notices changes in state. Can be
+        called from any thread. """
+        if not self.wakeup_sender:
+            return
+        try:
+            self.wakeup_sender.send('\x00')
+        except socket.error:
+            pass
+
+    def stop(self):
+        """ Make the main loop shut down the server. Can be called from any
+        thread. """
+        self.running = False
+        self.wakeup()
+
+    def attach(self, ch, name):
+        """ Attach a client to the session with the given name, creating the
+        session if it doesn't exist yet. """
+        if not valid_session_name(name):
+            raise EngineException(802, 'Session names may only contain letters, digits, - and _')
+
+        if ch.session:
+            if ch.session.name == name:
+                return
+            self.detach(ch)
+
+        session = self.sessions.get(name)
+        if session == None:
+            if name == DEFAULT_SESSION:
+                output_dir = '.'
+            else:
+                output_dir = os.path.join(self.session_dir, name)
+            session = Session(name, output_dir, self.training_slots, self.model_dir)
+            self.sessions[name] = session
+            self.logger.info('Created session %s' % name)
+
+        session.attach(ch)
+        ch.session = session
+        if session.recorder:
+            ch.attach_recorder(session.recorder)
+
+    def detach(self, ch):
+        """ Detach a client from its session. Sessions without clients are
+        stopped. """
+        session = ch.session
+        ch.session = None
+        ch.detach_recorder()
+        if session and session.detach(ch) == 0:
+            self.logger.info('Stopping session %s' % session.name)
+            del self.sessions[session.name]
+
+            # Stopping waits for the classifier and the recording device to
+            # finish, which can take a while. Don't hold up the other clients.
+            thread = threading.Thread(target=session.stop)
+            thread.start()
+            self.stopping = [t for t in self.stopping if t.isAlive()] + [thread]
+
+    def get_marker_session(self, name=None):
+        """ The session that receives the markers send over UDP to the
+        session with the given name, by default the default session. """
+        if name == None:
+            name = DEFAULT_SESSION
+        return self.sessions.get(name)
+
+    def get_stats(self, ch):
+        """ Returns a list of (name, value) pairs describing the state of the
+        server, the session of the given client and its connection. """
+        stats = [('server.sessions', len(self.sessions)),
+                 ('server.clients', len(self.clients))]
+        if ch.session:
+            stats += ch.session.get_stats()
+        stats += [('network.%s' % name, value) for name, value in ch.get_stats()]
+        if self.marker_listener:
+            stats += [('udp.%s' % name, value)
+                      for name, value in self.marker_listener.get_stats()]
+        return stats
+
+def main():
+    class VAction(argparse.Action):
+        def __call__(self, parser, args, values, option_string=None):
+            if values==None:
+                values='1'
+            try:
+                values=int(values)
+            except ValueError:
+                values=values.count('v')+1
+            setattr(args, self.dest, values)
+
+    print '''
+K.U.Leuven BCI server -- Marijn van Vliet <marijn.vanvliet@med.kuleuven.be>
+Copyright computational neuroscience group, K.U.Leuven (2013)
+'''
+    parser = argparse.ArgumentParser(description='BCI EEG data recorder and classifier')
+    parser.add_argument('-p', '--network-port', metavar='N', type=int, default=9000, help='Set the port number on which the recorder will listen to incoming connections from Unity. [9000]')
+    parser.add_argument('-u', '--udp-port', metavar='N', type=int, help='Also listen for markers send as UDP datagrams on this port number. See doc/protocol_draft.txt for the format of the datagrams.')
+    parser.add_argument('-s', '--session-dir', metavar='Dir', default='sessions', help='Directory to write the output files of named sessions to. The default session writes to the current directory. [sessions]')
+    parser.add_argument('-t', '--max-training-jobs', metavar='N', type=int, default=1, help='Maximum number of classifiers that may be training at the same time, across all sessions. [1]')
+    parser.add_argument('-m', '--model-dir', metavar='Dir', default='models', help='Directory to save trained classifiers to with CLASSIFIER SAVE, shared by all sessions. [models]')
+    parser.add_argument('-l', '--log', metavar='File', help='Specify a file to write any log messages to.')
+    parser.add_argument('-v', nargs='?', action=VAction, dest='verbose', help='Be more verbose. Repeat this argument to be even more verbose.')
+    args = parser.parse_args()
+
+    # Setup logging
+    if args.log:
+        ch = logging.FileHandler(args.log)
+    else:
+        ch = logging.StreamHandler()
+
+    if args.verbose == None:
+        ch.setLevel(logging.WARNING)
+    elif args.verbose == 1:
+        ch.setLevel(logging.INFO)
+    else:
+        ch.setLevel(logging.DEBUG)
+
+    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    ch.setFormatter(formatter)
+    logger = logging.getLogger()
+
+    if args.verbose == None:
+        logger.setLevel(logging.WARNING)
+    elif args.verbose == 1:
+        logger.setLevel(logging.INFO)
+    else:
+        logger.setLevel(logging.DEBUG)
+
+    logger.addHandler(ch)
+
+    # Start engine
+    e = Engine( int(args.network_port), args.udp_port, args.session_dir,
+                args.max_training_jobs, args.model_dir )
+    e.run()
@@ -1,298 +1,888 @@
-﻿import socket
-import logging
-import re
-import sys, traceback
-from collections import deque
-
-from bci_exceptions import *
-from eegdevices import DeviceError, precision_timer
-
-class ClientHandler:
-    def __init__(self, socket, engine):
-        self.socket = socket
-        self.socket.settimeout(1)
-        self.engine = engine
-        self.running = False
-        self.logger = logging.getLogger('Network')
-
-        self.buffer = ''
-        self.tokens = deque()
-
-        self.tokenizer = re.compile(r'''
-(?:                     # switch on different datatypes
-    
-    (
-        [^-\d."][^\s$]+ # a single word (without quotes)
-        (?:\s+|$)       # optional whitespace
-    )
-
-    |
-
-        "               # a string, beginning with opening quote
-        (               # start capture of group here
-            (?:         # 
-                \\.     # escaped character
-                |       # 
-                [^"\\]  # anything but ending quote
-            )*
-        )               # end capture of group
-        "               # ending quote
-
-        (?:\s+|$)       # optional whitespace
-
-    |                
-
-    (                   
-        -?\d+           # an integer number
-        (?:\s+|$)       # optional whitespace
-    )               
-
-    |               
-
-    (                   
-        -?\d*.\d+       # a floating point number
-        (?:\s+|$)       # optional whitespace
-    )               
-
-)                       # end switch on datatypes
-            ''', re.VERBOSE)
-
-    def run(self):
-        self.running = True
-        self.logger.info('Connection established.')
-        while self.running:
-            try:
-                data = self.socket.recv(1024)
-                if not data:
-                    self.logger.info('Connection lost.')
-                    break
-
-                self.buffer += data
-
-                lines = self.buffer.split('\n')
-                if len(lines) <= 1:
-                    # No complete message received yet
-                    continue
-
-                for i in range(len(lines)-1):
-                    self.lineReceived(lines[i])
-
-                self.buffer = lines[-1]
-            except socket.timeout:
-                pass
-            except:
-                print 'exception caught , trying to close down network connection'
-                traceback.print_exc() 
-                self.stop()
-                self.socket.close()
-                raise
-
-        self.socket.close()
-
-    def stop(self):
-        self.running = False
-
-    def sendLine(self, line):
-        self.logger.debug('Sending message: %s' % line)
-        self.socket.sendall(line + '\r\n')
-
-    def lineReceived(self, line):
-        self.logger.debug('Received message: %s' % line)
-
-        # Tokenize line
-        for token in self.tokenizer.findall(line):
-            value = None
-            if token[0]:
-                # single word
-                value = token[0].strip()
-            elif token[1]:
-                # string
-                value = token[1].strip()
-            elif token[2]:
-                # integer
-                value = int(token[2])
-            elif token[3]:
-                # float
-                value = float(token[3])
-            else:
-                continue
-
-            self.tokens.append(value)
-
-        self._parse_message()
-
-    def encode(self, value):
-        if type(value) == list:
-            return ' '.join([self.encode(x) for x in value])
-        elif type(value) == int or type(value) == float:
-            return str(value)
-        elif type(value) == bool:
-            return '1' if value else '0'
-        else: 
-            return '"' + str(value).replace('"', '\\"') + '"'
-
-    def _parse_message(self):
-        if len(self.tokens) == 0 or type(self.tokens[0]) != str:
-            self.sendLine('ERROR 001: Please specify command category')
-            self.tokens.clear()
-            return
-
-        category = self.tokens.popleft().lower()
-        if category == 'ping':
-            self.sendLine('PONG')
-        else:
-            try:
-                if category == 'device':
-                    self._parse_device()
-                elif category == 'classifier':
-                    self._parse_classifier()
-                elif category == 'mode':
-                    self._parse_mode()
-                elif category == 'marker':
-                    self._parse_marker()
-                else:
-                    self.sendLine('ERROR 001 "Unknown command category.')
-            except Exception as e:
-                self.sendLine('ERROR 000 "%s"' %  e)
-                self.logger.error('ERROR 000 "%s"\n%s' % (e, traceback.format_exc()))
-            except:
-                self.sendLine('ERROR 000 "%s"' % sys.exc_info()[1])
-                self.logger.error('ERROR 000 "%s"' % traceback.format_exc())
-                raise
-
-        self.tokens.clear()
-
-    def _parse_device(self):
-        if len(self.tokens) == 0 or type(self.tokens[0]) != str:
-            raise BCIProtocolException(2, 'Please specify command')
-
-        command = self.tokens.popleft().lower()
-        if command == 'get':
-            # Provide a list of available classifiers
-            self.sendLine('DEVICE PROVIDE ' +
-                          self.encode( self.engine.provide_devices() ))
-
-        elif command == 'set':
-            # Load a device
-            if len(self.tokens) == 0 or type(self.tokens[0]) != str:
-                raise BCIProtocolException(102, 'Please specify device to set')
-
-            name = self.tokens.popleft().lower()
-            self.engine.set_device(name)
-
-        elif command == 'param':
-            if len(self.tokens) == 0 or type(self.tokens[0]) != str:
-                raise BCIProtocolException(103, 'Please specify parameter operation')
-            if len(self.tokens) == 1 or type(self.tokens[1]) != str:
-                raise BCIProtocolException(104, 'Please specify parameter name')
-
-            operation = self.tokens.popleft().lower()
-            name = self.tokens.popleft().lower()
-
-            if operation == 'set':
-                if len(self.tokens) == 0:
-                    raise BCIProtocolException(105, 'Please specify parameter value(s)')
-
-                self.engine.set_device_parameter(name, list(self.tokens))
-
-            elif operation == 'get':
-                value = self.engine.get_device_parameter(name)
-                self.sendLine('DEVICE PARAM PROVIDE "%s" %s' % (name, self.encode(value)))
-
-        elif command == 'open':
-            self.engine.open_device()
-
-        else:
-            raise BCIProtocolException(101, 'Unknown device command')
-
-    def _parse_classifier(self):
-        if len(self.tokens) == 0 or type(self.tokens[0]) != str:
-            raise BCIProtocolException(2, 'Please specify command')
-
-        command = self.tokens.popleft().lower()
-        if command == 'get':
-            # Provide a list of available classifiers
-            self.sendLine('CLASSIFIER PROVIDE ' +
-                          self.encode( self.engine.provide_classifiers() ))
-
-        elif command == 'set':
-            # Load a classifier
-            if len(self.tokens) == 0 or type(self.tokens[0]) != str:
-                raise BCIProtocolException(202, 'Please specify classifier to set')
-
-            name = self.tokens.popleft().lower()
-            self.engine.set_classifier(name)
-
-        elif command == 'param':
-            if len(self.tokens) == 0 or type(self.tokens[0]) != str:
-                raise BCIProtocolException(203, 'Please specify parameter operation')
-            if len(self.tokens) == 1 or type(self.tokens[1]) != str:
-                raise BCIProtocolException(204, 'Please specify parameter name')
-
-            operation = self.tokens.popleft().lower()
-            name = self.tokens.popleft().lower()
-
-            if operation == 'set':
-                if len(self.tokens) == 0:
-                    raise BCIProtocolException(205, 'Please specify parameter value(s)')
-
-                self.engine.set_classifier_parameter(name, list(self.tokens))
-
-            elif operation == 'get':
-                value = self.engine.get_classifier_parameter(name)
-                self.sendLine('CLASSIFIER PARAM PROVIDE "%s" %s' % (name, self.encode(value)))
-
-            else:
-                raise BCIProtocolException(201, 'Unknown classifier command')
-
-        else:
-            raise BCIProtocolException(201, 'Unknown classifier command')
-
-    def _parse_mode(self):
-        if len(self.tokens) == 0 or type(self.tokens[0]) != str:
-            raise BCIProtocolException(2, 'Please specify command')
-
-        command = self.tokens.popleft().lower()
-        if command == 'set':
-            if len(self.tokens) == 0 or type(self.tokens[0]) != str:
-                raise BCIProtocolException(302, 'Please specify mode to set')
-
-            mode = self.tokens.popleft().lower()
-            self.engine.set_mode(mode) 
-
-        elif command == 'get':
-            self.sendLine('MODE PROVIDE "%s"' % self.engine.get_mode())
-
-        else:
-            raise BCIProtocolException(301, 'Unknown mode command')
-
-    def provide_mode(self, mode):
-        self.sendLine('MODE PROVIDE "%s"' % mode)
-
-    def _parse_marker(self):
-        if len(self.tokens) < 2:
-            raise BCIProtocolException(401, 'Please specify both a marker code and type')
-
-        marker_type = self.tokens.popleft()
-        if marker_type != 'trigger' and marker_type != 'switch':
-                raise BCIProtocolException(402, 'Invalid marker type')
-
-        code = self.tokens.popleft()
-
-        if len(self.tokens) > 0:
-            timestamp = self.tokens.popleft()
-            if type(timestamp) != float:
-                raise BCIProtocolException(403, 'Invalid timestamp')
-        else:
-            timestamp = precision_timer()
-
-        self.engine.set_marker(code, marker_type, timestamp)
-
-    def provide_result(self, result, timestamp=None):
-        if timestamp:
-            self.sendLine('RESULT PROVIDE %s' % (self.encode(result), timestamp))
-        else:
-            self.sendLine('RESULT PROVIDE %s' % self.encode(result))
-
-    def error(self, e):
-        self.sendLine('ERROR 000: "%s"' % e)
+﻿import socket
+import logging
+import re
+import sys, traceback
+import threading
+from collections import deque
+
+from bci_exceptions import *
+from eegdevices import DeviceError, precision_timer
+from clock_sync import ClockSync
+from shm_transport import SharedMemoryTransport
+
+tokenizer = re.compile(r'''
+(?:                     # switch on different datatypes
+
+    (
+        [^-\d."][^\s$]+ # a single word (without quotes)
+        (?:\s+|$)       # optional whitespace
+    )
+
+    |
+
+        "               # a string, beginning with opening quote
+        (               # start capture of group here
+            (?:         #
+                \\.     # escaped character
+                |       #
+                [^"\\]  # anything but ending quote
+            )*
+        )               # end capture of group
+        "               # ending quote
+
+        (?:\s+|$)       # optional whitespace
+
+    |
+
+    (
+        -?\d+           # an integer number
+        (?:\s+|$)       # optional whitespace
+    )
+
+    |
+
+    (
+        -?\d*.\d+       # a floating point number
+        (?:\s+|$)       # optional whitespace
+    )
+
+)                       # end switch on datatypes
+            ''', re.VERBOSE)
+
+# Converts the contents of each capture group of the tokenizer into a value
+_token_types = [None, str.strip, str.strip, int, float]
+
+# Strict form of a floating point number, used by the fast path of tokenize()
+_is_float = re.compile(r'-?\d*\.\d+$').match
+
+def tokenize(line):
+    """ Splits a line into a list of values. Words and strings become str,
+    integers become int and floating point numbers become float. """
+
+    # Fast path for lines without quoted strings, such as MARKER messages.
+    # Any token it is unsure about makes it fall back to the regular
+    # expression, which remains the definition of the grammar.
+    if '"' not in line and '$' not in line and not line[:1].isspace():
+        values = []
+        for token in line.split():
+            if token[0] in '-.0123456789':
+                if '.' in token:
+                    if not _is_float(token):
+                        break
+                    values.append(float(token))
+                else:
+                    try:
+                        values.append(int(token))
+                    except ValueError:
+                        break
+            elif len(token) > 1:
+                values.append(token)
+            else:
+                break
+        else:
+            return values
+
+    values = []
+    for match in tokenizer.finditer(line):
+        group = match.lastindex
+        if group is None:
+            continue
+
+        token = match.group(group)
+        if not token:
+            continue
+
+        values.append(_token_types[group](token))
+    return values
+
+class LineBuffer:
+    """
+    Splits a stream of data into lines. Incoming data is scanned only once:
+    a scan offset is kept into each received chunk and incomplete lines are
+    kept as a list of pieces that is joined only when the line ending arrives.
+    """
+
+    def __init__(self):
+        self.pending = []
+
+    def feed(self, data):
+        """ Adds data to the buffer. Returns a list of the lines that were
+        completed by it (without line endings). """
+        lines = []
+
+        end = data.find('\n')
+        if end == -1:
+            self.pending.append(data)
+            return lines
+
+        if self.pending:
+            self.pending.append(data[:end])
+            lines.append(''.join(self.pending))
+            self.pending = []
+        else:
+            lines.append(data[:end])
+
+        offset = end + 1
+        while True:
+            end = data.find('\n', offset)
+            if end == -1:
+                break
+            lines.append(data[offset:end])
+            offset = end + 1
+
+        if offset < len(data):
+            self.pending.append(data[offset:])
+
+        return lines
+
+    def clear(self):
+        self.pending = []
+
+class CommandTable:
+    """
+    Maps the categories and commands of the protocol to the functions that
+    handle them. Handlers are called with the ClientHandler that received the
+    message as only argument, and read their arguments from its token queue.
+    Other subsystems can extend the protocol by registering their own
+    categories and commands with the module level 'commands' table.
+    """
+
+    def __init__(self):
+        self.categories = {}
+
+    def register_category(self, category, handler=None, error_code=1):
+        """ Register a new command category.
+
+        category   - name of the category (case insensitive)
+        handler    - function that handles the entire message. Use this for
+                     categories that don't have commands, such as PING. When
+                     omitted, the next token is used to look up a command
+                     registered with register().
+        error_code - the error code to report for unknown commands
+        """
+        self.categories[category.lower()] = (handler, {}, error_code)
+
+    def register(self, category, command, handler):
+        """ Register a handler for a command within a category. """
+        self.categories[category.lower()][1][command.lower()] = handler
+
+    def dispatch(self, ch, category):
+        """ Calls the handler of the given category. The category token must
+        already have been consumed. Returns False if the category is unknown.
+        """
+        try:
+            handler, commands, error_code = self.categories[category]
+        except KeyError:
+            return False
+
+        if handler != None:
+            handler(ch)
+            return True
+
+        tokens = ch.tokens
+        if len(tokens) == 0 or type(tokens[0]) != str:
+            raise BCIProtocolException(2, 'Please specify command')
+
+        command = tokens.popleft().lower()
+        handler = commands.get(command)
+        if handler == None:
+            raise BCIProtocolException(error_code, 'Unknown %s command' % category)
+
+        handler(ch)
+        return True
+
+# Priorities of outgoing messages. Messages with a lower value are send first.
+# Replies and results share a priority, so the client receives them in the
+# order they were produced: a mode change never overtakes the results that
+# came before it.
+PRIORITY_NORMAL = 0 # replies to commands, mode changes, errors and results
+PRIORITY_BULK = 1   # large messages, such as debug images
+
+class OutboundQueue:
+    """
+    Queue of messages waiting to be send to the client. Messages are taken
+    from the queue in order of priority and, within a priority, in the order
+    they were put in.
+
+    A message can be given a coalesce key. If a message with the same key is
+    still waiting in the queue, it is replaced by the new message. This way, a
+    client that can't keep up only receives the most recent result instead of
+    a backlog of stale ones. The new message takes over the place of the old
+    one, unless other messages were put in after the old one. In that case,
+    the old message is kept and the new one goes to the back of the queue, so
+    messages are never reordered.
+    """
+
+    def __init__(self, npriorities=2):
+        self.queues = [deque() for i in range(npriorities)]
+        self.condition = threading.Condition()
+        self.waiting = {}
+        self.closed = False
+
+        # Counters
+        self.depth = 0
+        self.bytes_queued = 0
+        self.bytes_in_flight = 0
+        self.messages_sent = 0
+        self.messages_coalesced = 0
+
+    def put(self, data, priority=PRIORITY_NORMAL, coalesce=None):
+        """ Add a message to the queue.
+
+        data     - the data to send
+        priority - one of the PRIORITY_ constants
+        coalesce - optional key, see the class description
+        """
+        queue = self.queues[priority]
+        self.condition.acquire()
+        try:
+            if coalesce != None and coalesce in self.waiting:
+                message = self.waiting[coalesce]
+                if queue and queue[-1] is message:
+                    self.bytes_queued += len(data) - len(message[0])
+                    message[0] = data
+                    self.messages_coalesced += 1
+                    return
+
+            message = [data, coalesce]
+            queue.append(message)
+            if coalesce != None:
+                self.waiting[coalesce] = message
+            self.depth += 1
+            self.bytes_queued += len(data)
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def get(self):
+        """ Take the next message from the queue, blocking until one is
+        available. Returns None when the queue has been closed. Call done()
+        after the message has been send. """
+        self.condition.acquire()
+        try:
+            while not self.closed:
+                for queue in self.queues:
+                    if queue:
+                        message = queue.popleft()
+                        data, coalesce = message
+                        if self.waiting.get(coalesce) is message:
+                            del self.waiting[coalesce]
+                        self.depth -= 1
+                        self.bytes_queued -= len(data)
+                        self.bytes_in_flight = len(data)
+                        return data
+                self.condition.wait()
+            return None
+        finally:
+            self.condition.release()
+
+    def done(self):
+        """ Signal that the last message taken from the queue has been send. """
+        self.condition.acquire()
+        self.bytes_in_flight = 0
+        self.messages_sent += 1
+        self.condition.release()
+
+    def close(self):
+        """ Discard all waiting messages and wake up the writer. """
+        self.condition.acquire()
+        self.closed = True
+        for queue in self.queues:
+            queue.clear()
+        self.waiting.clear()
+        self.depth = 0
+        self.bytes_queued = 0
+        self.condition.notifyAll()
+        self.condition.release()
+
+class ClientHandler:
+    def __init__(self, socket, engine):
+        self.socket = socket
+        # The engine only reads from the socket when select() reports it
+        # readable, and the writer thread must wait for a client that is slow
+        # to read instead of dropping the connection, so the socket blocks.
+        # close() unblocks the writer by shutting down the socket.
+        self.socket.settimeout(None)
+        self.engine = engine
+        self.running = False
+        self.logger = logging.getLogger('Network')
+
+        self.buffer = LineBuffer()
+        self.tokens = deque()
+
+        # Relation between the clock of the client and our own clock
+        self.clock = ClockSync()
+        self.sync_remaining = 0
+
+        # Optional shared memory transport for clients on the same host
+        self.transport = None
+
+        # How multiple results are send, see provide_results()
+        self.result_mode = 'each'
+
+        # The session this client is attached to, set by the engine
+        self.session = None
+
+        # Messages to the client are send by a separate writer thread, so the
+        # classifier never blocks on the network.
+        self.outbound = OutboundQueue()
+        self.writer = threading.Thread(target=self._write_messages)
+        self.writer.daemon = True
+
+    def start(self):
+        self.running = True
+        self.logger.info('Connection established.')
+        self.writer.start()
+
+    def handle_read(self):
+        """ Read and handle the data that arrived from the client. Call this
+        when the socket is readable. Returns False when the connection has
+        been closed, after which close() should be called. """
+        if not self.running:
+            return False
+
+        try:
+            data = self.socket.recv(65536)
+        except socket.error as e:
+            self.logger.info('Connection lost: %s' % e)
+            return False
+
+        if not data:
+            self.logger.info('Connection lost.')
+            return False
+
+        try:
+            for line in self.buffer.feed(data):
+                self.lineReceived(line)
+        except:
+            print 'exception caught , trying to close down network connection'
+            traceback.print_exc()
+            self.close()
+            raise
+
+        return self.running
+
+    def stop(self):
+        """ Make the engine close the connection. """
+        self.running = False
+        self.engine.wakeup()
+
+    def close(self):
+        self.running = False
+        self._close_transport()
+        self.outbound.close()
+
+        # Unblock the writer thread if it is waiting on the socket
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+        if self.writer.isAlive():
+            self.writer.join()
+        self.socket.close()
+
+    def _write_messages(self):
+        """ Writer thread: sends the messages in the outbound queue. """
+        while True:
+            data = self.outbound.get()
+            if data == None:
+                break
+
+            try:
+                self.socket.sendall(data)
+            except socket.error as e:
+                self.logger.error('Could not send message: %s' % e)
+                self.stop()
+                break
+            finally:
+                self.outbound.done()
+
+    def sendLine(self, line, priority=PRIORITY_NORMAL, coalesce=None):
+        """ Queue a message for sending to the client, see OutboundQueue.put()
+        for the meaning of priority and coalesce. """
+        self.logger.debug('Sending message: %s', line)
+        self.outbound.put(line + '\r\n', priority, coalesce)
+
+    def lineReceived(self, line):
+        self.logger.debug('Received message: %s', line)
+
+        self.tokens.extend(tokenize(line))
+        self._parse_message()
+
+    def encode(self, value):
+        if type(value) == list:
+            return ' '.join([self.encode(x) for x in value])
+        elif type(value) == int or type(value) == float:
+            return str(value)
+        elif type(value) == bool:
+            return '1' if value else '0'
+        else:
+            return '"' + str(value).replace('"', '\\"') + '"'
+
+    def _parse_message(self):
+        if len(self.tokens) == 0 or type(self.tokens[0]) != str:
+            self.sendLine('ERROR 001: Please specify command category')
+            self.tokens.clear()
+            return
+
+        category = self.tokens.popleft().lower()
+        try:
+            if not commands.dispatch(self, category):
+                self.sendLine('ERROR 001 "Unknown command category."')
+        except Exception as e:
+            self.sendLine('ERROR 000 "%s"' %  e)
+            self.logger.error('ERROR 000 "%s"\n%s' % (e, traceback.format_exc()))
+        except:
+            self.sendLine('ERROR 000 "%s"' % sys.exc_info()[1])
+            self.logger.error('ERROR 000 "%s"' % traceback.format_exc())
+            raise
+
+        self.tokens.clear()
+
+    def _parse_ping(self):
+        self.sendLine('PONG')
+
+    def _get_device(self):
+        # Provide a list of available devices
+        self.sendLine('DEVICE PROVIDE ' +
+                      self.encode( self.session.provide_devices() ))
+
+    def _set_device(self):
+        # Load a device
+        if len(self.tokens) == 0 or type(self.tokens[0]) != str:
+            raise BCIProtocolException(102, 'Please specify device to set')
+
+        name = self.tokens.popleft().lower()
+        self.session.set_device(name)
+
+    def _device_param(self):
+        if len(self.tokens) == 0 or type(self.tokens[0]) != str:
+            raise BCIProtocolException(103, 'Please specify parameter operation')
+        if len(self.tokens) == 1 or type(self.tokens[1]) != str:
+            raise BCIProtocolException(104, 'Please specify parameter name')
+
+        operation = self.tokens.popleft().lower()
+        name = self.tokens.popleft().lower()
+
+        if operation == 'set':
+            if len(self.tokens) == 0:
+                raise BCIProtocolException(105, 'Please specify parameter value(s)')
+
+            self.session.set_device_parameter(name, list(self.tokens))
+
+        elif operation == 'get':
+            value = self.session.get_device_parameter(name)
+            self.sendLine('DEVICE PARAM PROVIDE "%s" %s' % (name, self.encode(value)))
+
+    def _open_device(self):
+        self.session.open_device()
+
+    def _get_classifier(self):
+        # Provide a list of available classifiers
+        self.sendLine('CLASSIFIER PROVIDE ' +
+                      self.encode( self.session.provide_classifiers() ))
+
+    def _set_classifier(self):
+        # Load a classifier
+        if len(self.tokens) == 0 or type(self.tokens[0]) != str:
+            raise BCIProtocolException(202, 'Please specify classifier to set')
+
+        name = self.tokens.popleft().lower()
+        self.session.set_classifier(name)
+
+    def _save_classifier(self):
+        if len(self.tokens) == 0 or type(self.tokens[0]) != str:
+            raise BCIProtocolException(206, 'Please specify model name')
+
+        self.session.save_classifier(self.tokens.popleft())
+
+    def _load_classifier(self):
+        if len(self.tokens) == 0 or type(self.tokens[0]) != str:
+            raise BCIProtocolException(206, 'Please specify model name')
+
+        self.session.load_classifier(self.tokens.popleft())
+
+    def _classifier_param(self):
+        if len(self.tokens) == 0 or type(self.tokens[0]) != str:
+            raise BCIProtocolException(203, 'Please specify parameter operation')
+        if len(self.tokens) == 1 or type(self.tokens[1]) != str:
+            raise BCIProtocolException(204, 'Please specify parameter name')
+
+        operation = self.tokens.popleft().lower()
+        name = self.tokens.popleft().lower()
+
+        if operation == 'set':
+            if len(self.tokens) == 0:
+                raise BCIProtocolException(205, 'Please specify parameter value(s)')
+
+            self.session.set_classifier_parameter(name, list(self.tokens))
+
+        elif operation == 'get':
+            value = self.session.get_classifier_parameter(name)
+            self.sendLine('CLASSIFIER PARAM PROVIDE "%s" %s' % (name, self.encode(value)))
+
+        else:
+            raise BCIProtocolException(201, 'Unknown classifier command')
+
+    def _set_mode(self):
+        if len(self.tokens) == 0 or type(self.tokens[0]) != str:
+            raise BCIProtocolException(302, 'Please specify mode to set')
+
+        mode = self.tokens.popleft().lower()
+        self.session.set_mode(mode)
+
+    def _get_mode(self):
+        self.sendLine('MODE PROVIDE "%s"' % self.session.get_mode())
+
+    def provide_mode(self, mode):
+        self.sendLine('MODE PROVIDE "%s"' % mode)
+
+    def _parse_marker(self):
+        if len(self.tokens) > 0 and type(self.tokens[0]) == str and self.tokens[0].lower() == 'batch':
+            self.tokens.popleft()
+            self._parse_marker_batch()
+            return
+
+        if len(self.tokens) < 2:
+            raise BCIProtocolException(401, 'Please specify both a marker code and type')
+
+        marker_type = self.tokens.popleft()
+        if marker_type != 'trigger' and marker_type != 'switch':
+                raise BCIProtocolException(402, 'Invalid marker type')
+
+        code = self.tokens.popleft()
+
+        if len(self.tokens) > 0:
+            timestamp = self.tokens.popleft()
+            if type(timestamp) != float:
+                raise BCIProtocolException(403, 'Invalid timestamp')
+            timestamp = self.clock.to_server_time(timestamp)
+        else:
+            timestamp = precision_timer()
+
+        self.session.set_marker(code, marker_type, timestamp)
+
+    def _parse_marker_batch(self):
+        if len(self.tokens) == 0 or len(self.tokens) % 3 != 0:
+            raise BCIProtocolException(404, 'Please specify a type, code and timestamp for each marker')
+
+        tokens = self.tokens
+        markers = []
+        while tokens:
+            marker_type = tokens.popleft()
+            code = tokens.popleft()
+            timestamp = tokens.popleft()
+
+            if marker_type != 'trigger' and marker_type != 'switch':
+                raise BCIProtocolException(402, 'Invalid marker type')
+            if type(timestamp) != float:
+                raise BCIProtocolException(403, 'Invalid timestamp')
+
+            markers.append( (code, marker_type, self.clock.to_server_time(timestamp)) )
+
+        self.session.set_markers(markers)
+
+    def _time_sync(self):
+        if len(self.tokens) > 0:
+            if type(self.tokens[0]) != int or self.tokens[0] < 1:
+                raise BCIProtocolException(502, 'Number of exchanges must be a positive integer')
+            self.sync_remaining = self.tokens.popleft()
+        else:
+            self.sync_remaining = 8
+
+        self._send_ping()
+
+    def _send_ping(self):
+        seq, timestamp = self.clock.ping()
+        self.sendLine('TIME PING %d %f' % (seq, timestamp))
+
+    def _time_pong(self):
+        if (len(self.tokens) < 3 or type(self.tokens[0]) != int or
+            [t for t in list(self.tokens)[1:] if type(t) != float]):
+            raise BCIProtocolException(503, 'Please specify sequence number, server timestamp and client timestamp(s)')
+
+        seq = self.tokens.popleft()
+        self.tokens.popleft() # server timestamp, only for the client's convenience
+        t2 = self.tokens.popleft()
+        t3 = self.tokens.popleft() if len(self.tokens) > 0 else None
+
+        if self.clock.pong(seq, t2, t3) == None:
+            self.logger.warning('Ignoring TIME PONG with unknown sequence number %d' % seq)
+            return
+
+        if self.sync_remaining > 0:
+            self.sync_remaining -= 1
+            if self.sync_remaining > 0:
+                self._send_ping()
+            else:
+                self._time_get()
+
+    def _time_get(self):
+        offset, drift, uncertainty, nsamples = self.clock.get_estimate()
+        if uncertainty == None:
+            uncertainty = -1.0
+        self.sendLine('TIME PROVIDE %f %.9f %f %d' % (offset, drift, uncertainty, nsamples))
+
+    def _time_reset(self):
+        self.sync_remaining = 0
+        self.clock.reset()
+
+    def _transport_open(self):
+        if len(self.tokens) < 2 or type(self.tokens[0]) != str or type(self.tokens[1]) != int:
+            raise BCIProtocolException(603, 'Please specify transport and doorbell port')
+
+        name = self.tokens.popleft().lower()
+        doorbell_port = self.tokens.popleft()
+        samples = self.tokens.popleft() if len(self.tokens) > 0 else 0
+
+        if name != 'shm':
+            raise BCIProtocolException(602, 'Unknown transport')
+        if type(samples) != int:
+            raise BCIProtocolException(603, 'Please specify 0 or 1 for the samples option')
+        if not self.socket.getpeername()[0] in ['127.0.0.1', '::1']:
+            raise BCIProtocolException(604, 'Shared memory is only available to clients on the same host')
+
+        self._close_transport()
+        transport = SharedMemoryTransport(doorbell_port)
+        transport.samples = bool(samples)
+        if transport.samples and self.session.recorder:
+            transport.attach(self.session.recorder)
+        self.transport = transport
+
+        self.logger.info('Publishing results through shared memory: %s' % transport.ring.path)
+        self._transport_get()
+
+    def _transport_close(self):
+        self._close_transport()
+
+    def _transport_get(self):
+        if self.transport:
+            self.sendLine('TRANSPORT PROVIDE "shm" %s %d' % (
+                self.encode(self.transport.ring.path), self.transport.ring.capacity))
+        else:
+            self.sendLine('TRANSPORT PROVIDE "tcp"')
+
+    def _close_transport(self):
+        transport = self.transport
+        if transport:
+            self.transport = None
+            transport.close()
+
+    def _set_session(self):
+        if len(self.tokens) == 0 or type(self.tokens[0]) != str:
+            raise BCIProtocolException(802, 'Please specify session name')
+
+        self.engine.attach(self, self.tokens.popleft())
+
+    def _get_session(self):
+        self.sendLine('SESSION PROVIDE %s' % self.encode(self.session.name))
+
+    def _stats_get(self):
+        values = []
+        for name, value in self.engine.get_stats(self):
+            if type(value) == float:
+                # Avoid exponents, which the protocol doesn't allow
+                values.append('%s %.6f' % (self.encode(name), value))
+            else:
+                values.append('%s %s' % (self.encode(name), self.encode(value)))
+        self.sendLine('STATS PROVIDE %s' % ' '.join(values))
+
+    def get_stats(self):
+        """ Returns a list of (name, value) pairs describing the connection. """
+        outbound = self.outbound
+        stats = [('queue_depth', outbound.depth),
+                 ('bytes_queued', outbound.bytes_queued),
+                 ('bytes_in_flight', outbound.bytes_in_flight),
+                 ('messages_sent', outbound.messages_sent),
+                 ('messages_coalesced', outbound.messages_coalesced)]
+
+        transport = self.transport
+        if transport:
+            stats += [('shm_results_published', transport.results_published),
+                      ('shm_sample_blocks_published', transport.sample_blocks_published)]
+        return stats
+
+    def attach_recorder(self, recorder):
+        """ Called by the engine when a new recording device is selected, or
+        when the client switches to a session that has one. """
+        if self.transport and self.transport.samples:
+            self.transport.attach(recorder)
+
+    def detach_recorder(self):
+        """ Called by the engine when the client leaves its session. """
+        if self.transport:
+            self.transport.detach()
+
+    def provide_result(self, result, timestamp=None, coalesce=False):
+        """ Send a classification result. When coalesce is set, a result
+        that is still waiting to be send is replaced by this one. When the
+        client opened the shared memory transport, numeric results are
+        published there instead. """
+        transport = self.transport
+        if transport and transport.publish_result(result, timestamp):
+            return
+
+        coalesce = 'result' if coalesce else None
+        if timestamp:
+            self.sendLine('RESULT PROVIDE %s %s' % (self.encode(result), timestamp),
+                          PRIORITY_NORMAL, coalesce)
+        else:
+            self.sendLine('RESULT PROVIDE %s' % self.encode(result),
+                          PRIORITY_NORMAL, coalesce)
+
+    def provide_results(self, results, timestamps, coalesce=False):
+        """ Send several classification results at once, for example one for
+        each window of data. Depending on the result mode chosen by the
+        client, they are send as separate RESULT PROVIDE messages, as a single
+        RESULT BATCH message, or only the newest result is send. Only clients
+        that chose batches get the timestamps, the others get the same
+        messages as before. """
+        if len(results) == 0:
+            return
+
+        # The result mode does not apply to shared memory
+        mode = self.result_mode if not self.transport else 'each'
+        if mode == 'latest':
+            results = results[-1:]
+        if mode != 'batch':
+            timestamps = [None] * len(results)
+
+        # A batch needs rows of equal length
+        if (mode != 'batch' or len(results) == 1 or
+            len(set([len(r) for r in results])) != 1):
+            for result, timestamp in zip(results, timestamps):
+                self.provide_result(result, timestamp, coalesce)
+            return
+
+        # Batches are never coalesced, as the client wants all results
+        rows = ['%f %s' % (timestamp, self.encode(result))
+                for result, timestamp in zip(results, timestamps)]
+        self.sendLine('RESULT BATCH %d %s' % (len(results[0]), ' '.join(rows)),
+                      PRIORITY_NORMAL)
+
+    def _result_mode(self):
+        if len(self.tokens) == 0 or type(self.tokens[0]) != str:
+            raise BCIProtocolException(902, 'Please specify result mode operation')
+
+        operation = self.tokens.popleft().lower()
+        if operation == 'set':
+            if len(self.tokens) == 0 or type(self.tokens[0]) != str:
+                raise BCIProtocolException(903, 'Please specify result mode')
+
+            mode = self.tokens.popleft().lower()
+            if mode not in ['each', 'batch', 'latest']:
+                raise BCIProtocolException(903, 'Result mode must be one of: each, batch, latest')
+            self.result_mode = mode
+
+        elif operation == 'get':
+            self.sendLine('RESULT MODE PROVIDE "%s"' % self.result_mode)
+
+        else:
+            raise BCIProtocolException(901, 'Unknown result mode command')
+
+    def provide_debug_image(self, data):
+        """ Send an image describing the training data (base64 encoded) """
+        self.sendLine('RESULT PROVIDE "training-result" "%s"' % data, PRIORITY_BULK)
+
+    def provide_progress(self, fraction, elapsed, remaining):
+        """ Send the progress of the training: the fraction done and the
+        elapsed and estimated remaining time in seconds. Progress that is
+        still waiting to be send is replaced. """
+        self.sendLine('PROGRESS %f %f %f' % (fraction, elapsed, remaining),
+                      PRIORITY_NORMAL, 'progress')
+
+    def error(self, e):
+        self.sendLine('ERROR 000: "%s"' % e)
+
+# The commands of the protocol, see doc/protocol_draft.txt
+commands = CommandTable()
+
+commands.register_category('ping', ClientHandler._parse_ping)
+
+commands.register_category('device', error_code=101)
+commands.register('device', 'get', ClientHandler._get_device)
+commands.register('device', 'set', ClientHandler._set_device)
+commands.register('device', 'param', ClientHandler._device_param)
+commands.register('device', 'open', ClientHandler._open_device)
+
+commands.register_category('classifier', error_code=201)
+commands.register('classifier', 'get', ClientHandler._get_classifier)
+commands.register('classifier', 'set', ClientHandler._set_classifier)
+commands.register('classifier', 'param', ClientHandler._classifier_param)
+commands.register('classifier', 'save', ClientHandler._save_classifier)
+commands.register('classifier', 'load', ClientHandler._load_classifier)
+
+commands.register_category('mode', error_code=301)
+commands.register('mode', 'set', ClientHandler._set_mode)
+commands.register('mode', 'get', ClientHandler._get_mode)
+
+commands.register_category('marker', ClientHandler._parse_marker)
+
+commands.register_category('time', error_code=501)
+commands.register('time', 'sync', ClientHandler._time_sync)
+commands.register('time', 'pong', ClientHandler._time_pong)
+commands.register('time', 'get', ClientHandler._time_get)
+commands.register('time', 'reset', ClientHandler._time_reset)
+
+commands.register_category('transport', error_code=601)
+commands.register('transport', 'open', ClientHandler._transport_open)
+commands.register('transport', 'close', ClientHandler._transport_close)
+commands.register('transport', 'get', ClientHandler._transport_get)
+
+commands.register_category('stats', error_code=701)
+commands.register('stats', 'get', ClientHandler._stats_get)
+
+commands.register_category('session', error_code=801)
+commands.register('session', 'set', ClientHandler._set_session)
+commands.register('session', 'get', ClientHandler._get_session)
+
+commands.register_category('result', error_code=901)
+commands.register('result', 'mode', ClientHandler._result_mode)
+
+if __name__ == '__main__':
+    # Micro-benchmark of the protocol parser: feed a burst of MARKER lines,
+    # as send by a P300 speller, through a ClientHandler in random sized
+    # chunks, as they would arrive from the socket.
+    import random
+    import time
+
+    class DummySocket:
+        def settimeout(self, timeout):
+            pass
+        def sendall(self, data):
+            pass
+
+    class DummySession:
+        def set_marker(self, code, type, timestamp):
+            pass
+
+    nlines = 100000
+    T0 = precision_timer()
+    data = ''.join(['MARKER trigger %d %.3f\r\n' % (random.randint(1, 7), T0 + i * 0.1)
+                    for i in range(nlines)])
+
+    chunks = []
+    offset = 0
+    while offset < len(data):
+        size = random.randint(1, 4096)
+        chunks.append(data[offset:offset+size])
+        offset += size
+
+    ch = ClientHandler(DummySocket(), None)
+    ch.session = DummySession()
+
+    t = time.clock()
+    for line in data.split('\n')[:-1]:
+        tokenize(line)
+    t_tokenize = time.clock() - t
+
+    t = time.clock()
+    for chunk in chunks:
+        for line in ch.buffer.feed(chunk):
+            ch.lineReceived(line)
+    t_total = time.clock() - t
+
+    print 'Tokenizing: %.2f us per line' % (1e6 * t_tokenize / nlines)
+    print 'Buffering, tokenizing and dispatching: %.2f us per line (%d lines/s)' % (
+        1e6 * t_total / nlines, nlines / t_total)
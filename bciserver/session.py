@@ -0,0 +1,291 @@
+import classifiers
+import eegdevices
+
+import os
+import re
+import logging
+import threading
+
+from bci_exceptions import *
+
+# Model names are used as file names
+valid_model_name = re.compile(r'^[A-Za-z0-9_\-]+$').match
+
+def stop_concurrently(components):
+    """ Call the stop() method of the given components (recorders,
+    classifiers, sessions, ...) at the same time and wait for all of them to
+    finish. """
+    threads = []
+    for component in components:
+        if component:
+            thread = threading.Thread(target=component.stop)
+            thread.start()
+            threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+class Session:
+    """
+    A session owns a recording device and a classifier, together with the
+    markers, results and output files that belong to them. Clients attach to
+    a session by name, several clients can share the same session. Sessions
+    are isolated from each other, so multiple participants or headsets can be
+    served by a single server.
+
+    Classifiers and the UDP marker listener talk to the session as they used
+    to talk to the engine.
+    """
+
+    def __init__(self, name, output_dir, training_slots, model_dir='models'):
+        """
+        name           - name of the session
+        output_dir     - directory to write the output files to
+        training_slots - semaphore shared by all sessions, limiting the number
+                         of classifiers that are training at the same time
+        model_dir      - directory to save trained classifiers to
+        """
+        self.name = name
+        self.output_dir = output_dir
+        self.training_slots = training_slots
+        self.model_dir = model_dir
+        self.logger = logging.getLogger('Session %s' % name)
+
+        self.classifier = None
+        self.classifier_name = None
+        self.recorder = None
+        self.clients = []
+        self.lock = threading.Lock()
+
+        # Threads stopping the recorders and classifiers that were replaced
+        self.stopping = []
+
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+
+    def attach(self, ch):
+        self.lock.acquire()
+        self.clients = self.clients + [ch]
+        self.lock.release()
+        self.logger.info('Client attached (%d clients)' % len(self.clients))
+
+    def detach(self, ch):
+        """ Detach a client. Returns the number of clients still attached. """
+        self.lock.acquire()
+        self.clients = [c for c in self.clients if c != ch]
+        nclients = len(self.clients)
+        self.lock.release()
+        self.logger.info('Client detached (%d clients)' % nclients)
+        return nclients
+
+    @property
+    def clock(self):
+        """ Clock synchronization of the first client attached, used for
+        markers that don't arrive through a client connection. """
+        clients = self.clients
+        return clients[0].clock if clients else None
+
+    def stop(self):
+        """ Stop the classifier and recording device concurrently. """
+        stop_concurrently([self.classifier, self.recorder])
+        self.classifier = None
+        self.recorder = None
+
+        for thread in self.stopping:
+            thread.join()
+        self.stopping = []
+
+    def _stop_in_background(self, component):
+        """ Stop a recorder or classifier that is being replaced. Stopping
+        waits for its threads to finish, which can take a while, and the
+        server's main loop serves all sessions. """
+        thread = threading.Thread(target=component.stop)
+        thread.start()
+        self.stopping = [t for t in self.stopping if t.isAlive()] + [thread]
+
+    def provide_devices(self):
+        return eegdevices.available_devices.available()
+
+    def set_device(self, name):
+        if not name in eegdevices.available_devices:
+            raise EngineException(101, 'Recording device not available')
+
+        try:
+            device = eegdevices.available_devices[name]
+        except Exception as e:
+            raise EngineException(101, 'Recording device not available: %s' % e)
+
+        try:
+            if self.recorder:
+                self.logger.info('Switching device.')
+                self._stop_in_background(self.recorder)
+            self.recorder = device()
+            self.recorder.output_dir = self.output_dir
+            self.logger.info('Selected device: %s.' % name)
+
+            for ch in self.clients:
+                ch.attach_recorder(self.recorder)
+        except IOError as e:
+            raise EngineException(202, e.strerror)
+
+    def open_device(self):
+        if not self.recorder:
+            raise EngineException(102, 'Please specify a recording device first')
+        self.logger.info('Opening device.')
+
+        if not self.recorder.running:
+            self.recorder.start()
+        else:
+            print 'Device already opened'
+
+        if self.classifier and not self.classifier.running:
+            self.classifier.start()
+
+    def provide_classifiers(self):
+        return classifiers.available_classifiers.keys()
+
+    def set_classifier(self, name):
+        if not self.recorder:
+            raise EngineException(201, 'Please specify a recording device first')
+        if not name in classifiers.available_classifiers:
+            raise EngineException(202, 'Classifier not available')
+
+        try:
+            classifier = classifiers.available_classifiers[name]
+        except Exception as e:
+            raise EngineException(202, 'Classifier not available: %s' % e)
+
+        if self.classifier:
+            self.logger.info('Switching classifier.')
+            self._stop_in_background(self.classifier)
+
+        self.logger.info('Loading classifier: ' + name)
+        self.classifier = classifier(self, self.recorder)
+        self.classifier_name = name
+
+        if self.recorder.running:
+            self.classifier.start()
+
+    def _model_path(self, name):
+        if not valid_model_name(name):
+            raise EngineException(207, 'Model names may only contain letters, digits, - and _')
+        return os.path.join(self.model_dir, name + '.model')
+
+    def save_classifier(self, name):
+        if not self.classifier:
+            raise EngineException(302, 'Please specify a classifier first')
+
+        path = self._model_path(name)
+        if not os.path.isdir(self.model_dir):
+            os.makedirs(self.model_dir)
+        self.classifier.save_model(path, self.classifier_name)
+
+    def load_classifier(self, name):
+        """ Load a saved classifier, selecting the classifier it was saved
+        from first if needed. """
+        if not self.recorder:
+            raise EngineException(301, 'Please specify a recording device first')
+
+        path = self._model_path(name)
+        if not os.path.isfile(path):
+            raise EngineException(208, 'Model not found')
+
+        from classifiers.classifier import read_model
+        model = read_model(path)
+        if self.classifier_name != model['classifier']:
+            self.set_classifier(model['classifier'])
+
+        self.logger.info('Loading model: ' + name)
+        self.classifier.load_model(model)
+
+    def set_device_parameter(self, name, values):
+        if not self.recorder:
+            raise EngineException(301, 'Please specify a recording device first')
+
+        if not self.recorder.set_parameter(name, values):
+            raise EngineException(303, 'Unknown device parameter')
+
+    def get_device_parameter(self, name):
+        if not self.recorder:
+            raise EngineException(301, 'Please specify a recording device first')
+
+        value = self.recorder.get_parameter(name)
+        if value is None or value is False:
+            raise EngineException(303, 'Unknown device parameter')
+        return value
+
+    def set_classifier_parameter(self, name, values):
+        if not self.classifier:
+            raise EngineException(302, 'Please specify a classifier first')
+
+        if not self.classifier.set_parameter(name, values):
+            raise EngineException(304, 'Unknown classifier parameter')
+
+    def get_classifier_parameter(self, name):
+        if not self.classifier:
+            raise EngineException(302, 'Please specify a classifier first')
+
+        value = self.classifier.get_parameter(name)
+        if value is None or value is False:
+            raise EngineException(304, 'Unknown classifier parameter')
+        return value
+
+    def set_mode(self, mode):
+        if mode != 'idle' and mode != 'data-collect' and mode != 'training' and mode != 'application':
+            raise EngineException(401, 'Invalid mode requested')
+        if not self.classifier:
+            raise EngineException(402, 'Please specify a classifier first')
+
+        self.classifier.change_state(mode)
+
+    def get_mode(self):
+        if not self.classifier:
+            raise EngineException(402, 'Please specify a classifier first')
+        return self.classifier.state
+
+    def provide_mode(self, mode):
+        for ch in self.clients:
+            ch.provide_mode(mode)
+
+    def set_marker(self, code, type, timestamp):
+        if not self.recorder:
+            raise EngineException(301, 'Please specify a recording device first')
+
+        self.recorder.set_marker(code, type, timestamp)
+
+    def set_markers(self, markers):
+        if not self.recorder:
+            raise EngineException(301, 'Please specify a recording device first')
+
+        self.recorder.set_markers(markers)
+
+    def provide_result(self, result, timestamp=None, coalesce=False):
+        for ch in self.clients:
+            ch.provide_result(result, timestamp, coalesce)
+
+    def provide_results(self, results, timestamps, coalesce=False):
+        for ch in self.clients:
+            ch.provide_results(results, timestamps, coalesce)
+
+    def provide_debug_image(self, data):
+        for ch in self.clients:
+            ch.provide_debug_image(data)
+
+    def provide_progress(self, fraction, elapsed, remaining):
+        for ch in self.clients:
+            ch.provide_progress(fraction, elapsed, remaining)
+
+    def error(self, e):
+        for ch in self.clients:
+            ch.error(e)
+
+    def get_stats(self):
+        """ Returns a list of (name, value) pairs describing the state of the
+        recording device and classifier, each name prefixed by the subsystem.
+        """
+        stats = [('session.clients', len(self.clients))]
+        for prefix, component in [('device', self.recorder),
+                                  ('classifier', self.classifier)]:
+            if component:
+                stats += [('%s.%s' % (prefix, name), value)
+                          for name, value in component.get_stats()]
+        return stats
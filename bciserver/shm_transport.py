@@ -0,0 +1,392 @@
+import os
+import mmap
+import numbers
+import socket
+import struct
+import logging
+import tempfile
+import threading
+
+import numpy
+
+from eegdevices import precision_timer
+
+# Layout of the shared memory file, all values little endian:
+#
+#   header (64 bytes):
+#     4 bytes  magic 'BCIS'
+#     uint32   version
+#     uint32   capacity of the ring, in bytes
+#     uint32   update counter, odd while the writer is updating the header
+#     uint64   write position: total number of bytes written to the ring
+#     uint64   total number of records written
+#     uint32   doorbell request: set to 1 by a reader about to wait for the
+#              doorbell, cleared by the writer when it rings
+#     uint32   reserved
+#     uint64   reserved position: the write position the record that is
+#              being written will end at, published before it is copied
+#
+#   ring (capacity bytes), containing records aligned on 16 bytes:
+#     uint16   kind of record, see KIND_* below
+#     uint16   reserved
+#     uint32   length of the payload in bytes
+#     double   timestamp (server clock) at which the record was written
+#     payload
+#
+# A record never wraps around the end of the ring. When it doesn't fit, the
+# remainder of the ring is filled with a padding record and the record is
+# written at the start of the ring. The writer never waits for readers: a
+# reader that falls more than the capacity behind has lost records. A record
+# that is being read is also lost when the reserved position moves more than
+# the capacity past its start before the reader is done with it.
+#
+# To wait for new records, a reader sets the doorbell request, checks the
+# write position once more and then waits for the doorbell. The writer only
+# rings the doorbell when it is requested, so a busy reader costs nothing.
+HEADER = struct.Struct('<4sIIIQQIIQ')
+DOORBELL_OFFSET = 32
+RESERVED_OFFSET = 40
+HEADER_SIZE = 64
+RECORD = struct.Struct('<HHId')
+ALIGN = 16
+MAGIC = 'BCIS'
+VERSION = 2
+
+KIND_PADDING = 0
+KIND_RESULT = 1   # payload: double[n], the values of the result
+KIND_SAMPLES = 2  # payload: uint32 nchannels, uint32 nsamples,
+                  #          double[nsamples][nchannels + 2], each row holding
+                  #          the channels, the marker code and the timestamp
+
+SAMPLES_HEADER = struct.Struct('<II')
+
+_COUNTER = struct.Struct('<I')
+_UPDATE = struct.Struct('<IQQ')
+_POSITION = struct.Struct('<Q')
+
+def _aligned(size):
+    return (size + ALIGN - 1) // ALIGN * ALIGN
+
+class SharedRing:
+    """
+    Ring buffer in a memory mapped file, written by the server and read by any
+    number of processes on the same host.
+    """
+
+    def __init__(self, capacity=4*1024*1024):
+        self.capacity = _aligned(capacity)
+        self.lock = threading.Lock()
+
+        fd, self.path = tempfile.mkstemp(prefix='bciserver-', suffix='.shm')
+        self.file = os.fdopen(fd, 'w+b')
+        self.file.truncate(HEADER_SIZE + self.capacity)
+        self.file.flush()
+        self.map = mmap.mmap(self.file.fileno(), HEADER_SIZE + self.capacity)
+
+        self.counter = 0
+        self.position = 0
+        self.nrecords = 0
+        self._write_header()
+
+    def _write_header(self):
+        HEADER.pack_into(self.map, 0, MAGIC, VERSION, self.capacity,
+                         self.counter, self.position, self.nrecords, 0, 0,
+                         self.position)
+
+    def _reserve(self, end):
+        # Tell readers which part of the ring is about to be overwritten,
+        # before touching it
+        _COUNTER.pack_into(self.map, 12, self.counter + 1)
+        _POSITION.pack_into(self.map, RESERVED_OFFSET, end)
+        self.counter += 2
+        _COUNTER.pack_into(self.map, 12, self.counter)
+
+    def _publish(self):
+        # Readers retry when the counter is odd or changed while reading
+        _UPDATE.pack_into(self.map, 12, self.counter + 1, self.position, self.nrecords)
+        self.counter += 2
+        _COUNTER.pack_into(self.map, 12, self.counter)
+
+    def write(self, kind, payload, timestamp=None):
+        """ Append a record to the ring. Returns whether a reader requested
+        the doorbell to be rung. """
+        if timestamp == None:
+            timestamp = precision_timer()
+
+        size = _aligned(RECORD.size + len(payload))
+        if size > self.capacity // 2:
+            raise ValueError('record of %d bytes does not fit in the ring' % size)
+
+        self.lock.acquire()
+        try:
+            offset = self.position % self.capacity
+            padding = 0
+            if offset + size > self.capacity:
+                padding = self.capacity - offset
+            self._reserve(self.position + padding + size)
+
+            if padding:
+                RECORD.pack_into(self.map, HEADER_SIZE + offset, KIND_PADDING, 0,
+                                 padding - RECORD.size, timestamp)
+                self.position += padding
+                offset = 0
+
+            start = HEADER_SIZE + offset
+            record = RECORD.pack(kind, 0, len(payload), timestamp) + payload
+            self.map[start:start + len(record)] = record
+            self.position += size
+            self.nrecords += 1
+            self._publish()
+
+            requested = self.map[DOORBELL_OFFSET] != '\x00'
+            if requested:
+                self.map[DOORBELL_OFFSET] = '\x00'
+        finally:
+            self.lock.release()
+
+        return requested
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+class RingReader:
+    """
+    Reads the records from a SharedRing, usually in another process. Clients
+    written in other languages can follow the same procedure.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, 'r+b')
+        magic, version, self.capacity = HEADER.unpack(self.file.read(HEADER.size))[:3]
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('not a bciserver shared memory file')
+
+        self.map = mmap.mmap(self.file.fileno(), HEADER_SIZE + self.capacity)
+        self.position = self._read_position()
+        self.records_lost = 0
+
+    def _read_position(self):
+        return self._read_positions()[0]
+
+    def _read_positions(self):
+        """ The write position and the reserved position. """
+        while True:
+            counter1, position = struct.unpack_from('<IQ', self.map, 12)
+            reserved, = _POSITION.unpack_from(self.map, RESERVED_OFFSET)
+            counter2, = _COUNTER.unpack_from(self.map, 12)
+            if counter1 == counter2 and counter1 % 2 == 0:
+                return position, reserved
+
+    def request_doorbell(self):
+        """ Ask the writer to ring the doorbell on the next record. Returns
+        False if records are already waiting, in which case the doorbell may
+        not be rung. """
+        self.map[DOORBELL_OFFSET] = '\x01'
+        return self._read_position() == self.position
+
+    def read(self):
+        """ Returns a list of (kind, timestamp, payload) tuples for the records
+        written since the last call. """
+        start = self.position
+        end = self._read_position()
+        if end - start > self.capacity:
+            self.records_lost += 1
+            self.position = end
+            return []
+
+        records = []
+        position = start
+        while position < end:
+            offset = HEADER_SIZE + position % self.capacity
+            kind, _, length, timestamp = RECORD.unpack_from(self.map, offset)
+            if kind != KIND_PADDING:
+                payload = self.map[offset + RECORD.size:offset + RECORD.size + length]
+                records.append( (kind, timestamp, payload) )
+            position += _aligned(RECORD.size + length)
+
+        # Discard everything if the writer overtook us while reading. A record
+        # that is still being copied into the ring is not published yet, but
+        # the part of the ring it overwrites is already reserved.
+        latest, reserved = self._read_positions()
+        if reserved - start > self.capacity:
+            self.records_lost += 1
+            self.position = latest
+            return []
+
+        self.position = end
+        return records
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+class SharedMemoryTransport:
+    """
+    Publishes classification results, and optionally the EEG data, to a client
+    running on the same host through a SharedRing. After writing, the client
+    is notified by a 'doorbell': a small UDP datagram send to a port on the
+    loopback interface the client is listening on, whenever the client has
+    requested it (see RingReader.request_doorbell). A client can also simply
+    poll the ring.
+    """
+
+    def __init__(self, doorbell_port, capacity=4*1024*1024):
+        self.logger = logging.getLogger('SHM transport')
+        self.ring = SharedRing(capacity)
+        self.doorbell_address = ('127.0.0.1', doorbell_port)
+        self.doorbell = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.recorder = None
+        self.samples = False
+
+        self.results_published = 0
+        self.sample_blocks_published = 0
+
+    def attach(self, recorder):
+        """ Start publishing the data recorded by the given recorder. """
+        self.detach()
+        self.recorder = recorder
+        recorder.add_sink(self.publish_samples)
+
+    def detach(self):
+        """ Stop publishing recorded data. """
+        if self.recorder:
+            self.recorder.remove_sink(self.publish_samples)
+            self.recorder = None
+
+    def close(self):
+        self.detach()
+        self.doorbell.close()
+        self.ring.close()
+
+    def _ring_doorbell(self):
+        try:
+            self.doorbell.sendto('\x01', self.doorbell_address)
+        except socket.error as e:
+            self.logger.debug('Could not ring doorbell: %s' % e)
+
+    def publish_result(self, result, timestamp=None):
+        """ Publish a classification result. Returns False if the result is
+        not numeric and can not be published this way. """
+        if type(result) != list:
+            result = [result]
+        for x in result:
+            if not isinstance(x, numbers.Real):
+                return False
+
+        if self.ring.write(KIND_RESULT, struct.pack('<%dd' % len(result), *result),
+                           timestamp):
+            self._ring_doorbell()
+        self.results_published += 1
+        return True
+
+    def publish_samples(self, recorder, d):
+        """ Publish a block of recorded data, called by the recorder. """
+        block = numpy.empty((d.ninstances, d.nfeatures + 2), dtype='<f8')
+        block[:,:-2] = d.data.T
+        block[:,-2] = d.labels[0,:]
+        block[:,-1] = d.ids[0,:] + recorder.T0
+
+        if self.ring.write(KIND_SAMPLES,
+                           SAMPLES_HEADER.pack(d.nfeatures, d.ninstances) + block.tostring()):
+            self._ring_doorbell()
+        self.sample_blocks_published += 1
+
+if __name__ == '__main__':
+    # Compare delivering results to a local client through the ring with
+    # sending them as RESULT PROVIDE lines over a loopback TCP connection. The
+    # client is busy rendering frames and collects the results that arrived
+    # once per frame, as a stimulus presentation program would. Sample blocks
+    # are compared as well, using a text encoding on the TCP connection.
+    import time
+
+    nframes = 5000
+    results_per_frame = 4
+    result = [0.1, 0.5, 0.25, 0.15]
+
+    doorbell = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    doorbell.bind( ('127.0.0.1', 0) )
+    transport = SharedMemoryTransport(doorbell.getsockname()[1], capacity=64*1024*1024)
+    reader = RingReader(transport.ring.path)
+
+    t_server = t_client = 0
+    received = 0
+    for frame in range(nframes):
+        t = time.time()
+        for i in range(results_per_frame):
+            transport.publish_result(result)
+        t_server += time.time() - t
+
+        t = time.time()
+        for kind, timestamp, payload in reader.read():
+            struct.unpack('<%dd' % (len(payload) // 8), payload)
+            received += 1
+        t_client += time.time() - t
+
+    nresults = nframes * results_per_frame
+    print 'Shared memory: server %.1f us, client %.1f us per result (%d received, %d lost)' % (
+        1e6 * t_server / nresults, 1e6 * t_client / nresults, received, reader.records_lost)
+
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind( ('127.0.0.1', 0) )
+    server.listen(1)
+    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    client.connect(server.getsockname())
+    connection, address = server.accept()
+    connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    t_server = t_client = 0
+    received = 0
+    buf = ''
+    for frame in range(nframes):
+        t = time.time()
+        for i in range(results_per_frame):
+            connection.sendall('RESULT PROVIDE %s\r\n' % ' '.join([str(x) for x in result]))
+        t_server += time.time() - t
+
+        t = time.time()
+        while received < (frame + 1) * results_per_frame:
+            buf += client.recv(4096)
+            lines = buf.split('\r\n')
+            buf = lines[-1]
+            for line in lines[:-1]:
+                [float(x) for x in line.split()[2:]]
+                received += 1
+        t_client += time.time() - t
+
+    print 'TCP:           server %.1f us, client %.1f us per result' % (
+        1e6 * t_server / nresults, 1e6 * t_client / nresults)
+
+    # The same for blocks of 32 samples of 66 values (64 channels, marker code
+    # and timestamp), as published when the client asks for the EEG data.
+    nblocks = 2000
+    values = [float(x) for x in range(32 * 66)]
+    payload = SAMPLES_HEADER.pack(64, 32) + struct.pack('<%dd' % len(values), *values)
+
+    t = time.time()
+    for i in range(nblocks):
+        transport.ring.write(KIND_SAMPLES, payload)
+        for kind, timestamp, data in reader.read():
+            struct.unpack_from('<%dd' % len(values), data, SAMPLES_HEADER.size)
+    t_shm = time.time() - t
+
+    t = time.time()
+    for i in range(nblocks):
+        connection.sendall('SAMPLES %s\r\n' % ' '.join(['%f' % x for x in values]))
+        while not buf.endswith('\r\n'):
+            buf += client.recv(65536)
+        [float(x) for x in buf.split()[1:]]
+        buf = ''
+    t_tcp = time.time() - t
+
+    print 'Sample blocks: shared memory %.1f us, TCP %.1f us per block' % (
+        1e6 * t_shm / nblocks, 1e6 * t_tcp / nblocks)
+
+    for s in [client, connection, server, doorbell]:
+        s.close()
+    reader.close()
+    transport.close()
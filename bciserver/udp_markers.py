@@ -0,0 +1,260 @@
+import socket
+import struct
+import logging
+import threading
+
+from eegdevices import precision_timer
+
+# Layout of a marker datagram, all values in network byte order:
+#   header: magic 'BCIM', sequence number (uint32), number of markers (uint16)
+#   marker: type (uint8, 0=trigger, 1=switch), code (int32),
+#           timestamp (double, 0 means time of arrival)
+#
+# Datagrams for a named session start with magic 'BCIN' instead, followed by
+# the length of the session name (uint8) and the name, before the rest of the
+# header. Datagrams with magic 'BCIM' go to the default session.
+HEADER = struct.Struct('!4sIH')
+MARKER = struct.Struct('!Bid')
+MAGIC = 'BCIM'
+MAGIC_NAMED = 'BCIN'
+MARKER_TYPES = ['trigger', 'switch']
+
+def pack_markers(seq, markers, session=None):
+    """ Build a marker datagram. markers is a list of (code, type, timestamp)
+    tuples. When a session name is given, the markers go to that session
+    instead of the default one. """
+    if session == None:
+        data = [HEADER.pack(MAGIC, seq, len(markers))]
+    else:
+        data = [MAGIC_NAMED, chr(len(session)), session,
+                HEADER.pack(MAGIC_NAMED, seq, len(markers))[4:]]
+    for code, type, timestamp in markers:
+        data.append(MARKER.pack(MARKER_TYPES.index(type), code, timestamp))
+    return ''.join(data)
+
+def unpack_markers(data):
+    """ Parse a marker datagram. Returns the session name (None for the
+    default session), the sequence number and a list of (code, type,
+    timestamp) tuples. Raises ValueError for malformed data. """
+    session = None
+    if data[:4] == MAGIC_NAMED:
+        if len(data) < 5 or len(data) < 5 + ord(data[4]):
+            raise ValueError('datagram too short')
+        session = data[5:5 + ord(data[4])]
+        data = MAGIC + data[5 + len(session):]
+
+    if len(data) < HEADER.size:
+        raise ValueError('datagram too short')
+
+    magic, seq, nmarkers = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('invalid magic')
+    if len(data) != HEADER.size + nmarkers * MARKER.size:
+        raise ValueError('datagram length does not match number of markers')
+
+    markers = []
+    for i in range(nmarkers):
+        type, code, timestamp = MARKER.unpack_from(data, HEADER.size + i * MARKER.size)
+        if type >= len(MARKER_TYPES):
+            raise ValueError('invalid marker type')
+        markers.append( (code, MARKER_TYPES[type], timestamp) )
+
+    return session, seq, markers
+
+class MarkerListener(threading.Thread):
+    """
+    Receives markers as compact UDP datagrams and hands them straight to the
+    recorder of the session named in the datagram, or of the default session.
+    This path avoids the Nagle delays of the TCP connection and never waits
+    behind large messages. Sequence numbers are used to detect lost and
+    reordered datagrams, separately for each session. Timestamps are mapped
+    onto the server clock using the clock synchronization of the first client
+    attached to the session.
+    """
+
+    def __init__(self, engine, port, host=''):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.engine = engine
+        self.logger = logging.getLogger('UDP markers')
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind( (host, port) )
+        self.socket.settimeout(1)
+        self.port = self.socket.getsockname()[1]
+
+        self.running = False
+
+        # Next sequence number expected for each session
+        self.expected_seq = {}
+
+        # Counters
+        self.datagrams_received = 0
+        self.markers_received = 0
+        self.datagrams_lost = 0
+        self.datagrams_reordered = 0
+        self.datagrams_invalid = 0
+
+    def stop(self):
+        self.running = False
+        if self.isAlive():
+            self.join()
+        self.socket.close()
+
+    def run(self):
+        self.running = True
+        self.logger.info('Listening for markers on UDP port %d' % self.port)
+        while self.running:
+            try:
+                data, address = self.socket.recvfrom(65536)
+            except socket.timeout:
+                continue
+            except socket.error as e:
+                if self.running:
+                    self.logger.error('%s' % e)
+                break
+
+            arrival = precision_timer()
+            try:
+                session, seq, markers = unpack_markers(data)
+            except ValueError as e:
+                self.datagrams_invalid += 1
+                self.logger.warning('Ignoring invalid datagram from %s: %s' % (address[0], e))
+                continue
+
+            self._check_sequence(session, seq)
+            self.datagrams_received += 1
+            self.markers_received += len(markers)
+
+            try:
+                self._set_markers(session, markers, arrival)
+            except Exception as e:
+                self.logger.warning('Could not set markers: %s' % e)
+
+    def get_stats(self):
+        """ Returns a list of (name, value) pairs describing the listener. """
+        return [('datagrams_received', self.datagrams_received),
+                ('markers_received', self.markers_received),
+                ('datagrams_lost', self.datagrams_lost),
+                ('datagrams_reordered', self.datagrams_reordered),
+                ('datagrams_invalid', self.datagrams_invalid)]
+
+    def _check_sequence(self, session, seq):
+        expected_seq = self.expected_seq.get(session)
+        if seq == 0 or expected_seq == None:
+            # Start of a new stream
+            pass
+        elif seq > expected_seq:
+            self.datagrams_lost += seq - expected_seq
+            self.logger.warning('Lost %d marker datagram(s) before #%d' % (seq - expected_seq, seq))
+        elif seq < expected_seq:
+            self.datagrams_reordered += 1
+            self.logger.warning('Marker datagram #%d arrived out of order' % seq)
+            return
+
+        self.expected_seq[session] = seq + 1
+
+    def _set_markers(self, name, markers, arrival):
+        session = self.engine.get_marker_session(name)
+        if not session:
+            self.logger.warning('Ignoring markers, no session named %s' % name)
+            return
+        recorder = session.recorder
+        if not recorder:
+            self.logger.warning('Ignoring markers, no recording device selected')
+            return
+
+        clock = session.clock
+
+        mapped = []
+        for code, type, timestamp in markers:
+            if timestamp == 0:
+                timestamp = arrival
+            elif clock:
+                timestamp = clock.to_server_time(timestamp)
+            mapped.append( (code, type, timestamp) )
+
+        if len(mapped) == 1:
+            code, type, timestamp = mapped[0]
+            recorder.set_marker(code, type, timestamp)
+        else:
+            recorder.set_markers(mapped)
+
+if __name__ == '__main__':
+    # Loopback test comparing the arrival jitter of markers send over the TCP
+    # protocol connection with markers send as UDP datagrams. Markers are send
+    # at 20 Hz, as by a fast P300 speller, while the TCP connection is also
+    # carrying a large message now and then.
+    import time
+    import numpy
+
+    nmarkers = 400
+    interval = 0.05
+
+    class Recorder:
+        def __init__(self):
+            self.delays = []
+        def set_marker(self, code, type, timestamp):
+            self.delays.append(precision_timer() - timestamp)
+
+    class Session:
+        def __init__(self):
+            self.recorder = Recorder()
+            self.clock = None
+
+    class Engine:
+        def __init__(self):
+            self.session = Session()
+        def get_marker_session(self, name=None):
+            return self.session
+
+    # UDP path
+    engine = Engine()
+    listener = MarkerListener(engine, 0, '127.0.0.1')
+    listener.start()
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for seq in range(nmarkers):
+        sender.sendto(pack_markers(seq, [(1, 'trigger', precision_timer())]),
+                      ('127.0.0.1', listener.port))
+        time.sleep(interval)
+    time.sleep(0.2)
+    listener.stop()
+    udp_delays = numpy.array(engine.session.recorder.delays)
+
+    # TCP path, lines are parsed as the ClientHandler would
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind( ('127.0.0.1', 0) )
+    server.listen(1)
+    client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    client.connect(server.getsockname())
+    connection, address = server.accept()
+
+    tcp_delays = []
+    def receive():
+        buf = ''
+        while len(tcp_delays) < nmarkers:
+            buf += connection.recv(65536)
+            lines = buf.split('\n')
+            buf = lines[-1]
+            for line in lines[:-1]:
+                if line.startswith('MARKER'):
+                    tcp_delays.append(precision_timer() - float(line.split()[3]))
+    receiver = threading.Thread(target=receive)
+    receiver.start()
+
+    for i in range(nmarkers):
+        if i % 50 == 25:
+            client.sendall('PING "%s"\r\n' % ('x' * 500000))
+        client.sendall('MARKER trigger 1 %f\r\n' % precision_timer())
+        time.sleep(interval)
+    receiver.join()
+    client.close()
+    connection.close()
+    server.close()
+    tcp_delays = numpy.array(tcp_delays)
+
+    for name, delays in [('TCP', tcp_delays), ('UDP', udp_delays)]:
+        print '%s: %d markers, mean delay %.3f ms, jitter (std) %.3f ms, max %.3f ms' % (
+            name, len(delays), 1000 * numpy.mean(delays),
+            1000 * numpy.std(delays), 1000 * numpy.max(delays))
+    print 'UDP datagrams lost: %d' % listener.datagrams_lost
@@ -0,0 +1,173 @@
+'''
+Compares the training of the P300 classifier, train_averaged_svm, with the
+training it replaced: a LinearSVC fitted on Blowup(100) averages, with C
+selected by GridSearchCV. Both are trained on simulated P300 trials.
+
+Each is scored in two ways:
+  - cross-validated accuracy: the instances are split in 5 folds, each path is
+    trained (including its selection of C) on 4 of them and tested on the
+    plain averages of the fifth. This is what the classifier sees in
+    application mode.
+  - selection accuracy: the fraction of blocks of a separate recording, of
+    the same subject, in which the target gets the highest score, using the
+    averages of the first 1, 3 and 10 repetitions.
+
+The channels of the simulated subject differ in noise level, as real EEG
+channels do.
+
+Both are also cross-validated on the trials the P300 classifier extracts
+from the recording of benchmarks/p300_trials.py, shortened to 10 minutes,
+with a P300 response added after each stimulus of the target: 32 channels of
+128 samples and 10 repetitions. This takes over an hour.
+
+Run from any directory, with bciserver installed:
+    python benchmarks/p300_training.py
+'''
+import time
+import logging
+import warnings
+
+import numpy
+import sklearn.svm
+import sklearn.grid_search
+import sklearn.cross_validation
+
+import p300_trials
+from bciserver.classifiers.p300 import P300
+from bciserver.classifiers.training import train_averaged_svm
+
+C_VALUES = numpy.logspace(-3, 5, 10)
+
+def erp(amplitude, num_channels, num_samples=128):
+    """ The simulated P300 response: a positive peak at 350 ms, preceded by
+    a smaller negative one, growing over the channels. """
+    t = numpy.arange(num_samples) / 128.0
+    shape = (numpy.exp(-(t - 0.35) ** 2 / (2 * 0.06 ** 2)) -
+             0.5 * numpy.exp(-(t - 0.2) ** 2 / (2 * 0.03 ** 2)))
+    return amplitude * numpy.outer(numpy.linspace(0.3, 1.0, num_channels), shape)
+
+def simulate(num_blocks, subject, seed, amplitude, spread, num_options=7,
+             num_repetitions=10, num_channels=8, num_samples=128):
+    """ Simulates the trials of a P300 recording, in microvolts. The mixing
+    of the noise, the noise level and offset of each channel are determined
+    by the subject. Returns the trials as an array of shape (features,
+    repetitions, instances), the class of each instance (0 for the target)
+    and the block of each instance. """
+    subject_rng = numpy.random.RandomState(1000 + subject)
+    mixing = numpy.eye(num_channels) + 0.3 * subject_rng.randn(num_channels, num_channels)
+    gains = numpy.exp(spread * subject_rng.randn(num_channels))
+    offsets = 5 * subject_rng.randn(num_channels)
+
+    rng = numpy.random.RandomState(seed)
+    template = erp(amplitude, num_channels, num_samples)
+
+    num_instances = num_blocks * num_options
+    y = numpy.ones(num_instances, dtype=int)
+    y[numpy.arange(num_blocks) * num_options + rng.randint(num_options, size=num_blocks)] = 0
+    blocks = numpy.repeat(numpy.arange(num_blocks), num_options)
+
+    # Smooth noise, mixed over the channels
+    kernel = numpy.hanning(9)
+    kernel /= numpy.sqrt(numpy.sum(kernel ** 2))
+    white = rng.randn(num_channels, num_samples + 8, num_repetitions, num_instances)
+    smooth = numpy.apply_along_axis(numpy.convolve, 1, white, kernel, 'valid')
+    noise = numpy.tensordot(mixing, smooth, axes=(1, 0))
+
+    X = 10 * gains[:,numpy.newaxis,numpy.newaxis,numpy.newaxis] * noise
+    X += offsets[:,numpy.newaxis,numpy.newaxis,numpy.newaxis]
+    X[:,:,:,y == 0] += template[:,:,numpy.newaxis,numpy.newaxis]
+    return X.reshape(-1, num_repetitions, num_instances), y, blocks
+
+def trials_recording(minutes, amplitude, seed=0):
+    """ The recording of benchmarks/p300_trials.py, white noise with unit
+    variance, with a P300 response added after each stimulus of the target,
+    cut into trials by the P300 classifier. Returns the trials as an array of shape (features,
+    repetitions, instances) and the class of each instance (0 for the
+    target). """
+    num_options, num_repetitions = 7, 10
+    d = p300_trials.simulate(num_options, num_repetitions, minutes, seed)
+    X = d.data.copy()
+    template = erp(amplitude, X.shape[0])
+
+    target = None
+    previous = 0
+    for i, label in enumerate(d.labels[0]):
+        if label > 100:
+            target = label - 100
+        elif label != previous and label == target and i + template.shape[1] <= X.shape[1]:
+            X[:,i:i + template.shape[1]] += template
+        previous = label
+    d.data = X
+
+    p300 = P300(None, p300_trials.Recorder(), num_repetitions=num_repetitions, num_options=num_options)
+    p300.logger.setLevel(logging.ERROR)
+    trials = p300._extract_training_trials(d)
+    valid = numpy.sum(trials.Y, axis=0) > 0
+    return trials.data.reshape(-1, num_repetitions, trials.ninstances)[:,:,valid], trials.y[valid]
+
+def train_blowup(X, y, seed=0):
+    """ The training train_averaged_svm replaced. Returns a function that
+    scores averages, higher for the target. """
+    rng = numpy.random.RandomState(seed)
+    num_features, num_repetitions, num_instances = X.shape
+    averages = numpy.empty((num_instances, 100, num_features))
+    for instance in range(num_instances):
+        draws = rng.randint(num_repetitions, size=(100, num_repetitions))
+        averages[instance] = numpy.mean(X[:,draws,instance], axis=2).T
+    search = sklearn.grid_search.GridSearchCV(sklearn.svm.LinearSVC(), {'C': C_VALUES}, cv=5)
+    search.fit(averages.reshape(-1, num_features), numpy.repeat(y, 100))
+    return lambda means: -search.decision_function(means)
+
+def train_sgd(X, y):
+    """ Trains with train_averaged_svm, with the settings of the P300
+    classifier. Returns a function that scores averages, higher for the
+    target. """
+    classifier = train_averaged_svm(X, y, 100, C_VALUES, 5, -1)[0]
+    return lambda means: -(numpy.dot(means, classifier.coef) + classifier.intercept)
+
+def cross_validate(train, X, y):
+    """ Accuracy on the plain averages of held out instances. """
+    correct = 0
+    for train_instances, test_instances in sklearn.cross_validation.StratifiedKFold(y, 5):
+        score = train(X[:,:,train_instances], y[train_instances])
+        predicted = numpy.where(score(numpy.mean(X[:,:,test_instances], axis=1).T) > 0, 0, 1)
+        correct += numpy.sum(predicted == y[test_instances])
+    return correct / float(len(y))
+
+def selection_accuracy(score, X, y, blocks, num_repetitions):
+    """ Fraction of blocks in which the target gets the highest score. """
+    scores = score(numpy.mean(X[:,:num_repetitions], axis=1).T)
+    correct = 0
+    for block in numpy.unique(blocks):
+        instances = numpy.flatnonzero(blocks == block)
+        correct += y[instances[numpy.argmax(scores[instances])]] == 0
+    return correct / float(len(numpy.unique(blocks)))
+
+if __name__ == '__main__':
+    warnings.simplefilter('ignore')
+    print 'amplitude spread subject  path     time  C.V. acc.  selection (1, 3, 10 rep.)'
+    for amplitude, spread in [(4.0, 0.0), (2.0, 1.0)]:
+        for subject in [1, 2]:
+            X, y, blocks = simulate(20, subject, subject, amplitude, spread)
+            X_test, y_test, blocks_test = simulate(200, subject, subject + 100, amplitude, spread)
+            for name, train in [('blowup', train_blowup), ('sgd', train_sgd)]:
+                start_time = time.time()
+                score = train(X, y)
+                train_time = time.time() - start_time
+                accuracy = cross_validate(train, X, y)
+                selection = [selection_accuracy(score, X_test, y_test, blocks_test, n)
+                             for n in [1, 3, 10]]
+                print '%9.1f %6.1f %7d  %-6s %5.0fs  %9.3f  %.3f %.3f %.3f' % (
+                    (amplitude, spread, subject, name, train_time, accuracy) + tuple(selection))
+
+    print
+    print 'p300_trials recording, 10 minutes'
+    print 'amplitude  path   C.V. time  C.V. acc.  majority'
+    logging.getLogger('psychic').setLevel(logging.ERROR)
+    for amplitude in [0.1, 0.15, 0.2]:
+        X, y = trials_recording(10, amplitude)
+        for name, train in [('blowup', train_blowup), ('sgd', train_sgd)]:
+            start_time = time.time()
+            accuracy = cross_validate(train, X, y)
+            print '%9.2f  %-6s %8.0fs  %9.3f  %8.3f' % (
+                amplitude, name, time.time() - start_time, accuracy, numpy.mean(y == 1))
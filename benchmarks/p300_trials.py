@@ -0,0 +1,136 @@
+'''
+Compares P300._extract_training_trials with the implementation it replaced,
+which sliced each block with psychic.slice, on a simulated 30 minute
+recording of 32 channels at 128 Hz. Checks that both produce the same trials
+and labels, and times them.
+
+Stimulus markers are held for 1 to 3 samples, as happens with 'switch'
+markers, and some stimuli are dropped, so some options miss repetitions in
+some blocks.
+
+Run from any directory, with bciserver installed:
+    python benchmarks/p300_trials.py
+'''
+import time
+import logging
+
+import numpy
+import psychic
+
+from bciserver.classifiers.p300 import P300
+from bciserver.bci_exceptions import ClassifierException
+
+def extract_with_slice(self, d):
+    """ P300._extract_training_trials as it was before it used a single
+    gather. """
+    block_onsets = numpy.flatnonzero(d.Y > 100)
+    num_blocks = len(block_onsets)
+    if not num_blocks:
+        raise ClassifierException('No blocks found in recording. Make sure the data is properly labeled.')
+
+    block_lengths = numpy.hstack( (numpy.diff(block_onsets), d.ninstances-block_onsets[-1]) )
+    targets = d.Y[0,block_onsets] - 100
+    options = numpy.unique(targets)
+    num_options = len(options)
+    num_instances = num_blocks * num_options
+    num_channels = d.nfeatures
+
+    mdict = {}
+    for target in sorted(numpy.unique(targets)):
+        mdict[target] = 'target %02d' % target
+
+    # Allocate memory for the blocks
+    feat_dim_lab = ['channels', 'samples', 'repetitions']
+    feat_shape = (num_channels, self.target_window[1]-self.target_window[0], self.num_repetitions)
+    X = numpy.zeros(feat_shape + (num_instances,))
+    Y = numpy.zeros((2,num_instances))
+    I = numpy.arange(num_instances)
+
+    # Extract each block
+    for block_num,block_onset,block_length,target in zip(range(num_blocks), block_onsets, block_lengths, targets):
+        block = d[block_onset : block_onset+block_length+self.target_sample_rate]
+        block = psychic.slice(block, mdict, self.target_window)
+
+        # Extract each option within a block
+        for option_num in range(block.nclasses):
+            if block.get_class(option_num).ndX.shape[2] < self.num_repetitions:
+                continue
+            instance = block_num*num_options+option_num
+            X[:,:,:,instance] = block.get_class(option_num).ndX[:,:,:self.num_repetitions]
+            Y[0,instance] = (option_num == (target-1)) # target trial
+            Y[1,instance] = (option_num != (target-1)) # nontarget trial
+
+    # Build new dataset containing the trials
+    return psychic.DataSet(data=X, labels=Y, ids=I,
+                           feat_dim_lab=feat_dim_lab,
+                           l_lab=['target', 'nontarget'])
+
+class Recorder:
+    sample_rate = 128
+
+def simulate(num_options, num_repetitions, minutes, seed=0):
+    """ Simulates a recording of P300 blocks. Each block starts with a marker
+    100 + target, followed by the stimuli of all options in random order,
+    num_repetitions times. """
+    rng = numpy.random.RandomState(seed)
+    soa = 25 # samples between stimuli
+    pause = 256 # samples between the block marker and the first stimulus
+    nsamples = minutes * 60 * Recorder.sample_rate
+
+    labels = numpy.zeros(nsamples)
+    onset = 0
+    while True:
+        block_length = num_options * num_repetitions * soa + pause
+        if onset + block_length + Recorder.sample_rate > nsamples:
+            break
+        labels[onset] = 100 + rng.randint(1, num_options + 1)
+        stimuli = numpy.hstack([rng.permutation(num_options) + 1
+                                for i in range(num_repetitions)])
+        for i, stimulus in enumerate(stimuli):
+            if rng.rand() < 0.005:
+                continue # dropped stimulus
+            stimulus_onset = onset + pause + soa * i
+            labels[stimulus_onset:stimulus_onset + rng.randint(1, 4)] = stimulus
+        onset += block_length
+
+    return psychic.DataSet(data=rng.randn(32, nsamples),
+                           labels=labels[numpy.newaxis,:],
+                           ids=numpy.arange(nsamples) / float(Recorder.sample_rate))
+
+def compare(d, num_options, num_repetitions):
+    p300 = P300(None, Recorder(), num_repetitions=num_repetitions, num_options=num_options)
+    p300.logger.setLevel(logging.ERROR)
+
+    t = time.time()
+    d_slice = extract_with_slice(p300, d)
+    t_slice = time.time() - t
+
+    t = time.time()
+    d_gather = p300._extract_training_trials(d)
+    t_gather = time.time() - t
+
+    same_trials = numpy.array_equal(d_slice.data, d_gather.data)
+    same_labels = numpy.array_equal(d_slice.labels, d_gather.labels)
+    return t_slice, t_gather, d_gather, same_trials, same_labels
+
+if __name__ == '__main__':
+    logging.getLogger('psychic').setLevel(logging.ERROR)
+    num_options = 7
+    num_repetitions = 10
+
+    d = simulate(num_options, num_repetitions, 30)
+    t_slice, t_gather, d_gather, same_trials, same_labels = compare(d, num_options, num_repetitions)
+    valid = numpy.sum(d_gather.Y, axis=0) > 0
+    print '%d blocks of %d options, %d incomplete: psychic.slice %.3f s, gather %.3f s (%.0fx)' % (
+        d_gather.ninstances // num_options, num_options, numpy.sum(~valid),
+        t_slice, t_gather, t_slice / t_gather)
+    print 'Same trials: %s, same labels: %s' % (same_trials, same_labels)
+
+    # Option 3 is never the target. The old implementation labeled the
+    # options by their position among the target codes, so in this case it
+    # marks the wrong option as the target. The new one labels by code.
+    labels = d.labels.copy()
+    labels[labels == 103] = 104
+    d.labels = labels
+    t_slice, t_gather, d_gather, same_trials, same_labels = compare(d, num_options, num_repetitions)
+    print 'Option never the target: same trials: %s, same labels: %s' % (same_trials, same_labels)
@@ -0,0 +1,115 @@
+'''
+Compares SlidingSSVEPScorer, which the SSVEP classifier uses when the
+'incremental' parameter is set, with the nodes it replaces:
+psychic.nodes.OnlineSlidingWindow followed by psychic.nodes.CanonCorr or
+psychic.nodes.MNEC. The data contains a 12 Hz SSVEP response in noise and is
+send in chunks of 1/20 second, like the EEG devices do.
+
+For 'canoncorr', both compute the canonical correlations of the same windows,
+so they should only differ by rounding errors. For 'mnec' the scores differ:
+the scorer estimates the noise from the energy of the channels after removing
+the references, while psychic.nodes.MNEC fits an AR model to it. The script
+reports how often both pick the same frequency.
+
+The scorer is also compared with computing the covariances of each window
+from scratch and scoring them the same way, which shows the effect of the
+running totals alone.
+
+Run from any directory, with bciserver installed:
+    python benchmarks/ssvep_sliding.py
+'''
+import time
+
+import numpy
+import psychic
+
+from bciserver.classifiers.sliding import SlidingSSVEPScorer
+
+SAMPLE_RATE = 200
+FREQS = [60/4., 60/5., 60/6., 60/7.]
+NHARMONICS = 3
+
+def simulate(nchannels, minutes, seed=0):
+    """ Returns the chunks of a recording with a response to the second
+    frequency. """
+    rng = numpy.random.RandomState(seed)
+    nsamples = minutes * 60 * SAMPLE_RATE
+    chunk = SAMPLE_RATE // 20
+    t = numpy.arange(nsamples) / float(SAMPLE_RATE)
+    data = rng.randn(nchannels, nsamples) + 0.5 * numpy.sin(2 * numpy.pi * FREQS[1] * t)
+    ids = numpy.atleast_2d(t)
+    return [psychic.DataSet(data=data[:,i:i + chunk], labels=numpy.zeros((1, chunk)),
+                            ids=ids[:,i:i + chunk])
+            for i in range(0, nsamples, chunk)]
+
+def scores(d):
+    """ The scores of each window, as the SSVEP classifier reads them. """
+    return numpy.array([d.data[:,i].ravel() for i in range(d.ninstances)]).T
+
+def run_psychic(method, chunks, window_size, window_step):
+    window = psychic.nodes.OnlineSlidingWindow(window_size, window_step, ref_point=1.0)
+    if method == 'mnec':
+        node = psychic.nodes.MNEC(SAMPLE_RATE, FREQS, NHARMONICS, nsamples=window_size)
+    else:
+        node = psychic.nodes.CanonCorr(SAMPLE_RATE, FREQS, NHARMONICS, nsamples=window_size)
+    node.train_(None)
+
+    results = []
+    for d in chunks:
+        windows = window.apply(d)
+        if windows.ninstances > 0:
+            results.append(scores(node.apply(windows)))
+    return numpy.hstack(results)
+
+def run_scorer(method, chunks, window_size, window_step):
+    scorer = SlidingSSVEPScorer(method, SAMPLE_RATE, FREQS, NHARMONICS, window_size, window_step)
+    return numpy.hstack([scorer.apply_(d).data for d in chunks])
+
+def run_scratch(method, chunks, window_size, window_step):
+    """ Computes the covariances of each window from scratch after collecting
+    it, as OnlineSlidingWindow does, and scores them like the scorer. """
+    scorer = SlidingSSVEPScorer(method, SAMPLE_RATE, FREQS, NHARMONICS, window_size, window_step)
+    Y = scorer._references(0, sum([d.ninstances for d in chunks]))
+    results = []
+    buf = numpy.zeros((chunks[0].nfeatures, 0))
+    position = 0
+    next_window = window_size
+    for d in chunks:
+        buf = numpy.hstack( (buf, d.data) )[:,-window_size:]
+        position += d.ninstances
+        if position < next_window:
+            continue
+        next_window += window_step
+        X = buf - numpy.mean(buf, axis=1)[:,numpy.newaxis]
+        Yw = Y[:,position - window_size:position]
+        Yw = Yw - numpy.mean(Yw, axis=1)[:,numpy.newaxis]
+        results.append(scorer.score(numpy.dot(X, X.T), numpy.dot(X, Yw.T), numpy.dot(Yw, Yw.T)))
+    return numpy.array(results).T
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, (time.time() - start) / result.shape[1]
+
+if __name__ == '__main__':
+    # The first configuration is the default of the SSVEP classifier
+    for nchannels, window_size, window_step in [(8, 2.0, 0.5), (8, 4.0, 0.1), (32, 4.0, 0.5)]:
+        chunks = simulate(nchannels, 10)
+        window_size = int(window_size * SAMPLE_RATE)
+        window_step = int(window_step * SAMPLE_RATE)
+        for method in ['canoncorr', 'mnec']:
+            reference, t_psychic = timed(run_psychic, method, chunks, window_size, window_step)
+            incremental, t_incremental = timed(run_scorer, method, chunks, window_size, window_step)
+            scratch, t_scratch = timed(run_scratch, method, chunks, window_size, window_step)
+
+            print '%2d channels, %3d sample windows, step %3d, %-9s: psychic %.3f ms, incremental %.3f ms, from scratch %.3f ms per window' % (
+                nchannels, window_size, window_step, method,
+                1000 * t_psychic, 1000 * t_incremental, 1000 * t_scratch)
+            if reference.shape != incremental.shape:
+                print '    different number of windows: psychic %d, incremental %d' % (
+                    reference.shape[1], incremental.shape[1])
+                continue
+            print '    max difference with psychic %g, same frequency picked in %.1f%% of the windows, max difference with from scratch %g' % (
+                numpy.max(numpy.abs(incremental - reference)),
+                100 * numpy.mean(numpy.argmax(incremental, axis=0) == numpy.argmax(reference, axis=0)),
+                numpy.max(numpy.abs(incremental - scratch)))
@@ -4,8 +4,8 @@ import cProfile
 import bciserver
 import time
 import numpy as np
-import scipy.signal
 import psychic
+from bciserver.classifiers.filters import OnlineSOSFilter
 import argparse
 
 class ERPPlotter():
@@ -22,9 +22,8 @@ class ERPPlotter():
         ax.yaxis.grid(True)
         plt.title('EEG signal')
 
-        self.filt = psychic.nodes.OnlineFilter(None)
-        self.filt.fs = r.sample_rate
-        self.filt.filter = scipy.signal.iirfilter(3, [0.1/(r.sample_rate/2.0), 40/(r.sample_rate/2.0)])
+        self.filt = OnlineSOSFilter(3, [0.1, 40])
+        self.filt.design(r.sample_rate)
 
     def setup(self):
         self.lines = []
@@ -57,9 +56,9 @@ parser.add_argument('-b', '--bdf-file', metavar='File', default=None, help='BDF
 args = parser.parse_args()
 
 if args.device == 'epoc':
-    r = bciserver.eegdevices.EPOC(buffer_size_seconds=0.1, bdf_file=args.bdf_file)
+    r = bciserver.eegdevices.available_devices['epoc'](buffer_size_seconds=0.1, bdf_file=args.bdf_file)
 elif args.device == 'biosemi':
-    r = bciserver.eegdevices.BIOSEMI(buffer_size_seconds=0.1, reference_channels=['EXG1', 'EXG2'], bdf_file=args.bdf_file)
+    r = bciserver.eegdevices.available_devices['biosemi'](buffer_size_seconds=0.1, reference_channels=['EXG1', 'EXG2'], bdf_file=args.bdf_file)
 elif args.device == 'emulator':
     r = bciserver.eegdevices.Emulator(buffer_size_seconds=0.1, bdf_file=args.bdf_file)
 